@@ -0,0 +1,298 @@
+"""
+Heap allocation per command, checked against budgets.
+
+    python -m benchmarks.alloc_bench --check
+    python -m benchmarks.alloc_bench --update
+
+Every command runs through the layer named by its prefix (hid.send,
+hid.receive, ctaphid.process or cbor.process) against an in-memory HID
+device and a RAM storage backend. Budgets are kept per interpreter version
+(allocations differ between CPython releases) and measuring method in
+alloc_budgets.json next to this file; --check fails when a command allocates
+more bytes or leaks more objects than its budget, --update rewrites the
+budgets of the current interpreter and method from a fresh run with some
+headroom. Interpreters without budgets are not checked. A command leaks when
+objects it allocates are still alive after a batch of calls; the budgets
+allow no leaks.
+"""
+
+import asyncio
+import gc
+import json
+import struct
+import sys
+
+import adafruit_logging
+import flynn
+
+from benchmarks import harness
+from benchmarks.replay import reports
+import circuitkey.hid as hid
+import circuitkey.pin as pin
+import circuitkey.storage as storage
+from circuitkey import cbor, ctaphid
+from circuitkey.arena import get_arena
+from circuitkey.schema import (
+    CTAPHID_BROADCAST_CID,
+    CborCmd,
+    ClientPinParam,
+    CtapCommand,
+    CtaphidCmd,
+    PinSubCmd,
+)
+from circuitkey.storage_backend import RamBackend
+
+# CircuitPython has no os.path
+BUDGETS = __file__.rsplit("/", 1)[0] + "/alloc_budgets.json"
+
+# budgets written by --update are the measured values plus this share
+HEADROOM = 0.25
+
+# measured values compared with the budgets
+CHECKED = ("bytes", "leaked_objects")
+
+CID = b"\x00\x00\x00\x01"
+
+
+class _Device:
+    """
+    HID device which keeps sent reports and replays queued ones.
+    """
+
+    def __init__(self):
+        self.sent = 0
+        self.reports = []
+
+    def send_report(self, report: bytes) -> None:
+        self.sent += 1
+
+    def get_last_received_report(self):
+        return self.reports.pop(0) if self.reports else None
+
+
+def _cbor(cmd: CborCmd, req: dict = None) -> bytes:
+    payload = struct.pack("<B", cmd)
+    if req is not None:
+        payload += flynn.dumps(req)
+    return payload
+
+
+def commands(device: _Device, loop) -> list:
+    run = loop.run_until_complete
+
+    get_info = _cbor(CborCmd.GET_INFO)
+    get_retries = _cbor(
+        CborCmd.CLIENT_PIN,
+        {
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.GET_RETRIES,
+        },
+    )
+
+    arena = get_arena()
+
+    # like main() and ctaphid.cbor_cmd, arena buffers are released after use
+    def receive(reports):
+        def call():
+            device.reports[:] = reports
+            arena.release(hid.receive(device).payload)
+
+        return call
+
+    def process(payload):
+        def call():
+            arena.release(run(cbor.process(CtapCommand(CID, CtaphidCmd.CBOR, payload))))
+
+        return call
+
+    return [
+        ("hid_send_64", lambda: run(hid.send(CID, 0x01, bytes(57), device))),
+        ("hid_send_1024", lambda: run(hid.send(CID, 0x01, bytes(1024), device))),
+        ("hid_receive_64", receive(reports(CID, 0x01, bytes(57)))),
+        ("hid_receive_1024", receive(reports(CID, 0x01, bytes(1024)))),
+        (
+            "ctaphid_ping",
+            lambda: run(ctaphid.process(CID, CtaphidCmd.PING, bytes(57))),
+        ),
+        (
+            "ctaphid_init",
+            lambda: run(
+                ctaphid.process(CTAPHID_BROADCAST_CID, CtaphidCmd.INIT, bytes(8))
+            ),
+        ),
+        (
+            "ctaphid_cbor_get_info",
+            lambda: run(ctaphid.process(CID, CtaphidCmd.CBOR, get_info)),
+        ),
+        ("cbor_get_info", process(get_info)),
+        ("cbor_client_pin_get_retries", process(get_retries)),
+    ]
+
+
+def leaked_objects(func, iterations: int = 10):
+    """
+    Objects still allocated after a batch of calls, per call, or None if the
+    implementation cannot count them (CircuitPython).
+
+    Counting over a batch keeps the few objects of the measurement itself
+    from showing up as a leak of every call.
+    """
+    if not hasattr(sys, "getallocatedblocks"):
+        return None
+
+    gc.collect()
+    before = sys.getallocatedblocks()
+    for _ in range(iterations):
+        func()
+    gc.collect()
+
+    return max(sys.getallocatedblocks() - before, 0) // iterations
+
+
+def run(iterations: int = 10) -> dict:
+    device = _Device()
+    saved_device = hid.get_device.__dict__.get("_device")
+    hid.get_device._device = device
+
+    saved = storage.get_backend()
+    storage.set_backend(RamBackend())
+    pin.get_pin_protocol()
+    loop = asyncio.new_event_loop()
+
+    # log output is not part of the budgets (and buffered output would count
+    # as retained)
+    loggers = [
+        log
+        for name, log in adafruit_logging.logger_cache.items()
+        if isinstance(name, str) and name.startswith("circuitkey")
+    ]
+    levels = [log.getEffectiveLevel() for log in loggers]
+    for log in loggers:
+        log.setLevel(adafruit_logging.WARNING)
+
+    results = []
+    try:
+        for name, func in commands(device, loop):
+            # first calls fill caches (storage, key pool, ...)
+            for _ in range(3):
+                func()
+
+            result = {"name": name}
+            result.update(harness.allocations(func, iterations))
+            leaked = leaked_objects(func, iterations)
+            if leaked is not None:
+                result["leaked_objects"] = leaked
+            results.append(result)
+    finally:
+        loop.close()
+        for log, level in zip(loggers, levels):
+            log.setLevel(level)
+        if saved_device is None:
+            del hid.get_device._device
+        else:
+            hid.get_device._device = saved_device
+        if "v1" in pin.get_pin_protocol.__dict__:
+            del pin.get_pin_protocol.v1
+        storage.set_backend(saved)
+
+    return {
+        "suite": "allocations",
+        "interpreter": interpreter(),
+        "iterations": iterations,
+        "results": results,
+    }
+
+
+def interpreter() -> str:
+    """
+    Name and version of the running interpreter, e.g. "cpython-3.11".
+    """
+    return "%s-%d.%d" % (
+        (sys.implementation.name,) + tuple(sys.implementation.version[:2])
+    )
+
+
+def _load(path: str) -> dict:
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_budgets(path: str = BUDGETS, version: str = None) -> dict:
+    """
+    Budgets by method of the interpreter version (by default the running
+    one), empty if it has none.
+    """
+    return _load(path).get(version or interpreter(), {})
+
+
+def check(data: dict, budgets: dict) -> list:
+    """
+    (command, measure, value, budget) of every command over its budget.
+    Commands without a budget for the current method are not checked.
+    """
+    exceeded = []
+
+    for result in data["results"]:
+        budget = budgets.get(result["method"], {}).get(result["name"])
+        if budget is None:
+            continue
+
+        for measure in CHECKED:
+            if measure in result and measure in budget:
+                if result[measure] > budget[measure]:
+                    exceeded.append(
+                        (result["name"], measure, result[measure], budget[measure])
+                    )
+
+    return exceeded
+
+
+def budgets_for(data: dict, headroom: float = HEADROOM) -> dict:
+    budgets = {}
+    for result in data["results"]:
+        budget = {"bytes": int(result["bytes"] * (1 + headroom))}
+        if "leaked_objects" in result:
+            # no headroom, steady-state requests must not leak
+            budget["leaked_objects"] = result["leaked_objects"]
+        budgets[result["name"]] = budget
+    return budgets
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--check", action="store_true", help="fail over budget")
+    parser.add_argument("--update", action="store_true", help="rewrite budgets")
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.iterations)
+    harness.emit(data, args.output)
+
+    if args.update:
+        try:
+            budgets = _load(BUDGETS)
+        except OSError:
+            budgets = {}
+        method = data["results"][0]["method"]
+        budgets.setdefault(data["interpreter"], {})[method] = budgets_for(data)
+        with open(BUDGETS, "w") as f:
+            json.dump(budgets, f, indent=2, sort_keys=True)
+            f.write("\n")
+
+    if args.check:
+        budgets = load_budgets()
+        if not budgets:
+            print("No budgets for %s" % data["interpreter"])
+        exceeded = check(data, budgets)
+        for name, measure, value, budget in exceeded:
+            print("%s: %s %d exceeds budget %d" % (name, measure, value, budget))
+        return 1 if exceeded else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,78 @@
+"""
+Size and speed of the storage format compared with JSON.
+
+    python -m benchmarks.codec_bench --output codec.json
+"""
+
+import json
+
+from benchmarks import harness
+from circuitkey import storage
+
+# representative bucket data, bytes are stored as hex strings in JSON
+SAMPLES = {
+    "counter": {"counter": 123456},
+    "pin": {"pin": b"\x5a" * 16, "retry_count": 8},
+    "secret": {"master_key": b"\xa5" * 32},
+    "keys": {"%08x" % i: True for i in range(16)},
+}
+
+
+def _to_json(data: dict) -> dict:
+    return {k: v.hex() if isinstance(v, bytes) else v for k, v in data.items()}
+
+
+def run(iterations: int = 200) -> dict:
+    results = []
+    for name, data in SAMPLES.items():
+        json_data = _to_json(data)
+        encoded_json = json.dumps(json_data)
+        encoded = storage.encode(data)
+
+        results += [
+            harness.measure(
+                "json_dumps_%s" % name,
+                lambda d=json_data: json.dumps(d),
+                iterations=iterations,
+                size=len(encoded_json),
+            ),
+            harness.measure(
+                "json_loads_%s" % name,
+                lambda e=encoded_json: json.loads(e),
+                iterations=iterations,
+                size=len(encoded_json),
+            ),
+            harness.measure(
+                "encode_%s" % name,
+                lambda d=data: storage.encode(d),
+                iterations=iterations,
+                size=len(encoded),
+            ),
+            harness.measure(
+                "decode_%s" % name,
+                lambda e=encoded: storage.decode(e),
+                iterations=iterations,
+                size=len(encoded),
+            ),
+        ]
+
+    return harness.report("codec", results, iterations=iterations)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.iterations)
+    harness.emit(data, args.output)
+    harness.print_table(data)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
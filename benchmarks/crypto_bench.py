@@ -0,0 +1,158 @@
+"""
+Benchmark of circuitkey.crypto backends on the operations used by the
+authenticator.
+
+Host (CPython backend):
+
+    python -m benchmarks.crypto_bench --iterations 200 --output crypto.json
+
+Device (CircuitPython backend), from the REPL:
+
+    from benchmarks import crypto_bench
+    crypto_bench.run()
+"""
+
+import random
+
+from benchmarks import harness
+from circuitkey import crypto
+
+SEED = 0x610
+AES_SIZES = (16, 32, 64, 256)
+BATCH_SIZES = (8, 32)
+BATCH_MSG_LEN = 64
+
+
+def _random_bytes(n: int) -> bytes:
+    return bytes(random.getrandbits(8) for _ in range(n))
+
+
+def cases(backend: crypto.Backend) -> list:
+    """
+    Inputs are derived from the fixed seed, so each run measures the same data.
+    Key generation itself uses the backend's RNG and cannot be seeded.
+    """
+    random.seed(SEED)
+
+    key = _random_bytes(32)
+    peer_pub, _ = backend.ec_genkey()
+    _, priv = backend.ec_genkey()
+
+    result = [
+        ("ec_genkey", backend.ec_genkey, {}),
+        ("ec_shared_secret", lambda: backend.ec_shared_secret(priv, peer_pub), {}),
+    ]
+
+    for size in AES_SIZES:
+        plaintext = _random_bytes(size)
+        ciphertext = backend.aes256_cbc_encrypt(key, plaintext, size)
+        result += [
+            (
+                "aes256_cbc_encrypt_%d" % size,
+                lambda p=plaintext, s=size: backend.aes256_cbc_encrypt(key, p, s),
+                {"size": size},
+            ),
+            (
+                "aes256_cbc_decrypt_%d" % size,
+                lambda c=ciphertext: backend.aes256_cbc_decrypt(key, c),
+                {"size": size},
+            ),
+            (
+                "hmac_sha256_%d" % size,
+                lambda p=plaintext: backend.hmac_sha256(p, key),
+                {"size": size},
+            ),
+            (
+                "sha256_%d" % size,
+                lambda p=plaintext: backend.sha256(p),
+                {"size": size},
+            ),
+        ]
+
+    # many messages under one key, e.g. credential IDs from an allowList
+    for count in BATCH_SIZES:
+        msgs = [_random_bytes(BATCH_MSG_LEN) for _ in range(count)]
+        result += [
+            (
+                "hmac_sha256_loop_%d" % count,
+                lambda m=msgs: [backend.hmac_sha256(msg, key) for msg in m],
+                {"count": count, "size": BATCH_MSG_LEN},
+            ),
+            (
+                "hmac_sha256_batch_%d" % count,
+                lambda m=msgs: backend.hmac_sha256_batch(m, key),
+                {"count": count, "size": BATCH_MSG_LEN},
+            ),
+            (
+                "sha256_loop_%d" % count,
+                lambda m=msgs: [backend.sha256(msg) for msg in m],
+                {"count": count, "size": BATCH_MSG_LEN},
+            ),
+            (
+                "sha256_batch_%d" % count,
+                lambda m=msgs: backend.sha256_batch(m),
+                {"count": count, "size": BATCH_MSG_LEN},
+            ),
+        ]
+
+    return result
+
+
+def get_backend(name: str = "auto") -> crypto.Backend:
+    if name == "cpython":
+        return crypto.CPythonBackend()
+    if name == "circuitpython":
+        return crypto.CircuitPythonBackend()
+    return crypto.backend()
+
+
+def run(backend: str = "auto", iterations: int = 50, only: str = None) -> dict:
+    bcd = get_backend(backend)
+
+    results = []
+    for name, func, params in cases(bcd):
+        if only is not None and only not in name:
+            continue
+        results.append(harness.measure(name, func, iterations=iterations, **params))
+
+    return harness.report(
+        "crypto",
+        results,
+        backend=bcd.__class__.__name__,
+        seed=SEED,
+        iterations=iterations,
+    )
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--backend", choices=("auto", "cpython", "circuitpython"), default="auto"
+    )
+    parser.add_argument("--iterations", type=int, default=50)
+    parser.add_argument("--only", help="run benchmarks whose name contains this")
+    parser.add_argument("--output", help="write JSON report to file")
+    parser.add_argument("--compare", help="baseline JSON report to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args(argv)
+
+    data = run(args.backend, args.iterations, args.only)
+    harness.emit(data, args.output)
+    harness.print_table(data)
+
+    if args.compare:
+        import json
+
+        with open(args.compare) as f:
+            regressions = harness.compare(json.load(f), data, args.tolerance)
+        for name in regressions:
+            print("REGRESSION: %s" % name)
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
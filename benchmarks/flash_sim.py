@@ -0,0 +1,186 @@
+"""
+Flash wear of bucket updates: record log vs. rewriting whole files.
+
+    python -m benchmarks.flash_sim --ops 10000 --output flash.json
+
+The record log runs on a simulated NOR flash (bytes can only be programmed
+once between erases of their sector). Rewriting a bucket file on the FAT
+filesystem is modelled as erasing and programming the file's data sector and
+the sector of its directory entry.
+"""
+
+import random
+import sys
+
+from benchmarks import harness
+from circuitkey.logstore import LogStore
+from circuitkey.storage import LOG_SEGMENT_SIZE, LOG_SEGMENTS, encode
+
+SEED = 0x610
+OPS = 10000
+
+FAT_BLOCK_SIZE = 512
+
+
+class SimulatedFlash:
+    """
+    Segments of NOR flash, one erase sector each.
+    """
+
+    def __init__(self, count: int = LOG_SEGMENTS, size: int = LOG_SEGMENT_SIZE):
+        self.count = count
+        self.size = size
+        self.sectors = [bytearray(b"\xff" * size) for _ in range(count)]
+        self.erases = [0] * count
+        self.bytes_written = 0
+
+    def read(self, index: int) -> bytes:
+        return bytes(self.sectors[index])
+
+    def write(self, index: int, offset: int, data: bytes) -> None:
+        sector = self.sectors[index]
+        if offset + len(data) > self.size:
+            raise ValueError("Write beyond sector")
+        if any(b != 0xFF for b in sector[offset : offset + len(data)]):
+            raise ValueError("Programming bytes which are not erased")
+
+        sector[offset : offset + len(data)] = data
+        self.bytes_written += len(data)
+
+    def erase(self, index: int) -> None:
+        self.sectors[index][:] = b"\xff" * self.size
+        self.erases[index] += 1
+
+
+class LogStrategy:
+    name = "record_log"
+
+    def __init__(self):
+        self.flash = SimulatedFlash()
+        self.store = LogStore(self.flash)
+
+    def save(self, key: bytes, value: bytes) -> None:
+        self.store.put(key, value)
+
+    def stats(self) -> dict:
+        return {
+            "bytes_written": self.flash.bytes_written,
+            "erase_cycles": sum(self.flash.erases),
+            "max_sector_erases": max(self.flash.erases),
+            "sectors": self.flash.count,
+        }
+
+
+class FileRewriteStrategy:
+    name = "file_rewrite"
+
+    def __init__(self):
+        self.erases = {}  # sector -> erase count
+        self.bytes_written = 0
+
+    def _program(self, sector: str, size: int) -> None:
+        blocks = (size + FAT_BLOCK_SIZE - 1) // FAT_BLOCK_SIZE
+        self.erases[sector] = self.erases.get(sector, 0) + 1
+        self.bytes_written += blocks * FAT_BLOCK_SIZE
+
+    def save(self, key: bytes, value: bytes) -> None:
+        self._program(key, len(value))
+        self._program("directory", FAT_BLOCK_SIZE)
+
+    def stats(self) -> dict:
+        return {
+            "bytes_written": self.bytes_written,
+            "erase_cycles": sum(self.erases.values()),
+            "max_sector_erases": max(self.erases.values()),
+            "sectors": len(self.erases),
+        }
+
+
+def workload(ops: int):
+    """
+    Bucket updates as saved by the authenticator: signature counter bumps,
+    PIN retry counter changes and key registrations.
+    """
+    random.seed(SEED)
+
+    counter = 0
+    retries = 8
+    keys = {}
+
+    for _ in range(ops):
+        op = random.random()
+        if op < 0.8:
+            counter += 1
+            yield b"counter", {"counter": counter}
+        elif op < 0.95:
+            retries = 8 if retries <= 1 else retries - 1
+            yield b"pin", {"pin": None, "retry_count": retries}
+        else:
+            key = "%08x" % random.getrandbits(32)
+            keys[key] = True
+            if len(keys) > 16:
+                keys.pop(next(iter(keys)))
+            yield b"keys", dict(keys)
+
+
+def run(ops: int = OPS) -> dict:
+    results = []
+    for strategy in (FileRewriteStrategy(), LogStrategy()):
+        for key, data in workload(ops):
+            strategy.save(key, encode(data))
+
+        stats = strategy.stats()
+        results.append(
+            {
+                "name": strategy.name,
+                "params": {"ops": ops},
+                **stats,
+                "bytes_per_op": stats["bytes_written"] / ops,
+            }
+        )
+
+    return harness.report(
+        "flash",
+        results,
+        seed=SEED,
+        segments=LOG_SEGMENTS,
+        segment_size=LOG_SEGMENT_SIZE,
+    )
+
+
+def print_table(data: dict, stream=sys.stderr) -> None:
+    print(
+        "%-16s %14s %13s %18s"
+        % ("name", "bytes_written", "erase_cycles", "max_sector_erases"),
+        file=stream,
+    )
+    for r in data["results"]:
+        print(
+            "%-16s %14d %13d %18d"
+            % (
+                r["name"],
+                r["bytes_written"],
+                r["erase_cycles"],
+                r["max_sector_erases"],
+            ),
+            file=stream,
+        )
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--ops", type=int, default=OPS)
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.ops)
+    harness.emit(data, args.output)
+    print_table(data)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
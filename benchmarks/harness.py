@@ -0,0 +1,190 @@
+import gc
+import json
+import math
+import sys
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    # CircuitPython does not ship tracemalloc, gc.mem_alloc is used instead
+    tracemalloc = None
+
+
+def _now_ns() -> int:
+    return time.monotonic_ns()
+
+
+def percentile(samples: list, pct: float) -> float:
+    """
+    Nearest-rank percentile of already sorted samples.
+    """
+    assert len(samples) > 0, "At least one sample is required"
+
+    rank = math.ceil(pct / 100 * len(samples))
+    return samples[min(max(rank, 1), len(samples)) - 1]
+
+
+def allocations(func, iterations: int = 10) -> dict:
+    """
+    Average heap allocation of a single call.
+
+    On CPython tracemalloc reports the peak of transient allocations and the
+    bytes still retained after the call. On CircuitPython the collector is
+    disabled around the call, so the gc.mem_alloc delta is the total number of
+    bytes allocated.
+    """
+    peak = retained = 0
+
+    if tracemalloc is not None:
+        was_tracing = tracemalloc.is_tracing()
+        if not was_tracing:
+            tracemalloc.start()
+        try:
+            for _ in range(iterations):
+                gc.collect()
+                tracemalloc.reset_peak()
+                before, _ = tracemalloc.get_traced_memory()
+                func()
+                _, top = tracemalloc.get_traced_memory()
+                # garbage cycles (e.g. finished tasks) are not retained
+                gc.collect()
+                after, _ = tracemalloc.get_traced_memory()
+                peak += top - before
+                retained += after - before
+        finally:
+            if not was_tracing:
+                tracemalloc.stop()
+
+        return {
+            "method": "tracemalloc",
+            "bytes": peak // iterations,
+            "retained_bytes": retained // iterations,
+        }
+
+    for _ in range(iterations):
+        gc.collect()
+        gc.disable()
+        try:
+            before = gc.mem_alloc()
+            func()
+            after = gc.mem_alloc()
+        finally:
+            gc.enable()
+        peak += after - before
+
+    return {"method": "gc.mem_alloc", "bytes": peak // iterations}
+
+
+def measure(name: str, func, iterations: int = 100, warmup: int = 5, **params) -> dict:
+    """
+    Run func repeatedly and return its throughput, latency percentiles (in
+    microseconds) and allocations.
+    """
+    for _ in range(warmup):
+        func()
+
+    samples = []
+    for _ in range(iterations):
+        started = _now_ns()
+        func()
+        samples.append(_now_ns() - started)
+
+    result = summarize(name, samples, **params)
+    result["allocations"] = allocations(func, min(iterations, 10))
+    return result
+
+
+def summarize(name: str, samples: list, **params) -> dict:
+    """
+    Throughput and latency percentiles (in microseconds) of samples taken in
+    nanoseconds.
+    """
+    samples = sorted(samples)
+    total_ns = sum(samples)
+    to_us = lambda ns: ns / 1000
+
+    return {
+        "name": name,
+        "params": params,
+        "iterations": len(samples),
+        "ops_per_sec": len(samples) * 1e9 / total_ns if total_ns > 0 else 0.0,
+        "latency_us": {
+            "min": to_us(samples[0]),
+            "p50": to_us(percentile(samples, 50)),
+            "p90": to_us(percentile(samples, 90)),
+            "p99": to_us(percentile(samples, 99)),
+            "max": to_us(samples[-1]),
+        },
+    }
+
+
+def report(suite: str, results: list, **meta) -> dict:
+    return {
+        "suite": suite,
+        "implementation": sys.implementation.name,
+        "version": ".".join(str(v) for v in sys.implementation.version[:3]),
+        "meta": meta,
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float = 0.1) -> list:
+    """
+    Names of the benchmarks which got slower (p50) or allocate more than
+    baseline by more than the given tolerance.
+    """
+    previous = {r["name"]: r for r in baseline["results"]}
+    regressions = []
+
+    for result in current["results"]:
+        before = previous.get(result["name"])
+        if before is None:
+            continue
+
+        slower = result["latency_us"]["p50"] > before["latency_us"]["p50"] * (
+            1 + tolerance
+        )
+        # results of summarize() have no allocations
+        heavier = "allocations" in result and (
+            result["allocations"]["bytes"]
+            > before["allocations"]["bytes"] * (1 + tolerance)
+        )
+
+        if slower or heavier:
+            regressions.append(result["name"])
+
+    return regressions
+
+
+def emit(data: dict, output: str = None) -> None:
+    try:
+        encoded = json.dumps(data, indent=2, sort_keys=True)
+    except TypeError:
+        # CircuitPython json.dumps does not support formatting arguments
+        encoded = json.dumps(data)
+
+    if output is None:
+        print(encoded)
+    else:
+        with open(output, "w") as f:
+            f.write(encoded)
+
+
+def print_table(data: dict, stream=sys.stderr) -> None:
+    stream.write(
+        "{:<32} {:>12} {:>10} {:>10} {:>10} {:>10}\n".format(
+            "benchmark", "ops/s", "p50 us", "p90 us", "p99 us", "alloc B"
+        )
+    )
+    for r in data["results"]:
+        stream.write(
+            "{:<32} {:>12.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>10}\n".format(
+                r["name"],
+                r["ops_per_sec"],
+                r["latency_us"]["p50"],
+                r["latency_us"]["p90"],
+                r["latency_us"]["p99"],
+                r["allocations"]["bytes"] if "allocations" in r else "-",
+            )
+        )
@@ -0,0 +1,219 @@
+import pytest
+
+from benchmarks import harness
+
+
+def test_percentile():
+    samples = list(range(1, 101))
+
+    assert harness.percentile(samples, 50) == 50
+    assert harness.percentile(samples, 90) == 90
+    assert harness.percentile(samples, 99) == 99
+    assert harness.percentile([7], 99) == 7
+
+
+def test_measure_reports_latency_and_allocations():
+    result = harness.measure("alloc", lambda: bytearray(1024), iterations=5, size=1)
+
+    assert result["name"] == "alloc"
+    assert result["params"] == {"size": 1}
+    assert result["iterations"] == 5
+    assert result["ops_per_sec"] > 0
+    assert result["latency_us"]["p50"] <= result["latency_us"]["max"]
+    assert result["allocations"]["bytes"] >= 1024
+
+
+def test_compare_detects_regressions():
+    def result(name, p50, alloc):
+        return {
+            "name": name,
+            "latency_us": {"p50": p50},
+            "allocations": {"bytes": alloc},
+        }
+
+    baseline = {"results": [result("a", 10, 100), result("b", 10, 100)]}
+    current = {
+        "results": [result("a", 10.5, 100), result("b", 20, 100), result("c", 1, 1)]
+    }
+
+    assert harness.compare(baseline, current, tolerance=0.1) == ["b"]
+
+
+def test_crypto_bench_report():
+    from benchmarks import crypto_bench
+
+    data = crypto_bench.run("cpython", iterations=1, only="sha256_")
+
+    assert data["suite"] == "crypto"
+    assert data["meta"]["backend"] == "CPythonBackend"
+    assert len(data["results"]) == 2 * len(crypto_bench.AES_SIZES) + 4 * len(
+        crypto_bench.BATCH_SIZES
+    )
+
+
+def test_storage_bench_report():
+    from benchmarks import storage_bench
+
+    data = storage_bench.run()
+    results = {r["name"]: r for r in data["results"]}
+
+    assert len(results) == 2 * len(storage_bench.flows())
+    for name, _ in storage_bench.flows():
+        cached, uncached = results[name + "_cached"], results[name + "_uncached"]
+        assert cached["reads"] <= uncached["reads"]
+        assert cached["writes"] <= uncached["writes"]
+
+    # buckets are read from flash on every load only when caching is disabled
+    cached, uncached = (
+        results["make_credential_cached"],
+        results["make_credential_uncached"],
+    )
+    assert cached["reads"] < uncached["reads"]
+
+
+def test_flash_sim_report():
+    from benchmarks import flash_sim
+
+    data = flash_sim.run(ops=1000)
+    rewrite, record_log = data["results"]
+
+    assert rewrite["name"] == "file_rewrite"
+    assert record_log["erase_cycles"] < rewrite["erase_cycles"]
+    assert record_log["bytes_written"] < rewrite["bytes_written"]
+
+
+def test_codec_bench_report():
+    from benchmarks import codec_bench
+
+    data = codec_bench.run(iterations=1)
+    sizes = {r["name"]: r["params"]["size"] for r in data["results"]}
+
+    for name in codec_bench.SAMPLES:
+        assert sizes["encode_" + name] < sizes["json_dumps_" + name]
+
+
+def test_logging_bench_report():
+    from benchmarks import logging_bench
+
+    data = logging_bench.run(iterations=2)
+    results = {r["name"]: r for r in data["results"]}
+
+    for level, _ in logging_bench.LEVELS:
+        for name, _ in logging_bench.requests():
+            assert name + "_" + level in results
+
+    # dropped debug messages are not formatted
+    assert (
+        results["debug_facade_warning"]["allocations"]["bytes"]
+        < results["debug_adafruit_warning"]["allocations"]["bytes"]
+    )
+
+
+def _with_hid(monkeypatch, name):
+    import importlib
+    import sys
+    from unittest.mock import MagicMock
+
+    # circuitkey.hid needs usb_hid, the benchmark uses its own device
+    monkeypatch.setitem(sys.modules, "usb_hid", sys.modules.get("usb_hid", MagicMock()))
+
+    return importlib.import_module("benchmarks." + name)
+
+
+def _alloc_bench(monkeypatch):
+    return _with_hid(monkeypatch, "alloc_bench")
+
+
+def test_allocations_within_budgets(monkeypatch):
+    alloc_bench = _alloc_bench(monkeypatch)
+
+    budgets = alloc_bench.load_budgets()
+    if not budgets:
+        pytest.skip("No allocation budgets for %s" % alloc_bench.interpreter())
+
+    data = alloc_bench.run(iterations=5)
+
+    assert len(data["results"]) == len(budgets["tracemalloc"])
+    assert alloc_bench.check(data, budgets) == []
+
+
+def test_budgets_are_kept_per_interpreter(monkeypatch, tmp_path):
+    alloc_bench = _alloc_bench(monkeypatch)
+    path = tmp_path / "budgets.json"
+    path.write_text('{"cpython-3.11": {"tracemalloc": {"a": {"bytes": 1}}}}')
+
+    assert alloc_bench.load_budgets(str(path), "cpython-3.11") == {
+        "tracemalloc": {"a": {"bytes": 1}}
+    }
+    assert alloc_bench.load_budgets(str(path), "cpython-3.10") == {}
+
+
+def test_allocation_budget_exceeded(monkeypatch):
+    alloc_bench = _alloc_bench(monkeypatch)
+
+    data = {
+        "results": [
+            {"name": "a", "method": "tracemalloc", "bytes": 101, "leaked_objects": 0},
+            {"name": "b", "method": "tracemalloc", "bytes": 1, "leaked_objects": 1},
+            {"name": "c", "method": "gc.mem_alloc", "bytes": 500},
+        ]
+    }
+    budgets = {
+        "tracemalloc": {
+            "a": {"bytes": 100, "leaked_objects": 0},
+            "b": {"bytes": 100, "leaked_objects": 0},
+        }
+    }
+
+    assert alloc_bench.check(data, budgets) == [
+        ("a", "bytes", 101, 100),
+        ("b", "leaked_objects", 1, 0),
+    ]
+
+
+def test_leaked_objects(monkeypatch):
+    alloc_bench = _alloc_bench(monkeypatch)
+    kept = []
+
+    assert alloc_bench.leaked_objects(lambda: kept.append(object())) >= 1
+    assert alloc_bench.leaked_objects(lambda: bytes(100)) == 0
+
+
+def test_schema_bench_report():
+    from benchmarks import schema_bench
+
+    data = schema_bench.run(iterations=5)
+    results = {r["name"]: r for r in data["results"]}
+
+    # table lookups allocate less than the IntFlag versions
+    for name, _, _ in schema_bench.cases():
+        assert (
+            results["table_" + name]["allocations"]["bytes"]
+            < results["flag_" + name]["allocations"]["bytes"]
+        )
+
+
+def test_replay_of_sample_trace(monkeypatch):
+    replay = _with_hid(monkeypatch, "replay")
+
+    data = replay.run(replay.load(replay.SAMPLE), iterations=2)
+    names = {r["name"] for r in data["results"]}
+
+    assert data["differences"] == []
+    assert {"session", "init", "ping", "cbor_get_info", "cbor_client_pin"} <= names
+
+
+def test_replay_reports_differences(monkeypatch):
+    replay = _with_hid(monkeypatch, "replay")
+
+    records = replay.sample()
+    assert replay.loads(replay.dumps(records)) == records
+
+    # ping response (the second one) recorded with a different payload
+    index = [i for i, (d, _, _) in enumerate(records) if d == replay.IN][1]
+    direction, delta, report = records[index]
+    records[index] = (direction, delta, report[:7] + b"\xff" + report[8:])
+
+    data = replay.run(records, iterations=1)
+
+    assert [d[0] for d in data["differences"]] == [1]
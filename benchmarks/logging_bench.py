@@ -0,0 +1,146 @@
+"""
+Logging overhead per CBOR request at INFO and WARNING level.
+
+    python -m benchmarks.logging_bench --output logging.json
+
+Requests are processed with all circuitkey loggers set to the given level
+and messages written to a null stream, so the difference between the levels
+is the cost of the log calls themselves. debug_* results compare a dropped
+debug message with a request dictionary argument, logged directly through
+adafruit_logging and through circuitkey.logger.
+"""
+
+import asyncio
+import struct
+
+import adafruit_logging
+import flynn
+
+from benchmarks import harness
+import circuitkey.logger as logger
+import circuitkey.pin as pin
+import circuitkey.storage as storage
+from circuitkey import cbor
+from circuitkey.schema import CborCmd, ClientPinParam, CtapCommand, PinSubCmd
+from circuitkey.storage_backend import RamBackend
+
+CID = b"\x00\x00\x00\x01"
+
+LEVELS = (("info", adafruit_logging.INFO), ("warning", adafruit_logging.WARNING))
+
+
+class _NullStream:
+    def write(self, buf: str) -> int:
+        return len(buf)
+
+
+def _command(cmd: CborCmd, req: dict = None) -> CtapCommand:
+    payload = struct.pack("<B", cmd)
+    if req is not None:
+        payload += flynn.dumps(req)
+    return CtapCommand(CID, None, payload)
+
+
+def requests() -> list:
+    return [
+        ("get_info", _command(CborCmd.GET_INFO)),
+        (
+            "client_pin_get_retries",
+            _command(
+                CborCmd.CLIENT_PIN,
+                {
+                    ClientPinParam.PIN_PROTOCOL: 1,
+                    ClientPinParam.SUB_COMMAND: PinSubCmd.GET_RETRIES,
+                },
+            ),
+        ),
+    ]
+
+
+def _set_level(level: int) -> None:
+    for name, log in adafruit_logging.logger_cache.items():
+        if isinstance(name, str) and name.startswith("circuitkey"):
+            log.setLevel(level)
+
+
+def run(iterations: int = 200) -> dict:
+    handler = adafruit_logging.StreamHandler(_NullStream())
+    loggers = [
+        log
+        for name, log in adafruit_logging.logger_cache.items()
+        if isinstance(name, str) and name.startswith("circuitkey")
+    ]
+    levels = [log.getEffectiveLevel() for log in loggers]
+    for log in loggers:
+        log.addHandler(handler)
+
+    saved = storage.get_backend()
+    storage.set_backend(RamBackend())
+    pin.get_pin_protocol()
+    loop = asyncio.new_event_loop()
+
+    raw = adafruit_logging.getLogger("circuitkey.logging_bench")
+    facade = logger.getLogger("circuitkey.logging_bench")
+    raw.addHandler(handler)
+    request = {"subCommand": 1, "clientDataHash": b"\x01" * 32, "rp": {"id": "x"}}
+
+    results = []
+    try:
+        for level_name, level in LEVELS:
+            _set_level(level)
+            raw.setLevel(level)
+
+            for name, cmd in requests():
+                results.append(
+                    harness.measure(
+                        "%s_%s" % (name, level_name),
+                        lambda c=cmd: loop.run_until_complete(cbor.process(c)),
+                        iterations=iterations,
+                        level=level_name,
+                    )
+                )
+
+            results += [
+                harness.measure(
+                    "debug_adafruit_%s" % level_name,
+                    lambda: raw.debug("CBOR request: %s", request),
+                    iterations=iterations,
+                    level=level_name,
+                ),
+                harness.measure(
+                    "debug_facade_%s" % level_name,
+                    lambda: facade.debug("CBOR request: %s", request),
+                    iterations=iterations,
+                    level=level_name,
+                ),
+            ]
+    finally:
+        loop.close()
+        raw.removeHandler(handler)
+        for log, level in zip(loggers, levels):
+            log.removeHandler(handler)
+            log.setLevel(level)
+        if "v1" in pin.get_pin_protocol.__dict__:
+            del pin.get_pin_protocol.v1
+        storage.set_backend(saved)
+
+    return harness.report("logging", results, iterations=iterations)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.iterations)
+    harness.emit(data, args.output)
+    harness.print_table(data)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,434 @@
+"""
+Replay of recorded HID report streams, a throughput benchmark and a
+byte-exact regression check.
+
+    python -m benchmarks.replay TRACE [--pace] [--iterations 10] [--output replay.json]
+    python -m benchmarks.replay --sample TRACE
+
+A trace holds the 64-byte reports exchanged with a key, OUT (host to key)
+and IN (key to host), and the time between them. It is recorded by wrapping
+the HID device of a key running on CPython in Recorder, starting from a
+fresh key. --sample records a scripted session (INIT, PING, GetInfo,
+ClientPIN getRetries); traces/sample.ckhr is such a session, replayed by
+the tests.
+
+The replay feeds the OUT reports of each request through hid.receive and
+ctaphid.process, either at the recorded pace or as fast as possible, on a
+fresh key with RAM storage whose user confirms presence at once. The IN
+reports sent back are compared with the recorded ones; keepalives are left
+out (their number depends on timing) and CTAPHID_INIT hands out the channel
+IDs of the recording. Responses with fresh randomness (signatures, key
+agreement, credential IDs) cannot match. The exit status is 1 when any
+report differs.
+
+Trace file (little endian):
+
+    magic "CKHR" (4) | version (1)
+
+followed by records
+
+    direction (1) | time since the previous record in us (4) | length (1) | report
+
+where trailing zeros of the report are not stored.
+"""
+
+import asyncio
+import struct
+import time
+
+import adafruit_logging
+import flynn
+
+from benchmarks import harness
+import circuitkey.hid as hid
+import circuitkey.ui as ui
+from circuitkey import channel, ctaphid, keystate
+from circuitkey.error import AbortError, CtapError
+from circuitkey.schema import (
+    CTAPHID_BROADCAST_CID,
+    CborCmd,
+    ClientPinParam,
+    CtaphidCmd,
+    PinSubCmd,
+)
+from circuitkey.storage_backend import RamBackend
+
+# CircuitPython has no os.path
+SAMPLE = __file__.rsplit("/", 1)[0] + "/traces/sample.ckhr"
+
+MAGIC = b"CKHR"
+VERSION = 0x01
+
+RECORD_FORMAT = "<BIB"
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+# directions
+OUT = 0x01  # host to key
+IN = 0x02  # key to host
+
+_CTAPHID_NAMES = {int(c): n.lower() for n, c in CtaphidCmd.__members__.items()}
+_CBOR_NAMES = {int(c): n.lower() for n, c in CborCmd.__members__.items()}
+
+
+class Recorder:
+    """
+    HID device wrapper which records the reports passing through it.
+    """
+
+    def __init__(self, device):
+        self.device = device
+        self.records = []  # (direction, us since the previous record, report)
+        self._last = None
+
+    def _record(self, direction: int, report) -> None:
+        now = time.monotonic_ns() // 1000
+        delta = 0 if self._last is None else now - self._last
+        self._last = now
+        # hid.send reuses its report buffer
+        self.records.append((direction, delta, bytes(report)))
+
+    def send_report(self, report) -> None:
+        self._record(IN, report)
+        self.device.send_report(report)
+
+    def get_last_received_report(self):
+        report = self.device.get_last_received_report()
+        if report is not None:
+            self._record(OUT, report)
+        return report
+
+
+def dumps(records: list) -> bytes:
+    data = bytearray(MAGIC)
+    data.append(VERSION)
+
+    for direction, delta, report in records:
+        report = bytes(report).rstrip(b"\x00")
+        data += struct.pack(
+            RECORD_FORMAT, direction, min(delta, 0xFFFFFFFF), len(report)
+        )
+        data += report
+
+    return bytes(data)
+
+
+def loads(data: bytes) -> list:
+    if data[:4] != MAGIC:
+        raise ValueError("Not a HID trace")
+    if data[4] != VERSION:
+        raise ValueError("Unsupported HID trace version %d" % data[4])
+
+    records = []
+    offset = 5
+    while offset < len(data):
+        direction, delta, length = struct.unpack_from(RECORD_FORMAT, data, offset)
+        offset += RECORD_SIZE
+        report = data[offset : offset + length]
+        offset += length
+        records.append((direction, delta, report + bytes(hid.REPORT_LEN - length)))
+
+    return records
+
+
+def save(path: str, records: list) -> None:
+    with open(path, "wb") as f:
+        f.write(dumps(records))
+
+
+def load(path: str) -> list:
+    with open(path, "rb") as f:
+        return loads(f.read())
+
+
+def reports(cid: bytes, cmd: int, payload: bytes) -> list:
+    """
+    Packets of a request, as sent by the host.
+    """
+    packets = []
+    header = cid + struct.pack(">BH", cmd, len(payload))
+    chunk = hid.REPORT_LEN - len(header)
+    packets.append(header + payload[:chunk])
+    payload = payload[chunk:]
+
+    seq = 1
+    while payload:
+        header = cid + bytes((0x80 | seq,))
+        chunk = hid.REPORT_LEN - len(header)
+        packets.append(header + payload[:chunk])
+        payload = payload[chunk:]
+        seq += 1
+
+    return [p + bytes(hid.REPORT_LEN - len(p)) for p in packets]
+
+
+def _is_keepalive(report) -> bool:
+    return report[4] == CtaphidCmd.KEEPALIVE
+
+
+def requests(records: list) -> list:
+    """
+    OUT reports grouped by request: (us since the start, reports), the time
+    being that of the last report of the request.
+    """
+    grouped = []
+    now = 0
+    for direction, delta, report in records:
+        now += delta
+        if direction != OUT:
+            continue
+
+        if report[4] & 0x80 and grouped:
+            # continuation packet
+            grouped[-1][0] = now
+            grouped[-1][1].append(report)
+        else:
+            grouped.append([now, [report]])
+
+    return [tuple(request) for request in grouped]
+
+
+def responses(records: list) -> list:
+    """
+    IN reports other than keepalives.
+    """
+    return [r for d, _, r in records if d == IN and not _is_keepalive(r)]
+
+
+def assigned_cids(records: list) -> list:
+    """
+    Channel IDs handed out by CTAPHID_INIT on the broadcast channel.
+    """
+    return [
+        bytes(r[15:19])  # nonce (8) | CID (4) | ...
+        for r in responses(records)
+        if r[0:4] == CTAPHID_BROADCAST_CID and r[4] == CtaphidCmd.INIT
+    ]
+
+
+def request_name(report) -> str:
+    cmd = report[4]
+    if cmd == CtaphidCmd.CBOR:
+        return "cbor_" + _CBOR_NAMES.get(report[7], "%#x" % report[7])
+    return _CTAPHID_NAMES.get(cmd, "%#x" % cmd)
+
+
+def compare(expected: list, actual: list) -> list:
+    """
+    (index, expected, actual) of every differing report, None for a missing
+    one.
+    """
+    differences = []
+    for index in range(max(len(expected), len(actual))):
+        e = expected[index] if index < len(expected) else None
+        a = actual[index] if index < len(actual) else None
+        if e is None or a is None or bytes(e) != bytes(a):
+            differences.append((index, e, a))
+    return differences
+
+
+class Device:
+    """
+    HID device which keeps sent reports (without keepalives) and hands out
+    queued ones.
+    """
+
+    def __init__(self):
+        self.reports = []
+        self.sent = []
+
+    def send_report(self, report) -> None:
+        if not _is_keepalive(report):
+            self.sent.append(bytes(report))
+
+    def get_last_received_report(self):
+        return self.reports.pop(0) if self.reports else None
+
+
+async def replay(records: list, device, pace: bool = False, latencies=None) -> None:
+    """
+    Queue the requests of records on device, one at a time, and have the key
+    receive (from hid.get_device()) and process them. Latencies (ns) are
+    appended to latencies[request name] if given.
+    """
+    cids = assigned_cids(records)
+    generate_cid = channel.generate_cid
+    channel.generate_cid = lambda: cids.pop(0) if cids else generate_cid()
+
+    start = time.monotonic_ns()
+    try:
+        for at, packets in requests(records):
+            if pace:
+                delay = at / 1e6 - (time.monotonic_ns() - start) / 1e9
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            device.reports[:] = packets
+            started = time.monotonic_ns()
+            try:
+                command = hid.receive()
+            except AbortError:
+                # the transaction is abandoned by the host
+                continue
+            except CtapError as e:
+                await ctaphid.error_cmd(bytes(packets[0][0:4]), e.code)
+            else:
+                if command is not None:
+                    await ctaphid.process(command.cid, command.cmd, command.payload)
+
+            if latencies is not None:
+                latencies.setdefault(request_name(packets[0]), []).append(
+                    time.monotonic_ns() - started
+                )
+    finally:
+        channel.generate_cid = generate_cid
+
+
+def _with_key(func):
+    """
+    Call func(device, loop) with the key set up for a replay, and restore
+    the previous state afterwards.
+    """
+    device = Device()
+    saved_device = hid.get_device.__dict__.get("_device")
+    saved_ui = ui.get_ui.__dict__.get("_ui")
+    saved_key = keystate.save()
+    hid.set_device(device)
+    # the user confirms presence at once
+    ui.get_ui._ui = ui.UI(ui.PressedButton(), ui.LedScheduler(ui.SimulatedLed()))
+    loop = asyncio.new_event_loop()
+
+    loggers = [
+        log
+        for name, log in adafruit_logging.logger_cache.items()
+        if isinstance(name, str) and name.startswith("circuitkey")
+    ]
+    levels = [log.getEffectiveLevel() for log in loggers]
+    for log in loggers:
+        log.setLevel(adafruit_logging.WARNING)
+
+    try:
+        return func(device, loop)
+    finally:
+        loop.close()
+        for log, level in zip(loggers, levels):
+            log.setLevel(level)
+        for getter, name, saved in (
+            (hid.get_device, "_device", saved_device),
+            (ui.get_ui, "_ui", saved_ui),
+        ):
+            if saved is None:
+                getter.__dict__.pop(name, None)
+            else:
+                setattr(getter, name, saved)
+        keystate.restore(saved_key)
+
+
+def record(session: list) -> list:
+    """
+    Records of a session of requests, (CID, command, payload), sent to a
+    fresh key.
+    """
+    out = [(OUT, 0, r) for cid, cmd, data in session for r in reports(cid, cmd, data)]
+
+    def run(device, loop):
+        keystate.reset(RamBackend())
+        recorder = Recorder(device)
+        hid.set_device(recorder)
+        loop.run_until_complete(replay(out, device))
+        return recorder.records
+
+    return _with_key(run)
+
+
+def sample() -> list:
+    """
+    Records of a short session, as a browser starts one.
+    """
+    cid = b"\x00\x00\x00\x01"
+    get_retries = {
+        ClientPinParam.PIN_PROTOCOL: 1,
+        ClientPinParam.SUB_COMMAND: PinSubCmd.GET_RETRIES,
+    }
+
+    return record(
+        [
+            (CTAPHID_BROADCAST_CID, CtaphidCmd.INIT, bytes(range(8))),
+            (cid, CtaphidCmd.PING, bytes(range(100))),
+            (cid, CtaphidCmd.CBOR, bytes((CborCmd.GET_INFO,))),
+            (
+                cid,
+                CtaphidCmd.CBOR,
+                bytes((CborCmd.CLIENT_PIN,)) + flynn.dumps(get_retries),
+            ),
+            (cid, 0x7F, b""),  # not supported
+        ]
+    )
+
+
+def run(records: list, pace: bool = False, iterations: int = 10) -> dict:
+    """
+    Replay records iterations times on a fresh key. The report has the
+    latency of whole sessions and of each kind of request, and the
+    differences of the first replay to the recording.
+    """
+    expected = responses(records)
+    sessions = []
+    latencies = {}
+    differences = None
+
+    def replays(device, loop):
+        nonlocal differences
+
+        for _ in range(iterations):
+            keystate.reset(RamBackend())
+            device.sent.clear()
+            started = time.monotonic_ns()
+            loop.run_until_complete(replay(records, device, pace, latencies))
+            sessions.append(time.monotonic_ns() - started)
+
+            if differences is None:
+                differences = compare(expected, device.sent)
+
+    _with_key(replays)
+
+    results = [harness.summarize("session", sessions, requests=len(requests(records)))]
+    results += [harness.summarize(n, s) for n, s in sorted(latencies.items())]
+
+    data = harness.report("replay", results, iterations=iterations, pace=pace)
+    data["differences"] = [
+        (index, None if e is None else bytes(e).hex(), None if a is None else a.hex())
+        for index, e, a in differences
+    ]
+    return data
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("trace", help="HID trace file")
+    parser.add_argument("--pace", action="store_true", help="keep recorded timing")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--sample", action="store_true", help="record sample trace")
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    if args.sample:
+        save(args.trace, sample())
+        return 0
+
+    data = run(load(args.trace), args.pace, args.iterations)
+    harness.emit(data, args.output)
+    harness.print_table(data)
+
+    for index, expected, actual in data["differences"]:
+        print(
+            "IN report %d differs:\n  recorded %s\n  replayed %s"
+            % (index, expected, actual)
+        )
+
+    return 1 if data["differences"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,120 @@
+"""
+Protocol code lookups with IntFlag members and with the precomputed tables
+of circuitkey.schema.
+
+    python -m benchmarks.schema_bench --output schema.json
+
+Each flag_* result has a table_* counterpart doing the same lookup the way
+the hot paths in circuitkey.ctaphid and circuitkey.cbor do it now.
+
+Allocations include the overhead of the measured call itself (56 bytes per
+call with tracemalloc on CPython 3.11), which is all a table lookup shows.
+"""
+
+from benchmarks import harness
+from circuitkey.schema import (
+    ERROR_BYTES,
+    ERROR_CODES,
+    KEEPALIVE_BYTES,
+    CborCmd,
+    CtaphidCmd,
+    Error,
+    KeepaliveStatusCode,
+)
+
+# dispatch before circuitkey.ctaphid and circuitkey.cbor used lookup tables
+_CTAPHID_LIST = [
+    (CtaphidCmd.PING, None),
+    (CtaphidCmd.INIT, None),
+    (CtaphidCmd.CBOR, None),
+    (CtaphidCmd.CANCEL, None),
+    (CtaphidCmd.WINK, None),
+    (CtaphidCmd.TRACE, None),
+    (CtaphidCmd.STATS, None),
+]
+_CTAPHID_TABLE = {int(code): handler for code, handler in _CTAPHID_LIST}
+
+_CBOR_LIST = [
+    (None, CborCmd.MAKE_CREDENTIAL, True),
+    (None, CborCmd.GET_ASSERTION, True),
+    (None, CborCmd.GET_NEXT_ASSERTION, False),
+    (None, CborCmd.GET_INFO, False),
+    (None, CborCmd.CLIENT_PIN, True),
+    (None, CborCmd.RESET, False),
+]
+_CBOR_TABLE = {int(code): (func, params) for func, code, params in _CBOR_LIST}
+
+
+def _ctaphid_loop(cmd: int):
+    for code, handler in _CTAPHID_LIST:
+        if code == cmd:
+            return handler
+
+
+def _cbor_filter(cmd: int):
+    found = [c for c in _CBOR_LIST if c[1] == cmd]
+    return found[0] if found else None
+
+
+def cases() -> list:
+    """
+    (name, IntFlag version, table version)
+    """
+    error = Error.PIN_AUTH_INVALID
+    status = KeepaliveStatusCode.PROCESSING
+    stats = int(CtaphidCmd.STATS)  # last of the list
+    reset = int(CborCmd.RESET)
+
+    return [
+        (
+            "error_byte",
+            lambda: error.value.to_bytes(1, "big"),
+            lambda: ERROR_BYTES[error],
+        ),
+        (
+            "keepalive_byte",
+            lambda: status.value.to_bytes(1, "big"),
+            lambda: KEEPALIVE_BYTES[status],
+        ),
+        ("error_valid", lambda: error in Error, lambda: error in ERROR_CODES),
+        (
+            "ctaphid_dispatch",
+            lambda: _ctaphid_loop(stats),
+            lambda: _CTAPHID_TABLE.get(stats),
+        ),
+        (
+            "cbor_dispatch",
+            lambda: _cbor_filter(reset),
+            lambda: _CBOR_TABLE.get(reset),
+        ),
+    ]
+
+
+def run(iterations: int = 1000) -> dict:
+    results = []
+    for name, flag, table in cases():
+        results += [
+            harness.measure("flag_" + name, flag, iterations=iterations),
+            harness.measure("table_" + name, table, iterations=iterations),
+        ]
+
+    return harness.report("schema", results, iterations=iterations)
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=1000)
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.iterations)
+    harness.emit(data, args.output)
+    harness.print_table(data)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
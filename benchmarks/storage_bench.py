@@ -0,0 +1,226 @@
+"""
+Flash reads and writes per CBOR command, with and without the storage cache.
+
+    python -m benchmarks.storage_bench --output storage.json
+
+Every flow runs on an empty RAM backend, first with storage.caching disabled
+(each load reads and each save writes flash) and then enabled. Time spent
+in the backend is reported separately; --latency-us and
+--latency-us-per-byte simulate slow flash.
+"""
+
+import asyncio
+import os
+import struct
+import sys
+import time
+
+import flynn
+
+from benchmarks import harness
+import circuitkey.crypto as crypto
+import circuitkey.storage as storage
+import circuitkey.ui as ui
+from circuitkey import cbor, counter, credential, pin, resident
+from circuitkey.error import CborError
+from circuitkey.schema import (
+    CborCmd,
+    CtapCommand,
+    GetAssertionParam,
+    MakeCredentialParam,
+)
+from circuitkey.storage_backend import InstrumentedBackend, RamBackend
+
+CID = b"\x00\x00\x00\x01"
+RP_ID = "example.com"
+ASSERTIONS = 5
+
+
+class _PresentUser:
+    async def verify_user_presence(self, timeout=None):
+        return True
+
+
+def _command(cmd: CborCmd, req: dict = None) -> CtapCommand:
+    payload = struct.pack("<B", cmd)
+    if req is not None:
+        payload += flynn.dumps(req)
+    return CtapCommand(CID, None, payload)
+
+
+def _make_credential(rk: bool = False) -> CtapCommand:
+    req = {
+        MakeCredentialParam.CLIENT_DATA_HASH: os.urandom(32),
+        MakeCredentialParam.RP: {"id": RP_ID},
+        MakeCredentialParam.USER: {"id": os.urandom(16), "name": "user"},
+        MakeCredentialParam.PUB_KEY_CRED_PARAMS: [{"alg": -7, "type": "public-key"}],
+    }
+    if rk:
+        req[MakeCredentialParam.OPTIONS] = {"rk": True}
+    return _command(CborCmd.MAKE_CREDENTIAL, req)
+
+
+def _get_assertion() -> CtapCommand:
+    return _command(
+        CborCmd.GET_ASSERTION,
+        {
+            GetAssertionParam.RP_ID: RP_ID,
+            GetAssertionParam.CLIENT_DATA_HASH: os.urandom(32),
+        },
+    )
+
+
+async def _wrong_pin():
+    # ClientPIN getPinToken with a wrong PIN, retry counter is decremented
+    platform_pub, _ = crypto.ec_genkey()
+    try:
+        await pin.get_pin_protocol().verify(os.urandom(16), platform_pub)
+    except CborError:
+        pass
+
+
+def flows() -> list:
+    """
+    Named command sequences. Each step is a CtapCommand or a coroutine
+    function.
+    """
+    return [
+        ("get_info", [_command(CborCmd.GET_INFO)]),
+        ("make_credential", [_make_credential() for _ in range(2)]),
+        ("make_credential_rk", [_make_credential(rk=True) for _ in range(2)]),
+        (
+            "get_assertion",
+            [_make_credential(rk=True)] + [_get_assertion()] * ASSERTIONS,
+        ),
+        ("pin_wrong", [_wrong_pin] * 3),
+    ]
+
+
+def _reset(backend: InstrumentedBackend) -> None:
+    storage.set_backend(backend)
+    counter.reset()
+    credential.reset()
+    resident.reset()
+    if "v1" in pin.get_pin_protocol.__dict__:
+        del pin.get_pin_protocol.v1
+
+    backend.reset_stats()
+
+
+async def _run_step(step, backend: InstrumentedBackend) -> dict:
+    storage.io_stats.update(reads=0, writes=0)
+    backend.reset_stats()
+    start = time.monotonic_ns()
+
+    if isinstance(step, CtapCommand):
+        await cbor.process(step)
+    else:
+        await step()
+        storage.flush()  # as at the end of every CBOR command
+
+    return {
+        "reads": storage.io_stats["reads"],
+        "writes": storage.io_stats["writes"],
+        "bytes_written": backend.stats["bytes_written"],
+        "io_us": backend.stats["time_us"],
+        "total_us": (time.monotonic_ns() - start) // 1000,
+    }
+
+
+async def _run_flow(steps: list, backend: InstrumentedBackend) -> list:
+    _reset(backend)
+    return [await _run_step(step, backend) for step in steps]
+
+
+def _result(name: str, caching: bool, stats: list, **params) -> dict:
+    result = {
+        "name": "%s_%s" % (name, "cached" if caching else "uncached"),
+        "params": {"caching": caching, "commands": len(stats), **params},
+        "per_command": stats,
+    }
+    for key in stats[0]:
+        result[key] = sum(s[key] for s in stats)
+    return result
+
+
+def run(latency_us: int = 0, latency_us_per_byte: float = 0) -> dict:
+    """
+    Flows run on a RAM backend, latency simulates slow flash.
+    """
+    ui.get_ui._ui = _PresentUser()
+    saved = storage.caching, storage.get_backend()
+
+    results = []
+    try:
+        for name, steps in flows():
+            for caching in (False, True):
+                storage.caching = caching
+                backend = InstrumentedBackend(
+                    RamBackend(), latency_us, latency_us_per_byte
+                )
+                stats = asyncio.run(_run_flow(steps, backend))
+                results.append(
+                    _result(
+                        name,
+                        caching,
+                        stats,
+                        latency_us=latency_us,
+                        latency_us_per_byte=latency_us_per_byte,
+                    )
+                )
+    finally:
+        storage.caching = saved[0]
+        storage.set_backend(saved[1])
+        counter.reset()
+        credential.reset()
+        del ui.get_ui._ui
+
+    return harness.report("storage", results)
+
+
+def print_table(data: dict, stream=sys.stderr) -> None:
+    print(
+        "%-32s %6s %6s %8s %10s %10s"
+        % ("name", "reads", "writes", "bytes", "io us", "total us"),
+        file=stream,
+    )
+    for r in data["results"]:
+        print(
+            "%-32s %6d %6d %8d %10d %10d"
+            % (
+                r["name"],
+                r["reads"],
+                r["writes"],
+                r["bytes_written"],
+                r["io_us"],
+                r["total_us"],
+            ),
+            file=stream,
+        )
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--latency-us", type=int, default=0, help="simulated flash latency per op"
+    )
+    parser.add_argument(
+        "--latency-us-per-byte",
+        type=float,
+        default=0,
+        help="simulated flash latency per byte",
+    )
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.latency_us, args.latency_us_per_byte)
+    harness.emit(data, args.output)
+    print_table(data)
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,91 @@
+# Preallocated message buffers.
+#
+# Request payloads (assembled by hid.receive) and CBOR responses (encoded by
+# cbor.process) are written into buffers of the largest CTAPHID message,
+# allocated once right after boot (see circuitkey.warmup). A buffer is borrowed for one message and
+# released when the message has been processed or sent, so steady-state
+# request handling does not allocate message-sized objects and cannot
+# fragment the heap over time.
+#
+# Messages are exposed as memoryviews returned by view(); release() takes
+# such a view (or the buffer itself) and ignores anything else, e.g. bytes
+# passed by tests. When all buffers are borrowed a new one is allocated and
+# counted as arena_misses in circuitkey.stats.
+
+from circuitkey import stats
+
+# 7609 bytes: initialization packet + 128 continuation packets of 64 bytes
+MESSAGE_SIZE = (64 - 7) + 128 * (64 - 5)
+
+# one for the request being received, one for the request being processed
+# and one for its response
+BUFFERS = 3
+
+
+class Arena:
+    def __init__(self, size: int, count: int):
+        self.size = size
+        self.count = count
+        self._free = [bytearray(size) for _ in range(count)]
+        self._lent = []  # (view, buffer)
+
+    def borrow(self) -> bytearray:
+        if self._free:
+            return self._free.pop()
+
+        stats.inc("arena_misses")
+        return bytearray(self.size)
+
+    def view(self, buffer: bytearray, length: int) -> memoryview:
+        """
+        First length bytes of a borrowed buffer, released with release().
+        """
+        view = memoryview(buffer)[:length]
+        self._lent.append((view, buffer))
+        return view
+
+    def release(self, data) -> None:
+        buffer = None
+        for i in range(len(self._lent)):
+            if self._lent[i][0] is data:
+                buffer = self._lent.pop(i)[1]
+                break
+
+        if buffer is None:
+            if not isinstance(data, bytearray) or len(data) != self.size:
+                return
+            buffer = data
+
+        if len(self._free) < self.count and not any(b is buffer for b in self._free):
+            self._free.append(buffer)
+
+    def available(self) -> int:
+        return len(self._free)
+
+
+class Writer:
+    """
+    File-like writer into a borrowed buffer, e.g. for flynn.dump().
+    """
+
+    def __init__(self, buffer: bytearray):
+        self.buffer = buffer
+        self.length = 0
+
+    def write(self, data) -> int:
+        end = self.length + len(data)
+        if end > len(self.buffer):
+            raise ValueError(
+                "Message too large [{} > {}]".format(end, len(self.buffer))
+            )
+
+        self.buffer[self.length : end] = data
+        self.length = end
+        return len(data)
+
+
+def get_arena() -> Arena:
+    if "_arena" not in get_arena.__dict__:
+        get_arena._arena = Arena(MESSAGE_SIZE, BUFFERS)
+
+    return get_arena._arena
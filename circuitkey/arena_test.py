@@ -0,0 +1,62 @@
+import flynn
+import pytest
+
+import circuitkey.arena as arena
+import circuitkey.stats as stats
+
+
+@pytest.fixture
+def small():
+    return arena.Arena(16, 2)
+
+
+def test_borrow_and_release(small):
+    buffer = small.borrow()
+    view = small.view(buffer, 4)
+
+    assert len(buffer) == 16
+    assert len(view) == 4
+    assert small.available() == 1
+
+    small.release(view)
+
+    assert small.available() == 2
+
+
+def test_release_ignores_foreign_data(small):
+    small.release(b"payload")
+    small.release(bytearray(16))
+
+    # a buffer of the right size is taken, but never above the count
+    assert small.available() == 2
+
+
+def test_exhausted_arena_allocates(small, monkeypatch):
+    monkeypatch.setitem(stats.counters, "arena_misses", 0)
+
+    buffers = [small.borrow() for _ in range(3)]
+
+    assert len({id(b) for b in buffers}) == 3
+    assert stats.counters["arena_misses"] == 1
+
+    for buffer in buffers:
+        small.release(buffer)
+
+    assert small.available() == 2
+
+
+def test_writer():
+    writer = arena.Writer(bytearray(16))
+
+    writer.write(b"\x00")
+    flynn.dump({1: b"ab"}, writer)
+
+    assert bytes(writer.buffer[: writer.length]) == b"\x00" + flynn.dumps({1: b"ab"})
+
+    with pytest.raises(ValueError):
+        writer.write(bytes(16))
+
+
+def test_message_size():
+    # initialization packet + 128 continuation packets
+    assert arena.MESSAGE_SIZE == 7609
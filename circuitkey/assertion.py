@@ -0,0 +1,76 @@
+# State of authenticatorGetAssertion kept for authenticatorGetNextAssertion.
+#
+# Each channel has at most one cursor. The cursor holds a lazy iterator over
+# matching resident credentials, so every authenticatorGetNextAssertion reads
+# and signs exactly one credential. The cursor expires 30 seconds after the
+# last assertion and is dropped when any other command is received on the
+# channel.
+
+import time
+
+from circuitkey.logger import getLogger
+
+log = getLogger(__name__)
+
+CURSOR_TIMEOUT = 30  # seconds
+
+
+class AssertionCursor:
+    def __init__(
+        self,
+        rp_id_hash: bytes,
+        client_data_hash: bytes,
+        flags: int,
+        credentials,
+        remaining: int,
+    ):
+        self.rp_id_hash = rp_id_hash
+        self.client_data_hash = client_data_hash
+        self.flags = flags
+        self.remaining = remaining
+
+        self._credentials = credentials
+        self._deadline = time.monotonic() + CURSOR_TIMEOUT
+
+    def is_expired(self) -> bool:
+        return time.monotonic() > self._deadline
+
+    def next(self):
+        """
+        Next credential or None if there are no more credentials.
+        """
+        if self.remaining <= 0:
+            return None
+
+        self.remaining -= 1
+        self._deadline = time.monotonic() + CURSOR_TIMEOUT
+
+        return next(self._credentials, None)
+
+
+_cursors = {}  # CID -> AssertionCursor
+
+
+def open_cursor(cid: bytes, cursor: AssertionCursor) -> None:
+    _cursors[cid] = cursor
+
+
+def get_cursor(cid: bytes) -> AssertionCursor | None:
+    cursor = _cursors.get(cid)
+
+    if cursor is not None and (cursor.is_expired() or cursor.remaining <= 0):
+        log.debug("Assertion cursor expired or exhausted")
+        del _cursors[cid]
+        return None
+
+    return cursor
+
+
+def invalidate(cid: bytes = None) -> None:
+    """
+    Drop cursor of the channel, or all cursors if no channel is given.
+    """
+    if cid is None:
+        _cursors.clear()
+    elif cid in _cursors:
+        del _cursors[cid]
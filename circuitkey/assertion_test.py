@@ -0,0 +1,64 @@
+import pytest
+import pytest_mock
+
+from circuitkey import assertion
+
+CID = b"\x00\x00\x00\x01"
+
+
+@pytest.fixture(autouse=True)
+def clean_cursors():
+    assertion.invalidate()
+    yield
+    assertion.invalidate()
+
+
+def cursor(credentials, remaining):
+    return assertion.AssertionCursor(
+        b"rp", b"client-data-hash", 0x01, iter(credentials), remaining
+    )
+
+
+def test_cursor_returns_credentials_lazily():
+    read = []
+
+    def credentials():
+        for c in ("a", "b"):
+            read.append(c)
+            yield c
+
+    assertion.open_cursor(CID, cursor(credentials(), 2))
+
+    assert read == []
+    assert assertion.get_cursor(CID).next() == "a"
+    assert read == ["a"]
+    assert assertion.get_cursor(CID).next() == "b"
+    assert assertion.get_cursor(CID) is None
+
+
+def test_cursor_is_per_channel():
+    assertion.open_cursor(CID, cursor(["a"], 1))
+
+    assert assertion.get_cursor(b"\x00\x00\x00\x02") is None
+
+    assertion.invalidate(b"\x00\x00\x00\x02")
+    assert assertion.get_cursor(CID) is not None
+
+    assertion.invalidate(CID)
+    assert assertion.get_cursor(CID) is None
+
+
+def test_cursor_expires(mocker: pytest_mock.MockFixture):
+    monotonic = mocker.patch("time.monotonic", return_value=100)
+
+    assertion.open_cursor(CID, cursor(["a", "b"], 2))
+
+    monotonic.return_value = 100 + assertion.CURSOR_TIMEOUT
+    assert assertion.get_cursor(CID).next() == "a"
+
+    # timer is restarted by every assertion
+    monotonic.return_value = 100 + 2 * assertion.CURSOR_TIMEOUT
+    assert assertion.get_cursor(CID) is not None
+
+    monotonic.return_value = 101 + 2 * assertion.CURSOR_TIMEOUT
+    assert assertion.get_cursor(CID) is None
@@ -5,24 +5,49 @@ import time
 
 import flynn
 import flynn.decoder as decoder
-from adafruit_logging import getLogger
 
+import circuitkey.crypto as crypto
 import circuitkey.info as info
 import circuitkey.storage as storage
 import circuitkey.ui as ui
-from circuitkey import pin
+from circuitkey import (
+    assertion,
+    counter,
+    credential,
+    keypool,
+    pin,
+    presence,
+    resident,
+    stats,
+)
+from circuitkey.arena import Writer, get_arena
 from circuitkey.error import CborError
+from circuitkey.logger import getLogger
+from circuitkey.request import (
+    ClientPinRequest,
+    GetAssertionRequest,
+    MakeCredentialRequest,
+)
 from circuitkey.schema import (
-    CBOR_SUCCCESS_CODE,
+    CBOR_SUCCESS_BYTE,
+    COSE_ALG_ES256,
+    ERROR_BYTES,
+    PUBLIC_KEY_CREDENTIAL_TYPE,
+    AuthDataFlag,
     CborCmd,
     CtapCommand,
     Error,
     PinSubCmd,
+    cbor_get_assertion_response,
+    cbor_make_credential_response,
     cbor_pin_response,
 )
+from circuitkey.util import next_tick
 
 log = getLogger(__name__)
 
+USER_PRESENCE_TIMEOUT = 30  # seconds
+
 
 async def authenticator_reset() -> None:
     """
@@ -40,7 +65,7 @@ async def authenticator_reset() -> None:
 
     try:
         timeout_in_sec = 30
-        await ui.get_ui().verify_user_presence(timeout_in_ms=timeout_in_sec * 1000)
+        await ui.get_ui().verify_user_presence(timeout=timeout_in_sec)
     except asyncio.TimeoutError:
         raise CborError(
             Error.USER_ACTION_TIMEOUT,
@@ -49,38 +74,293 @@ async def authenticator_reset() -> None:
 
     log.info("User confirmed reset")
 
+    assertion.invalidate()
+    presence.invalidate()
+    resident.reset()
     storage.reset()
+    credential.reset()
+    counter.reset()
+
+
+def authenticator_get_info() -> bytes:
+    return info.cbor_info_encoded()
+
+
+async def verify_user_presence(cid: bytes = None, rp_id_hash: bytes = None) -> None:
+    """
+    Wait for a touch, unless the user has touched the device for the relying
+    party on the channel recently (see circuitkey.presence).
+    """
+    if presence.is_cached(cid, rp_id_hash):
+        return
+
+    try:
+        await ui.get_ui().verify_user_presence(timeout=USER_PRESENCE_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise CborError(
+            Error.USER_ACTION_TIMEOUT,
+            f"User did not confirm presence within {USER_PRESENCE_TIMEOUT} seconds",
+        )
+
+    presence.record(cid, rp_id_hash)
+
+
+def verify_pin_auth(
+    client_data_hash: bytes, pin_auth: bytes, pin_protocol: int, required: bool
+) -> int:
+    """
+    Verify pinAuth of MakeCredential/GetAssertion request.
+
+    :return: authenticator data flags (UV if pinAuth has been verified)
+    """
+    protocol = pin.get_pin_protocol(1 if pin_protocol is None else pin_protocol)
+
+    if pin_auth is None:
+        if required and protocol.is_pin_set():
+            raise CborError(Error.PUAT_REQUIRED, "PIN is set, pinAuth is required")
+        return 0
+
+    if not protocol.verify_pin_auth(client_data_hash, pin_auth):
+        raise CborError(Error.PIN_AUTH_INVALID, "pinAuth verification failed")
+
+    return AuthDataFlag.UV
+
+
+def credential_ids(descriptors: list) -> list:
+    return [
+        d["id"]
+        for d in descriptors
+        if d.get("type") == PUBLIC_KEY_CREDENTIAL_TYPE and "id" in d
+    ]
+
+
+def auth_data(
+    rp_id_hash: bytes, flags: int, sign_count: int, attested_credential_data=b""
+) -> bytes:
+    """
+    rpIdHash (32) | flags (1) | signCount (4) | attestedCredentialData
+    """
+    return rp_id_hash + struct.pack(">BI", flags, sign_count) + attested_credential_data
+
+
+def attested_credential_data(credential_id: bytes, public_key) -> bytes:
+    """
+    AAGUID (16) | credentialIdLength (2) | credentialId | credentialPublicKey
+    """
+    return (
+        info.AAGUID
+        + struct.pack(">H", len(credential_id))
+        + credential_id
+        + flynn.dumps(credential.cose_key(public_key))
+    )
+
+
+async def authenticator_make_credential(req: dict, cid: bytes = None):
+    """
+    5.1. authenticatorMakeCredential (0x01)
 
+    The credential ID wraps the private key (see circuitkey.credential), so
+    nothing is stored on the device unless a resident credential is requested.
+    """
+    req = MakeCredentialRequest(req)
+    client_data_hash = req.client_data_hash
+    user = req.user
+
+    rp_id_hash = crypto.sha256(req.rp_id.encode())
+
+    exclude_list = credential_ids(req.exclude_list)
+    if credential.find(rp_id_hash, exclude_list) is not None:
+        await verify_user_presence(cid, rp_id_hash)
+        raise CborError(Error.CREDENTIAL_EXCLUDED, "Credential is excluded")
+
+    if not any(
+        p.get("alg") == COSE_ALG_ES256 and p.get("type") == PUBLIC_KEY_CREDENTIAL_TYPE
+        for p in req.pub_key_cred_params
+    ):
+        raise CborError(Error.UNSUPPORTED_ALGORITHM, "Only ES256 is supported")
+
+    options = req.options
+    rk = options.get("rk", False)
+    if rk and "id" not in user:
+        raise CborError(Error.MISSING_PARAMETER, "User ID is required")
+    if rk:
+        store = resident.get_store()
+        # a credential of the same user is overwritten in its slot
+        if store.is_full() and not store.has_user(rp_id_hash, user["id"]):
+            raise CborError(Error.KEY_STORE_FULL, "Resident credential store is full")
+    if options.get("uv", False):
+        raise CborError(Error.UNSUPPORTED_OPTION, "User verification not supported")
+
+    flags = verify_pin_auth(
+        client_data_hash, req.pin_auth, req.pin_protocol, required=True
+    )
+
+    await verify_user_presence(cid, rp_id_hash)
+    flags |= AuthDataFlag.UP | AuthDataFlag.AT
+
+    public_key, private_key = await next_tick(keypool.take)()
+    credential_id = credential.wrap(rp_id_hash, private_key)
+
+    if rk:
+        resident.get_store().add(
+            rp_id_hash, credential_id, user["id"], user.get("name", "")
+        )
+
+    data = auth_data(
+        rp_id_hash,
+        flags,
+        counter.next_value(credential_id),
+        attested_credential_data(credential_id, public_key),
+    )
+    signature = await next_tick(crypto.ec_sign)(private_key, data + client_data_hash)
+
+    # packed self attestation, signed with the credential private key
+    return cbor_make_credential_response(
+        "packed", data, {"alg": COSE_ALG_ES256, "sig": signature}
+    )
+
+
+async def sign_assertion(
+    rp_id_hash: bytes,
+    client_data_hash: bytes,
+    flags: int,
+    credential_id: bytes,
+    private_key: crypto.ECPrivKey,
+    user: dict = None,
+    number_of_credentials: int = None,
+) -> dict:
+    data = auth_data(rp_id_hash, flags, counter.next_value(credential_id))
+    signature = await next_tick(crypto.ec_sign)(private_key, data + client_data_hash)
+
+    return cbor_get_assertion_response(
+        {"id": credential_id, "type": PUBLIC_KEY_CREDENTIAL_TYPE},
+        data,
+        signature,
+        user=user,
+        number_of_credentials=number_of_credentials,
+    )
+
+
+async def authenticator_get_assertion(req: dict, cid: bytes = None):
+    """
+    5.2. authenticatorGetAssertion (0x02)
+
+    The credential is located by unwrapping credential IDs from allowList,
+    no storage is read. Without allowList resident credentials of the relying
+    party are used; if there is more than one, the remaining ones are kept in
+    an assertion cursor of the channel for authenticatorGetNextAssertion.
+    """
+    req = GetAssertionRequest(req)
+    client_data_hash = req.client_data_hash
+
+    rp_id_hash = crypto.sha256(req.rp_id.encode())
 
-def authenticator_get_info() -> tuple[Error, dict]:
-    return info.CBOR_INFO
+    allow_list = credential_ids(req.allow_list)
 
+    user = None
+    number_of_credentials = None
+    remaining_credentials = None
 
-async def authenticator_make_credential(req):
-    raise CborError(Error.NOT_ALLOWED, "Not implemented")
+    if len(allow_list) > 0:
+        found = credential.find(rp_id_hash, allow_list)
+    else:
+        store = resident.get_store()
+        remaining_credentials = store.find(rp_id_hash)
+        found = next(remaining_credentials, None)
+
+        if found is not None:
+            user = {"id": found.user_id}
+            if store.count(rp_id_hash) > 1:
+                number_of_credentials = store.count(rp_id_hash)
+
+            found = (
+                found.credential_id,
+                credential.unwrap(rp_id_hash, found.credential_id),
+            )
+
+    options = req.options
+    if options.get("uv", False):
+        raise CborError(Error.UNSUPPORTED_OPTION, "User verification not supported")
+
+    flags = verify_pin_auth(
+        client_data_hash, req.pin_auth, req.pin_protocol, required=False
+    )
 
+    if options.get("up", True):
+        await verify_user_presence(cid, rp_id_hash)
+        flags |= AuthDataFlag.UP
+
+    if found is None or found[1] is None:
+        raise CborError(Error.NO_CREDENTIALS, "No valid credentials found")
+
+    credential_id, private_key = found
+
+    if number_of_credentials is not None and cid is not None:
+        assertion.open_cursor(
+            cid,
+            assertion.AssertionCursor(
+                rp_id_hash,
+                client_data_hash,
+                flags,
+                remaining_credentials,
+                number_of_credentials - 1,
+            ),
+        )
+
+    return await sign_assertion(
+        rp_id_hash,
+        client_data_hash,
+        flags,
+        credential_id,
+        private_key,
+        user=user,
+        number_of_credentials=number_of_credentials,
+    )
 
-async def authenticator_get_assertion(req):
-    raise CborError(Error.NOT_ALLOWED, "Not implemented")
 
+async def authenticator_get_next_assertion(cid: bytes = None):
+    """
+    5.3. authenticatorGetNextAssertion (0x08)
 
-async def authenticator_get_next_assertion():
-    raise CborError(Error.NOT_ALLOWED, "Not implemented")
+    Signs the next credential of the assertion cursor, without searching the
+    credential store again.
+    """
+    cursor = assertion.get_cursor(cid)
+    if cursor is None:
+        raise CborError(Error.NOT_ALLOWED, "No pending assertion for the channel")
+
+    found = cursor.next()
+    if found is None:
+        assertion.invalidate(cid)
+        raise CborError(Error.NOT_ALLOWED, "No more credentials")
+
+    private_key = credential.unwrap(cursor.rp_id_hash, found.credential_id)
+    if private_key is None:
+        raise CborError(Error.INVALID_CREDENTIAL, "Credential cannot be unwrapped")
+
+    return await sign_assertion(
+        cursor.rp_id_hash,
+        cursor.client_data_hash,
+        cursor.flags,
+        found.credential_id,
+        private_key,
+        user={"id": found.user_id},
+    )
 
 
-def pin_get_retries(req: dict):
+def pin_get_retries(req: ClientPinRequest):
     """
     5.5.3. Getting Retries from Authenticator
     """
-    version = req.get("pinProtocol", 1)
+    version = req.pin_protocol
     return cbor_pin_response(retries=pin.get_pin_protocol(version).get_retries())
 
 
-def pin_get_key_agreement(req: dict):
+def pin_get_key_agreement(req: ClientPinRequest):
     """
     5.5.4. Getting sharedSecret from Authenticator
     """
-    version = req.get("pinProtocol", 1)
+    version = req.pin_protocol
     public_key = pin.get_pin_protocol(version).get_key_agreement_pub_key()
 
     x, y = public_key
@@ -90,70 +370,53 @@ def pin_get_key_agreement(req: dict):
     return cbor_pin_response(key_agreement=key_agreement_aG)
 
 
-async def pin_set_new(req):
+async def pin_set_new(req: ClientPinRequest):
     """
     5.5.5. Setting a New PIN
     """
-    pin_protocol = pin.get_pin_protocol(req.get("pinProtocol", 1))
+    pin_protocol = pin.get_pin_protocol(req.pin_protocol)
 
     if pin_protocol.is_pin_set():
         raise CborError(Error.PIN_AUTH_INVALID, "PIN already set")
 
-    try:
-        key_agreement = req["keyAgreement"]
-        new_pin_enc = req["newPinEnc"]
-        pin_auth = req["pinAuth"]
-    except KeyError as e:
-        raise CborError(Error.MISSING_PARAMETER, e)
+    req.require("key_agreement", "new_pin_enc", "pin_auth")
 
-    await pin_protocol.set_pin(new_pin_enc, pin_auth, key_agreement)
+    await pin_protocol.set_pin(req.new_pin_enc, req.pin_auth, req.key_agreement)
 
 
-async def pin_change(req):
+async def pin_change(req: ClientPinRequest):
     """
     5.5.6. Changing existing PIN
     """
-    pin_protocol = pin.get_pin_protocol(req.get("pinProtocol", 1))
+    pin_protocol = pin.get_pin_protocol(req.pin_protocol)
 
     if pin_protocol.get_retries() <= 0:
         raise CborError(Error.PIN_BLOCKED, "PIN is blocked")
 
-    try:
-        key_agreement = req["keyAgreement"]
-        pin_hash_enc = req["pinHashEnc"]
-        new_pin_enc = req["newPinEnc"]
-        pin_auth = req["pinAuth"]
-    except KeyError as e:
-        raise CborError(Error.MISSING_PARAMETER, e)
+    req.require("key_agreement", "pin_hash_enc", "new_pin_enc", "pin_auth")
 
-    await pin_protocol.verify(pin_hash_enc, key_agreement)
-    await pin_protocol.set_pin(new_pin_enc, pin_auth, key_agreement)
+    await pin_protocol.verify(req.pin_hash_enc, req.key_agreement)
+    await pin_protocol.set_pin(req.new_pin_enc, req.pin_auth, req.key_agreement)
 
 
-async def pin_get_token(req):
+async def pin_get_token(req: ClientPinRequest):
     """
     5.5.7. Getting pinToken from the Authenticator
     """
-    try:
-        key_agreement = req["keyAgreement"]
-        pin_hash_enc = req["pinHashEnc"]
-    except KeyError as e:
-        raise CborError(Error.MISSING_PARAMETER, e)
+    req.require("key_agreement", "pin_hash_enc")
 
-    pin_protocol = pin.get_pin_protocol(req.get("pinProtocol", 1))
-    pin_token = await pin_protocol.verify(pin_hash_enc, key_agreement)
+    pin_protocol = pin.get_pin_protocol(req.pin_protocol)
+    pin_token = await pin_protocol.verify(req.pin_hash_enc, req.key_agreement)
 
     return cbor_pin_response(pin_token=pin_token)
 
 
-async def authenticator_client_PIN(req):
-    try:
-        protocol = req["pinProtocol"]
-        supported_protocols = info.CBOR_INFO["pinUvAuthProtocols"]
-        sub_command = req["subCommand"]
-    except KeyError as e:
-        raise CborError(Error.MISSING_PARAMETER, e)
+async def authenticator_client_PIN(req: dict):
+    req = ClientPinRequest(req)
+    protocol = req.pin_protocol
+    sub_command = req.sub_command
 
+    supported_protocols = info.CBOR_INFO["pinUvAuthProtocols"]
     assert protocol in supported_protocols, f"Unsupported PIN protocol: {protocol}"
 
     pin_sub_commands = {
@@ -175,38 +438,49 @@ async def authenticator_client_PIN(req):
         return result
 
 
-async def process(cmd: CtapCommand) -> bytes:
-    # structure: function, command, has_payload
-    CBOR_COMMANDS = (
-        (authenticator_make_credential, CborCmd.MAKE_CREDENTIAL, True),
-        (authenticator_get_assertion, CborCmd.GET_ASSERTION, True),
+# CBOR command -> (processor(request, cid), has_parameters)
+CBOR_COMMANDS = {
+    int(code): entry
+    for code, entry in (
+        (CborCmd.MAKE_CREDENTIAL, (authenticator_make_credential, True)),
+        (CborCmd.GET_ASSERTION, (authenticator_get_assertion, True)),
         (
-            authenticator_get_next_assertion,
             CborCmd.GET_NEXT_ASSERTION,
-            True,
+            (lambda req, cid: authenticator_get_next_assertion(cid), False),
         ),
-        (authenticator_get_info, CborCmd.GET_INFO, False),
-        (authenticator_client_PIN, CborCmd.CLIENT_PIN, True),
-        (authenticator_reset, CborCmd.RESET, False),
+        (CborCmd.GET_INFO, (lambda req, cid: authenticator_get_info(), False)),
+        (CborCmd.CLIENT_PIN, (lambda req, cid: authenticator_client_PIN(req), True)),
+        (CborCmd.RESET, (lambda req, cid: authenticator_reset(), False)),
     )
+}
+
+_GET_NEXT_ASSERTION = int(CborCmd.GET_NEXT_ASSERTION)
+
 
-    def encode_cbor_error(error: CborError | Error):
-        return struct.pack("<B", error if isinstance(error, Error) else error.code)
+def encode_cbor_error(error: CborError | Error) -> bytes:
+    code = error if isinstance(error, Error) else error.code
+    stats.count(stats.errors, code)
+    return ERROR_BYTES[code]
 
+
+async def process(cmd: CtapCommand) -> bytes:
     try:
         cbor_cmd = int(cmd.payload[0])
-        log.info("Processing CBOR command: %s", hex(cbor_cmd))
+        log.info("Processing CBOR command: %#x", cbor_cmd)
+        stats.count(stats.cbor_commands, cbor_cmd)
 
-        cbor_command = [c for c in CBOR_COMMANDS if c[1] == cbor_cmd]
-        if len(cbor_command) == 0:
-            log.error("Command not supported: %s", hex(cbor_cmd))
+        cbor_command = CBOR_COMMANDS.get(cbor_cmd)
+        if cbor_command is None:
+            log.error("Command not supported: %#x", cbor_cmd)
             return encode_cbor_error(Error.INVALID_COMMAND)
 
-        assert len(cbor_command) == 1, "Command must be unique"
+        processor, has_parameters = cbor_command
 
-        processor, _, has_parameters = cbor_command[0]
+        if cbor_cmd != _GET_NEXT_ASSERTION:
+            # any other command ends pending GetAssertion of the channel
+            assertion.invalidate(cmd.cid)
 
-        proc = None
+        payload = None
         if has_parameters:
             cbor_encoded_paylod = cmd.payload[1:]
             try:
@@ -214,13 +488,11 @@ async def process(cmd: CtapCommand) -> bytes:
                 payload = flynn.loads(cbor_encoded_paylod)
             except decoder.InvalidCborError as e:
                 log.error("Invalid CBOR payload: %s", e)
-                return struct.pack("<B", Error.INVALID_CBOR)
+                return encode_cbor_error(Error.INVALID_CBOR)
 
             log.debug("CBOR request: %s", payload)
 
-            proc = processor(payload)
-        else:
-            proc = processor()
+        proc = processor(payload, cmd.cid)
 
         try:
             await asyncio.sleep(0)
@@ -237,19 +509,36 @@ async def process(cmd: CtapCommand) -> bytes:
 
         payload = resp
 
-        log.info("Finsihed processing CBOR command: %s", hex(cbor_cmd))
+        log.info("Finsihed processing CBOR command: %#x", cbor_cmd)
 
         if payload != None:
             log.debug("CBOR response: %s", payload)
 
             await asyncio.sleep(0)
-            cbor_encoded_payload = flynn.dumps(payload)
 
-            return struct.pack("<B", CBOR_SUCCCESS_CODE) + cbor_encoded_payload
+            # status code and CBOR are written into an arena buffer, released
+            # by the caller once the response has been sent
+            arena = get_arena()
+            writer = Writer(arena.borrow())
+            try:
+                writer.write(CBOR_SUCCESS_BYTE)
+                if isinstance(payload, bytes):
+                    # response encoded in advance
+                    writer.write(payload)
+                else:
+                    flynn.dump(payload, writer)
+            except Exception:
+                arena.release(writer.buffer)
+                raise
+
+            return arena.view(writer.buffer, writer.length)
         else:
             log.debug("No CBOR response")
-            return struct.pack("<B", CBOR_SUCCCESS_CODE)
+            return CBOR_SUCCESS_BYTE
 
     except asyncio.CancelledError:
         log.error("Cancelled, responding with CTAP2_ERR_KEEPALIVE_CANCEL")
-        return struct.pack("<B", Error.KEEPALIVE_CANCEL)
+        return encode_cbor_error(Error.KEEPALIVE_CANCEL)
+    finally:
+        # one write of all state changed by the command, before responding
+        storage.flush()
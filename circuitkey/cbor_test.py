@@ -1,18 +1,31 @@
 import asyncio
+import hashlib
 import struct
 import sys
-from unittest.mock import MagicMock
+import time
+from unittest.mock import AsyncMock, MagicMock
 
+import ecdsa
 import flynn
 import pytest
 import pytest_mock
 
-from circuitkey.schema import CborCmd, CtapCommand, Error, PinSubCmd
+from circuitkey.schema import (
+    AuthDataFlag,
+    CborCmd,
+    ClientPinParam,
+    CtapCommand,
+    Error,
+    GetAssertionParam,
+    MakeCredentialParam,
+    PinSubCmd,
+)
 
 sys.modules["countio"] = MagicMock()
 
 import circuitkey.cbor as cbor
 import circuitkey.info as info
+from circuitkey.ui import UI, LedScheduler, SimulatedButton, SimulatedLed
 
 
 @pytest.mark.asyncio
@@ -75,8 +88,8 @@ async def test_pin_retries(mocker: pytest_mock.MockFixture):
 
     data = await cbor.authenticator_client_PIN(
         {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.GET_RETRIES,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.GET_RETRIES,
         }
     )
 
@@ -94,8 +107,8 @@ async def test_pin_get_key_agreement(mocker: pytest_mock.MockFixture):
 
     data = await cbor.authenticator_client_PIN(
         {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.GET_KEY_AGREEMENT,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.GET_KEY_AGREEMENT,
         }
     )
     assert data == {1: {1: 2, 3: -25, -1: 1, -2: x, -3: y}}
@@ -115,11 +128,11 @@ async def test_pin_set_new_ok(mocker: pytest_mock.MockFixture):
 
     await cbor.authenticator_client_PIN(
         {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.SET_NEW,
-            "keyAgreement": {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
-            "pinAuth": b"\x00" * 16,
-            "newPinEnc": b"\x00" * 16,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.SET_NEW,
+            ClientPinParam.KEY_AGREEMENT: {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
+            ClientPinParam.PIN_AUTH: b"\x00" * 16,
+            ClientPinParam.NEW_PIN_ENC: b"\x00" * 16,
         }
     )
 
@@ -129,7 +142,13 @@ async def test_pin_set_new_ok(mocker: pytest_mock.MockFixture):
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "missing_param",
-    ["pinProtocol", "subCommand", "keyAgreement", "pinAuth", "newPinEnc"],
+    [
+        ClientPinParam.PIN_PROTOCOL,
+        ClientPinParam.SUB_COMMAND,
+        ClientPinParam.KEY_AGREEMENT,
+        ClientPinParam.PIN_AUTH,
+        ClientPinParam.NEW_PIN_ENC,
+    ],
 )
 async def test_pin_set_new_called_with_missing_parameter(
     mocker: pytest_mock.MockFixture, missing_param
@@ -141,11 +160,11 @@ async def test_pin_set_new_called_with_missing_parameter(
 
     with pytest.raises(cbor.CborError) as e:
         req = {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.SET_NEW,
-            "keyAgreement": {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
-            "pinAuth": b"\x00" * 16,
-            "newPinEnc": b"\x00" * 16,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.SET_NEW,
+            ClientPinParam.KEY_AGREEMENT: {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
+            ClientPinParam.PIN_AUTH: b"\x00" * 16,
+            ClientPinParam.NEW_PIN_ENC: b"\x00" * 16,
         }
         del req[missing_param]
         await cbor.authenticator_client_PIN(req)
@@ -180,12 +199,12 @@ async def test_pin_change_ok(mocker: pytest_mock.MockFixture):
 
     await cbor.authenticator_client_PIN(
         {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.CHANGE,
-            "keyAgreement": {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
-            "pinAuth": b"\x00" * 16,
-            "newPinEnc": b"\x00" * 16,
-            "pinHashEnc": b"\x00" * 16,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.CHANGE,
+            ClientPinParam.KEY_AGREEMENT: {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
+            ClientPinParam.PIN_AUTH: b"\x00" * 16,
+            ClientPinParam.NEW_PIN_ENC: b"\x00" * 16,
+            ClientPinParam.PIN_HASH_ENC: b"\x00" * 16,
         }
     )
 
@@ -196,7 +215,14 @@ async def test_pin_change_ok(mocker: pytest_mock.MockFixture):
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "missing_param",
-    ["pinProtocol", "subCommand", "keyAgreement", "pinAuth", "newPinEnc", "pinHashEnc"],
+    [
+        ClientPinParam.PIN_PROTOCOL,
+        ClientPinParam.SUB_COMMAND,
+        ClientPinParam.KEY_AGREEMENT,
+        ClientPinParam.PIN_AUTH,
+        ClientPinParam.NEW_PIN_ENC,
+        ClientPinParam.PIN_HASH_ENC,
+    ],
 )
 async def test_pin_change_called_with_missing_parameter(
     mocker: pytest_mock.MockFixture, missing_param: str
@@ -208,14 +234,14 @@ async def test_pin_change_called_with_missing_parameter(
 
     with pytest.raises(cbor.CborError) as e:
         req = {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.CHANGE,
-            "keyAgreement": {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
-            "pinAuth": b"\x00" * 16,
-            "newPinEnc": b"\x00" * 16,
-            "pinHashEnc": b"\x00" * 16,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.CHANGE,
+            ClientPinParam.KEY_AGREEMENT: {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
+            ClientPinParam.PIN_AUTH: b"\x00" * 16,
+            ClientPinParam.NEW_PIN_ENC: b"\x00" * 16,
+            ClientPinParam.PIN_HASH_ENC: b"\x00" * 16,
         }
-        del req["pinHashEnc"]
+        del req[ClientPinParam.PIN_HASH_ENC]
         await cbor.authenticator_client_PIN(req)
 
         assert e.code == Error.INVALID_PARAMETER
@@ -233,10 +259,10 @@ async def test_pin_token_ok(mocker: pytest_mock.MockFixture):
 
     data = await cbor.authenticator_client_PIN(
         {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.GET_TOKEN,
-            "keyAgreement": {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
-            "pinHashEnc": b"\x00" * 16,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.GET_TOKEN,
+            ClientPinParam.KEY_AGREEMENT: {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
+            ClientPinParam.PIN_HASH_ENC: b"\x00" * 16,
         }
     )
     assert data == {2: "HASH"}
@@ -245,7 +271,12 @@ async def test_pin_token_ok(mocker: pytest_mock.MockFixture):
 @pytest.mark.asyncio
 @pytest.mark.parametrize(
     "missing_param",
-    ["pinProtocol", "subCommand", "keyAgreement", "pinHashEnc"],
+    [
+        ClientPinParam.PIN_PROTOCOL,
+        ClientPinParam.SUB_COMMAND,
+        ClientPinParam.KEY_AGREEMENT,
+        ClientPinParam.PIN_HASH_ENC,
+    ],
 )
 async def test_pin_token_called_with_missing_parameter(
     mocker: pytest_mock.MockFixture, missing_param: str
@@ -256,12 +287,358 @@ async def test_pin_token_called_with_missing_parameter(
 
     with pytest.raises(cbor.CborError) as e:
         req = {
-            "pinProtocol": 1,
-            "subCommand": PinSubCmd.GET_TOKEN,
-            "keyAgreement": {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
-            "pinHashEnc": b"\x00" * 16,
+            ClientPinParam.PIN_PROTOCOL: 1,
+            ClientPinParam.SUB_COMMAND: PinSubCmd.GET_TOKEN,
+            ClientPinParam.KEY_AGREEMENT: {1: 2, 3: -25, -1: 1, -2: 1, -3: 2},
+            ClientPinParam.PIN_HASH_ENC: b"\x00" * 16,
         }
         del req[missing_param]
         await cbor.authenticator_client_PIN(req)
 
         assert e.code == Error.INVALID_PARAMETER
+
+
+@pytest.fixture
+def authenticator(mocker: pytest_mock.MockFixture, ram_storage):
+    import circuitkey.counter as counter
+    import circuitkey.credential as credential
+    import circuitkey.presence as presence
+    import circuitkey.resident as resident
+
+    counter.reset()
+    credential.reset()
+    resident.reset()
+
+    ui = MagicMock()
+    ui.verify_user_presence = AsyncMock()
+    mocker.patch("circuitkey.ui.get_ui", return_value=ui)
+
+    pin_protocol = mocker.patch("circuitkey.pin.PinProtocolV1")
+    pin_protocol.is_pin_set.return_value = False
+    mocker.patch("circuitkey.pin.get_pin_protocol", return_value=pin_protocol)
+
+    yield ui
+
+    credential.reset()
+    resident.reset()
+    presence.invalidate()
+
+
+def make_credential_request(params: dict = None):
+    req = {
+        MakeCredentialParam.CLIENT_DATA_HASH: b"\x01" * 32,
+        MakeCredentialParam.RP: {"id": "example.com", "name": "Example"},
+        MakeCredentialParam.USER: {"id": b"\x02" * 16, "name": "user"},
+        MakeCredentialParam.PUB_KEY_CRED_PARAMS: [{"alg": -7, "type": "public-key"}],
+    }
+    req.update(params or {})
+    return req
+
+
+def parse_attested_credential(auth_data: bytes):
+    cred_id_len = int.from_bytes(auth_data[53:55], "big")
+    cred_id = auth_data[55 : 55 + cred_id_len]
+    cose_key = flynn.loads(auth_data[55 + cred_id_len :])
+
+    public_key = ecdsa.VerifyingKey.from_string(
+        b"\x04" + cose_key[-2] + cose_key[-3], curve=ecdsa.NIST256p
+    )
+    return cred_id, public_key
+
+
+def verify_signature(public_key, signature: bytes, data: bytes):
+    assert public_key.verify(
+        signature, data, hashfunc=hashlib.sha256, sigdecode=ecdsa.util.sigdecode_der
+    )
+
+
+@pytest.mark.asyncio
+async def test_make_credential_and_get_assertion(authenticator: MagicMock):
+    import circuitkey.crypto as crypto
+
+    client_data_hash = b"\x01" * 32
+    rp_id_hash = crypto.sha256(b"example.com")
+
+    response = await cbor.authenticator_make_credential(make_credential_request())
+
+    auth_data = response[2]
+    assert response[1] == "packed"
+    assert auth_data[:32] == rp_id_hash
+    assert auth_data[32] == AuthDataFlag.UP | AuthDataFlag.AT
+    assert auth_data[37:53] == bytes(info.CBOR_INFO["aaguid"])
+
+    cred_id, public_key = parse_attested_credential(auth_data)
+    verify_signature(public_key, response[3]["sig"], auth_data + client_data_hash)
+
+    response = await cbor.authenticator_get_assertion(
+        {
+            GetAssertionParam.RP_ID: "example.com",
+            GetAssertionParam.CLIENT_DATA_HASH: client_data_hash,
+            GetAssertionParam.ALLOW_LIST: [
+                {"id": b"\x00" * 65, "type": "public-key"},
+                {"id": cred_id, "type": "public-key"},
+            ],
+        }
+    )
+
+    assert response[1] == {"id": cred_id, "type": "public-key"}
+    assert response[2][:32] == rp_id_hash
+    assert response[2][32] == AuthDataFlag.UP
+    assert int.from_bytes(response[2][33:37], "big") > int.from_bytes(
+        auth_data[33:37], "big"
+    )
+    verify_signature(public_key, response[3], response[2] + client_data_hash)
+    assert authenticator.verify_user_presence.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_user_presence_cache_window(authenticator: MagicMock, monkeypatch):
+    import circuitkey.presence as presence
+
+    monkeypatch.setattr(presence, "window", 5)
+    cid = b"\x00\x00\x00\x01"
+
+    response = await cbor.authenticator_make_credential(make_credential_request(), cid)
+    cred_id, _ = parse_attested_credential(response[2])
+
+    request = {
+        GetAssertionParam.RP_ID: "example.com",
+        GetAssertionParam.CLIENT_DATA_HASH: b"\x01" * 32,
+        GetAssertionParam.ALLOW_LIST: [{"id": cred_id, "type": "public-key"}],
+    }
+
+    response = await cbor.authenticator_get_assertion(request, cid)
+    assert response[2][32] == AuthDataFlag.UP
+    assert authenticator.verify_user_presence.call_count == 1
+
+    # another channel needs its own touch
+    await cbor.authenticator_get_assertion(request, b"\x00\x00\x00\x02")
+    assert authenticator.verify_user_presence.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_make_credential_excluded(authenticator: MagicMock):
+    response = await cbor.authenticator_make_credential(make_credential_request())
+    cred_id, _ = parse_attested_credential(response[2])
+
+    with pytest.raises(cbor.CborError) as e:
+        await cbor.authenticator_make_credential(
+            make_credential_request(
+                {
+                    MakeCredentialParam.EXCLUDE_LIST: [
+                        {"id": cred_id, "type": "public-key"}
+                    ]
+                }
+            )
+        )
+
+    assert e.value.code == Error.CREDENTIAL_EXCLUDED
+
+
+@pytest.mark.asyncio
+async def test_make_credential_unsupported_algorithm(authenticator: MagicMock):
+    with pytest.raises(cbor.CborError) as e:
+        await cbor.authenticator_make_credential(
+            make_credential_request(
+                {
+                    MakeCredentialParam.PUB_KEY_CRED_PARAMS: [
+                        {"alg": -257, "type": "public-key"}
+                    ]
+                }
+            )
+        )
+
+    assert e.value.code == Error.UNSUPPORTED_ALGORITHM
+
+
+@pytest.mark.asyncio
+async def test_make_credential_pin_required(authenticator: MagicMock):
+    import circuitkey.pin as pin
+
+    pin.get_pin_protocol().is_pin_set.return_value = True
+
+    with pytest.raises(cbor.CborError) as e:
+        await cbor.authenticator_make_credential(make_credential_request())
+
+    assert e.value.code == Error.PUAT_REQUIRED
+
+
+@pytest.mark.asyncio
+async def test_get_assertion_no_credentials(authenticator: MagicMock):
+    with pytest.raises(cbor.CborError) as e:
+        await cbor.authenticator_get_assertion(
+            {
+                GetAssertionParam.RP_ID: "example.com",
+                GetAssertionParam.CLIENT_DATA_HASH: b"\x01" * 32,
+                GetAssertionParam.ALLOW_LIST: [{"id": b"\x00", "type": "public-key"}],
+            }
+        )
+
+    assert e.value.code == Error.NO_CREDENTIALS
+
+
+@pytest.mark.asyncio
+async def test_get_assertion_with_resident_credentials(authenticator: MagicMock):
+    cred_ids = []
+    for user_id in (b"user-1", b"user-2"):
+        response = await cbor.authenticator_make_credential(
+            make_credential_request(
+                {
+                    MakeCredentialParam.USER: {"id": user_id, "name": "user"},
+                    MakeCredentialParam.OPTIONS: {"rk": True},
+                }
+            )
+        )
+        cred_ids.append(parse_attested_credential(response[2]))
+
+    response = await cbor.authenticator_get_assertion(
+        {
+            GetAssertionParam.RP_ID: "example.com",
+            GetAssertionParam.CLIENT_DATA_HASH: b"\x03" * 32,
+        }
+    )
+
+    cred_id, public_key = cred_ids[0]
+    assert response[1]["id"] == cred_id
+    assert response[4] == {"id": b"user-1"}
+    assert response[5] == 2
+    verify_signature(public_key, response[3], response[2] + b"\x03" * 32)
+
+
+@pytest.mark.asyncio
+async def test_make_credential_resident_store_full(
+    authenticator: MagicMock, mocker: pytest_mock.MockFixture
+):
+    import circuitkey.resident as resident
+
+    mocker.patch.object(resident.get_store(), "is_full", return_value=True)
+
+    with pytest.raises(cbor.CborError) as e:
+        await cbor.authenticator_make_credential(
+            make_credential_request({MakeCredentialParam.OPTIONS: {"rk": True}})
+        )
+
+    assert e.value.code == Error.KEY_STORE_FULL
+
+
+@pytest.mark.asyncio
+async def test_make_credential_overwrites_user_in_full_store(
+    authenticator: MagicMock,
+):
+    import circuitkey.resident as resident
+
+    store = resident.get_store()
+    rk = {MakeCredentialParam.OPTIONS: {"rk": True}}
+    for i in range(store.capacity):
+        await cbor.authenticator_make_credential(
+            make_credential_request(
+                {
+                    MakeCredentialParam.USER: {"id": b"user-%d" % i, "name": "user"},
+                    **rk,
+                }
+            )
+        )
+    assert store.is_full()
+
+    response = await cbor.authenticator_make_credential(
+        make_credential_request(
+            {MakeCredentialParam.USER: {"id": b"user-0", "name": "user"}, **rk}
+        )
+    )
+
+    cred_id, _ = parse_attested_credential(response[2])
+    assert len(store) == store.capacity
+    assert store.get(cred_id).user_id == b"user-0"
+
+    with pytest.raises(cbor.CborError) as e:
+        await cbor.authenticator_make_credential(
+            make_credential_request(
+                {MakeCredentialParam.USER: {"id": b"user-new", "name": "user"}, **rk}
+            )
+        )
+
+    assert e.value.code == Error.KEY_STORE_FULL
+
+
+@pytest.mark.asyncio
+async def test_get_next_assertion(authenticator: MagicMock):
+    cid = b"\x00\x00\x00\x01"
+    user_ids = [b"user-1", b"user-2", b"user-3"]
+
+    for user_id in user_ids:
+        await cbor.authenticator_make_credential(
+            make_credential_request(
+                {
+                    MakeCredentialParam.USER: {"id": user_id},
+                    MakeCredentialParam.OPTIONS: {"rk": True},
+                }
+            )
+        )
+
+    async def call(cbor_cmd, req=None, channel=cid):
+        payload = struct.pack("<B", cbor_cmd)
+        if req is not None:
+            payload += flynn.dumps(req)
+        response = await cbor.process(CtapCommand(channel, 0x10, payload))
+        return response[0], flynn.loads(response[1:]) if len(response) > 1 else None
+
+    get_assertion = {
+        GetAssertionParam.RP_ID: "example.com",
+        GetAssertionParam.CLIENT_DATA_HASH: b"\x03" * 32,
+    }
+
+    status, response = await call(CborCmd.GET_ASSERTION, get_assertion)
+    assert status == 0x00
+    assert response[4] == {"id": b"user-1"}
+    assert response[5] == 3
+
+    # other channel does not see the cursor
+    status, _ = await call(CborCmd.GET_NEXT_ASSERTION, channel=b"\x00\x00\x00\x02")
+    assert status == Error.NOT_ALLOWED
+
+    for user_id in user_ids[1:]:
+        status, response = await call(CborCmd.GET_NEXT_ASSERTION)
+        assert status == 0x00
+        assert response[4] == {"id": user_id}
+        assert 5 not in response
+
+    status, _ = await call(CborCmd.GET_NEXT_ASSERTION)
+    assert status == Error.NOT_ALLOWED
+
+    # any other command invalidates the cursor
+    await call(CborCmd.GET_ASSERTION, get_assertion)
+    await call(CborCmd.GET_INFO)
+
+    status, _ = await call(CborCmd.GET_NEXT_ASSERTION)
+    assert status == Error.NOT_ALLOWED
+
+
+def test_reset_only_within_10_s_of_power_up(virtual_time, mocker):
+    user_interface = UI(SimulatedButton(), LedScheduler(SimulatedLed()))
+    mocker.patch("circuitkey.ui.get_ui", return_value=user_interface)
+    storage_reset = mocker.patch("circuitkey.storage.reset")
+
+    async def touch(after):
+        await asyncio.sleep(after)
+        user_interface.button.press()
+
+    async def scenario():
+        # touched 5 s after power up
+        toucher = asyncio.create_task(touch(5))
+        await cbor.authenticator_reset()
+        await toucher
+        assert time.monotonic() == 5
+
+        # no touch, gives up after 30 s
+        with pytest.raises(cbor.CborError) as e:
+            await cbor.authenticator_reset()
+        assert e.value.code == Error.USER_ACTION_TIMEOUT
+        assert time.monotonic() == 35
+
+        with pytest.raises(cbor.CborError) as e:
+            await cbor.authenticator_reset()
+        assert e.value.code == Error.NOT_ALLOWED
+
+    virtual_time.run_until_complete(scenario())
+
+    storage_reset.assert_called_once()
@@ -0,0 +1,43 @@
+import pytest
+
+from circuitkey import arena, storage
+from circuitkey.storage_backend import RamBackend
+
+
+@pytest.fixture
+def ram_storage(monkeypatch):
+    """
+    Empty RAM backend, the previous backend is restored afterwards.
+    """
+    backend = RamBackend()
+
+    # restored by monkeypatch on teardown
+    monkeypatch.setattr(storage.get_backend, "_backend", None, raising=False)
+    storage.set_backend(backend)
+
+    yield backend
+
+    storage.invalidate()
+
+
+@pytest.fixture
+def message_arena(monkeypatch):
+    """
+    Arena with all buffers available, the shared one is restored afterwards.
+    """
+    fresh = arena.Arena(arena.MESSAGE_SIZE, arena.BUFFERS)
+    monkeypatch.setattr(arena.get_arena, "_arena", fresh, raising=False)
+
+    return fresh
+
+
+@pytest.fixture
+def virtual_time():
+    """
+    Event loop on a virtual clock, also read by time.monotonic(_ns). Run
+    coroutines with virtual_time.run_until_complete().
+    """
+    from host import vclock
+
+    with vclock.patch_time() as loop:
+        yield loop
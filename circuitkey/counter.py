@@ -0,0 +1,91 @@
+# Signature counters.
+#
+# A counter reserves a block of values with one durable write of the block's
+# last value and then hands the values out from RAM. After a reboot the
+# counter continues after the last reserved value, skipping whatever was left
+# of the block, so relying parties never see a counter going backwards.
+#
+# There is one global counter unless per_credential is enabled. Every
+# per-credential counter is a separate record in the record log, so only
+# resident credentials, whose number is limited by the resident store, get
+# their own counter. Other credentials use the global one.
+
+import adafruit_logging as logging
+
+import circuitkey.crypto as crypto
+import circuitkey.resident as resident
+import circuitkey.storage as storage
+
+log = logging.getLogger(__name__)
+
+BLOCK_SIZE = 32
+
+per_credential = False
+
+
+class LeasedCounter:
+    def __init__(self, bucket: storage.CounterBucket, block_size: int):
+        if block_size < 1:
+            raise ValueError("Block size must be positive")
+
+        self._bucket = bucket
+        self._block_size = block_size
+
+        self._next = None
+        self._limit = None  # last reserved value
+
+    def _reserve(self) -> None:
+        self._limit = self._next + self._block_size - 1
+        # the reservation has to reach flash before any value is used
+        self._bucket.set(self._limit, durable=True)
+        log.debug("Reserved counter values %d-%d", self._next, self._limit)
+
+    def next(self) -> int:
+        if self._next is None:
+            self._next = self._bucket.get() + 1
+            self._limit = self._next - 1
+
+        if self._next > self._limit:
+            self._reserve()
+
+        value = self._next
+        self._next += 1
+        return value
+
+
+def _bucket_name(credential_id: bytes | None) -> str:
+    if credential_id is None or not per_credential:
+        return "counter"
+
+    if credential_id not in resident.get_store():
+        return "counter"
+
+    return "counter_" + crypto.sha256(credential_id)[:8].hex()
+
+
+def get_counter(credential_id: bytes = None) -> LeasedCounter:
+    if "_counters" not in get_counter.__dict__:
+        get_counter._counters = {}
+
+    name = _bucket_name(credential_id)
+    if name not in get_counter._counters:
+        get_counter._counters[name] = LeasedCounter(
+            storage.CounterBucket(name), BLOCK_SIZE
+        )
+
+    return get_counter._counters[name]
+
+
+def next_value(credential_id: bytes = None) -> int:
+    """
+    Next signature counter value of the credential.
+    """
+    return get_counter(credential_id).next()
+
+
+def reset() -> None:
+    """
+    Forget counters held in RAM, e.g. after storage has been reset.
+    """
+    if "_counters" in get_counter.__dict__:
+        del get_counter._counters
@@ -0,0 +1,98 @@
+import pytest
+
+from circuitkey import counter, resident, storage
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(ram_storage, monkeypatch):
+    resident.reset()
+    counter.reset()
+
+    # formatting the empty log is not counted
+    storage.get_log()
+    monkeypatch.setattr(storage, "io_stats", {"reads": 0, "writes": 0})
+
+    yield
+
+    resident.reset()
+    counter.reset()
+
+
+def reboot():
+    storage.invalidate()
+    counter.reset()
+
+
+def test_one_write_per_block():
+    values = [counter.next_value() for _ in range(2 * counter.BLOCK_SIZE)]
+
+    assert values == list(range(1, 2 * counter.BLOCK_SIZE + 1))
+    assert storage.io_stats["writes"] == 2
+
+
+def test_reboot_skips_to_next_block():
+    first = [counter.next_value() for _ in range(3)]
+    reboot()
+
+    assert counter.next_value() == counter.BLOCK_SIZE + 1
+    assert first == [1, 2, 3]
+
+
+def test_reservation_is_durable():
+    counter.next_value()
+
+    # unsaved changes are dropped
+    storage.invalidate()
+
+    assert storage.CounterBucket().get() == counter.BLOCK_SIZE
+
+
+def test_continues_from_stored_counter():
+    storage.CounterBucket().set(41, durable=True)
+    reboot()
+
+    assert counter.next_value() == 42
+
+
+def test_block_size():
+    bucket = storage.CounterBucket()
+    leased = counter.LeasedCounter(bucket, block_size=1)
+
+    assert [leased.next() for _ in range(3)] == [1, 2, 3]
+    assert storage.io_stats["writes"] == 3
+
+
+def test_block_size_is_read_at_runtime(monkeypatch):
+    monkeypatch.setattr(counter, "BLOCK_SIZE", 1)
+
+    for _ in range(3):
+        counter.next_value()
+
+    assert storage.io_stats["writes"] == 3
+
+
+def test_per_credential(monkeypatch):
+    monkeypatch.setattr(counter, "per_credential", True)
+    store = resident.get_store()
+    store.add(b"\x00" * 32, b"\x01" * 16, b"user-1")
+    store.add(b"\x00" * 32, b"\x02" * 16, b"user-2")
+
+    assert counter.next_value(b"\x01" * 16) == 1
+    assert counter.next_value(b"\x01" * 16) == 2
+    assert counter.next_value(b"\x02" * 16) == 1
+    assert counter.next_value() == 1
+
+
+def test_per_credential_only_for_resident_credentials(monkeypatch):
+    monkeypatch.setattr(counter, "per_credential", True)
+
+    for i in range(100):
+        counter.next_value(b"%16d" % i)
+
+    assert counter.next_value() == 101
+    assert storage.get_log().keys() == [b"counter"]
+
+
+def test_global_counter_by_default():
+    assert counter.next_value(b"\x01" * 16) == 1
+    assert counter.next_value(b"\x02" * 16) == 2
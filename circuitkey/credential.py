@@ -0,0 +1,156 @@
+# Non-resident (stateless) credentials.
+#
+# The credential ID is the credential private key encrypted and authenticated
+# under the device master key and bound to rpIdHash, so nothing has to be
+# stored on the device when a credential is created or used.
+#
+# Credential ID layout (version 1, 65 bytes):
+#
+#   version (1) | nonce (16) | AES-256-CBC(wrap key, private key) (32) | tag (16)
+#
+#   wrap key = HMAC-SHA256(encryption key, nonce | rpIdHash)
+#   tag      = HMAC-SHA256(mac key, version | nonce | ciphertext | rpIdHash)[:16]
+#
+# Every credential is encrypted under its own wrap key, which makes the fixed
+# (zero) IV of the crypto backends safe to use.
+
+import os
+import typing
+
+import adafruit_logging as logging
+
+import circuitkey.crypto as crypto
+import circuitkey.storage as storage
+from circuitkey.schema import COSE_ALG_ES256
+from circuitkey.util import equal
+
+log = logging.getLogger(__name__)
+
+VERSION = 0x01
+
+_NONCE_LEN = 16
+_KEY_LEN = 32
+_TAG_LEN = 16
+
+_TAG_OFFSET = 1 + _NONCE_LEN + _KEY_LEN
+
+CREDENTIAL_ID_LEN = _TAG_OFFSET + _TAG_LEN
+
+
+def _master_keys() -> typing.Tuple[bytes, bytes]:
+    if "_keys" not in _master_keys.__dict__:
+        bucket = storage.SecretBucket()
+        master_key = bucket.get_master_key()
+
+        if master_key is None:
+            log.info("Generating new master key")
+            master_key = os.urandom(32)
+            bucket.set_master_key(master_key)
+
+        _master_keys._keys = (
+            crypto.hmac_sha256(b"circuitkey credential encryption", master_key),
+            crypto.hmac_sha256(b"circuitkey credential authentication", master_key),
+        )
+
+    return _master_keys._keys
+
+
+def preload() -> None:
+    """
+    Load (or generate) master keys ahead of the first request.
+    """
+    _master_keys()
+
+
+def reset() -> None:
+    """
+    Forget cached master keys, e.g. after storage has been reset.
+    """
+    if "_keys" in _master_keys.__dict__:
+        del _master_keys._keys
+
+
+def wrap(rp_id_hash: bytes, private_key: crypto.ECPrivKey) -> bytes:
+    """
+    Create credential ID which holds the private key bound to rpIdHash.
+    """
+    assert len(private_key) == _KEY_LEN, "Private key must be 32 bytes long"
+
+    enc_key, mac_key = _master_keys()
+
+    nonce = os.urandom(_NONCE_LEN)
+    wrap_key = crypto.hmac_sha256(nonce + rp_id_hash, enc_key)
+    ciphertext = crypto.aes256_cbc_encrypt(wrap_key, private_key, _KEY_LEN)
+
+    credential_id = bytes((VERSION,)) + nonce + bytes(ciphertext)
+    tag = crypto.hmac_sha256(credential_id + rp_id_hash, mac_key)[:_TAG_LEN]
+
+    return credential_id + tag
+
+
+def cose_key(public_key: crypto.ECPubKey) -> dict:
+    """
+    COSE_Key of ES256 (P-256) public key.
+    """
+    x, y = (c if isinstance(c, bytes) else c.to_bytes(32, "big") for c in public_key)
+
+    return {1: 2, 3: COSE_ALG_ES256, -1: 1, -2: x, -3: y}
+
+
+def _is_well_formed(credential_id: bytes) -> bool:
+    return len(credential_id) == CREDENTIAL_ID_LEN and credential_id[0] == VERSION
+
+
+def _decrypt(rp_id_hash: bytes, credential_id: bytes) -> crypto.ECPrivKey:
+    enc_key, _ = _master_keys()
+
+    nonce = credential_id[1 : 1 + _NONCE_LEN]
+    ciphertext = credential_id[1 + _NONCE_LEN : _TAG_OFFSET]
+
+    wrap_key = crypto.hmac_sha256(nonce + rp_id_hash, enc_key)
+    return bytes(crypto.aes256_cbc_decrypt(wrap_key, ciphertext))
+
+
+def unwrap(rp_id_hash: bytes, credential_id: bytes) -> crypto.ECPrivKey | None:
+    """
+    Private key of the credential or None if the credential ID was not
+    created by this authenticator for the given rpIdHash.
+    """
+    if not _is_well_formed(credential_id):
+        return None
+
+    _, mac_key = _master_keys()
+
+    tag = crypto.hmac_sha256(credential_id[:_TAG_OFFSET] + rp_id_hash, mac_key)
+    if not equal(tag[:_TAG_LEN], credential_id[_TAG_OFFSET:]):
+        return None
+
+    return _decrypt(rp_id_hash, credential_id)
+
+
+def find(
+    rp_id_hash: bytes, credential_ids: typing.Sequence[bytes]
+) -> typing.Tuple[bytes, crypto.ECPrivKey] | None:
+    """
+    First credential from the list (e.g. allowList or excludeList) which
+    belongs to this authenticator and rpIdHash. All tags are computed in one
+    batch, so only the matching credential is decrypted.
+
+    :return: tuple of credential ID and its private key or None
+    """
+    candidates = [c for c in credential_ids if _is_well_formed(c)]
+    if len(candidates) == 0:
+        return None
+
+    _, mac_key = _master_keys()
+
+    tags = crypto.hmac_sha256_batch(
+        [c[:_TAG_OFFSET] + rp_id_hash for c in candidates], mac_key
+    )
+
+    for i, credential_id in enumerate(candidates):
+        offset = i * crypto.SHA256_DIGEST_LEN
+        if equal(tags[offset : offset + _TAG_LEN], credential_id[_TAG_OFFSET:]):
+            return credential_id, _decrypt(rp_id_hash, credential_id)
+
+    return None
@@ -0,0 +1,82 @@
+import pytest
+
+from circuitkey import credential, crypto, storage
+
+RP_ID_HASH = crypto.sha256(b"example.com")
+OTHER_RP_ID_HASH = crypto.sha256(b"example.org")
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(ram_storage):
+    credential.reset()
+
+    yield
+
+    credential.reset()
+
+
+def test_wrap_unwrap():
+    _, private_key = crypto.ec_genkey()
+
+    credential_id = credential.wrap(RP_ID_HASH, private_key)
+
+    assert len(credential_id) == credential.CREDENTIAL_ID_LEN
+    assert private_key not in credential_id
+    assert credential.unwrap(RP_ID_HASH, credential_id) == private_key
+
+
+def test_unwrap_is_bound_to_rp_id_hash():
+    _, private_key = crypto.ec_genkey()
+
+    credential_id = credential.wrap(RP_ID_HASH, private_key)
+
+    assert credential.unwrap(OTHER_RP_ID_HASH, credential_id) is None
+
+
+def test_unwrap_rejects_tampered_credential_id():
+    _, private_key = crypto.ec_genkey()
+
+    credential_id = bytearray(credential.wrap(RP_ID_HASH, private_key))
+    credential_id[20] ^= 0x01
+
+    assert credential.unwrap(RP_ID_HASH, bytes(credential_id)) is None
+    assert credential.unwrap(RP_ID_HASH, b"\x01" * 10) is None
+
+
+def test_master_key_is_persisted():
+    _, private_key = crypto.ec_genkey()
+    credential_id = credential.wrap(RP_ID_HASH, private_key)
+
+    credential.reset()
+
+    assert storage.SecretBucket().get_master_key() is not None
+    assert credential.unwrap(RP_ID_HASH, credential_id) == private_key
+
+
+def test_credentials_are_invalid_after_master_key_change():
+    _, private_key = crypto.ec_genkey()
+    credential_id = credential.wrap(RP_ID_HASH, private_key)
+
+    storage.SecretBucket().set_master_key(b"\x00" * 32)
+    storage.flush()
+    credential.reset()
+
+    assert credential.unwrap(RP_ID_HASH, credential_id) is None
+
+
+def test_find():
+    _, private_key = crypto.ec_genkey()
+    credential_id = credential.wrap(RP_ID_HASH, private_key)
+    other_id = credential.wrap(OTHER_RP_ID_HASH, crypto.ec_genkey()[1])
+
+    found = credential.find(RP_ID_HASH, [b"foreign", other_id, credential_id])
+
+    assert found == (credential_id, private_key)
+    assert credential.find(RP_ID_HASH, [other_id]) is None
+    assert credential.find(RP_ID_HASH, []) is None
+
+
+def test_cose_key():
+    key = credential.cose_key(crypto.ECPubKey(1, b"\x02" * 32))
+
+    assert key == {1: 2, 3: -7, -1: 1, -2: b"\x00" * 31 + b"\x01", -3: b"\x02" * 32}
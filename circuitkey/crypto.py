@@ -5,11 +5,15 @@ from collections import namedtuple
 import adafruit_hashlib as hashlib
 import adafruit_logging as logging
 
+from circuitkey import trace
+
 logger = logging.getLogger(__name__)
 
 ECPubKey = namedtuple("ECPubKey", ["x", "y"])
 ECPrivKey = bytes
 
+SHA256_DIGEST_LEN = 32
+
 
 class Backend:
     def aes256_cbc_encrypt(self, key: bytes, data: bytes, buffer_size: int) -> bytes:
@@ -24,12 +28,64 @@ class Backend:
     def sha256(self, data: bytes) -> bytes:
         return hashlib.sha256(data).digest()
 
+    def hmac_sha256_batch(
+        self, msgs: typing.Sequence[bytes], secret: bytes
+    ) -> bytearray:
+        """
+        HMAC-SHA256 of every message under the same secret. The keyed
+        inner/outer state is computed once and copied for each message.
+
+        :return: digests concatenated into one buffer (32 bytes per message)
+        """
+        keyed = hmac.new(secret, digestmod=hashlib.sha256)
+        output = bytearray(SHA256_DIGEST_LEN * len(msgs))
+        view = memoryview(output)
+
+        offset = 0
+        for msg in msgs:
+            h = keyed.copy()
+            h.update(msg)
+            view[offset : offset + SHA256_DIGEST_LEN] = h.digest()
+            offset += SHA256_DIGEST_LEN
+
+        return output
+
+    def sha256_batch(
+        self, msgs: typing.Sequence[bytes], prefix: bytes = b""
+    ) -> bytearray:
+        """
+        SHA-256 of prefix + message for every message. The prefix is hashed
+        only once.
+
+        :return: digests concatenated into one buffer (32 bytes per message)
+        """
+        prefixed = hashlib.sha256(prefix)
+        output = bytearray(SHA256_DIGEST_LEN * len(msgs))
+        view = memoryview(output)
+
+        offset = 0
+        for msg in msgs:
+            h = prefixed.copy()
+            h.update(msg)
+            view[offset : offset + SHA256_DIGEST_LEN] = h.digest()
+            offset += SHA256_DIGEST_LEN
+
+        return output
+
     def ec_genkey(self) -> typing.Tuple[ECPubKey, ECPrivKey]:
         raise NotImplementedError()
 
     def ec_shared_secret(self, private_key: ECPrivKey, public_key: ECPubKey) -> bytes:
         raise NotImplementedError()
 
+    def ec_sign(self, private_key: ECPrivKey, data: bytes) -> bytes:
+        """
+        ECDSA (P-256, SHA-256) signature of data.
+
+        :return: DER encoded signature
+        """
+        raise NotImplementedError()
+
 
 class CircuitPythonBackend(Backend):
     def aes256_cbc_encrypt(self, key: bytes, data: bytes, buffer_size: int) -> bytes:
@@ -54,7 +110,7 @@ class CircuitPythonBackend(Backend):
         import crypto
 
         pub_key, priv_key = crypto.gen_keys()
-        x, y = pub_key[0].to_bytes(32, "big"), pub_key[1].to_bytes(32, "big")
+        x, y = pub_key  # crypto module already returns 32 bytes coordinates
 
         return ECPubKey(x, y), priv_key
 
@@ -66,6 +122,11 @@ class CircuitPythonBackend(Backend):
 
         return crypto.shared_secret(x, y, private_key)
 
+    def ec_sign(self, private_key: ECPrivKey, data: bytes) -> bytes:
+        import crypto
+
+        return crypto.sign(private_key, self.sha256(data))
+
 
 class CPythonBackend(Backend):
     def aes256_cbc_encrypt(self, key: bytes, data: bytes, buffer_size: int) -> bytes:
@@ -91,16 +152,25 @@ class CPythonBackend(Backend):
 
         sk = SigningKey.generate(NIST256p)
         point = sk.verifying_key.pubkey.point
-        return ECPubKey(point.x(), point.y()), sk.to_pem()
+        # raw 32 bytes scalar, the same format as the CircuitPython crypto module
+        return ECPubKey(point.x(), point.y()), sk.to_string()
+
+    def _signing_key(self, private_key: ECPrivKey):
+        from ecdsa import NIST256p, SigningKey
+
+        if private_key.startswith(b"-----BEGIN"):
+            return SigningKey.from_pem(private_key)
+
+        return SigningKey.from_string(private_key, curve=NIST256p)
 
     def ec_shared_secret(self, private_key: ECPrivKey, public_key: ECPubKey) -> bytes:
-        from ecdsa import NIST256p, SigningKey, VerifyingKey
+        from ecdsa import NIST256p, VerifyingKey
         from ecdsa.ecdh import ECDH
         from ecdsa.ellipticcurve import Point
 
         curve = NIST256p
 
-        priv = SigningKey.from_pem(private_key)
+        priv = self._signing_key(private_key)
         pub = VerifyingKey.from_public_point(
             Point(curve=curve.curve, x=public_key.x, y=public_key.y), curve=curve
         )
@@ -108,6 +178,13 @@ class CPythonBackend(Backend):
         ecdh = ECDH(curve=curve, private_key=priv, public_key=pub)
         return hashlib.sha256(ecdh.generate_sharedsecret_bytes()).digest()
 
+    def ec_sign(self, private_key: ECPrivKey, data: bytes) -> bytes:
+        from ecdsa.util import sigencode_der
+
+        return self._signing_key(private_key).sign_deterministic(
+            data, hashfunc=hashlib.sha256, sigencode=sigencode_der
+        )
+
 
 def backend():
     try:
@@ -145,6 +222,23 @@ _methods = list(_methods) + list(  # include the super class methods
 )
 
 wrap_method = lambda func: lambda *args, **kwargs: func(_bcd, *args, **kwargs)
+
+
+def _traced(op: int, func):
+    def wrapper(*args, **kwargs):
+        trace.record(trace.CRYPTO_START, None, op)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            trace.record(trace.CRYPTO_END, None, op)
+
+    return wrapper
+
+
 for name, func in _methods:
     if name not in globals():
         globals()[name] = wrap_method(func)
+
+# slow operations are recorded in the trace buffer
+for op, name in enumerate(trace.CRYPTO_OPS):
+    globals()[name] = _traced(op, globals()[name])
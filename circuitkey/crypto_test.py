@@ -1,3 +1,5 @@
+import hashlib
+
 import circuitkey.crypto as crypto
 
 
@@ -10,3 +12,46 @@ def test_if_backend_methods_are_exported():
 
     assert hasattr(crypto, "hmac_sha256")
     assert hasattr(crypto, "sha256")
+
+    assert hasattr(crypto, "ec_sign")
+
+
+def test_ec_sign():
+    import ecdsa
+
+    pub, priv = crypto.ec_genkey()
+
+    signature = crypto.ec_sign(priv, b"data")
+
+    vk = ecdsa.VerifyingKey.from_public_point(
+        ecdsa.ellipticcurve.Point(ecdsa.NIST256p.curve, pub.x, pub.y),
+        curve=ecdsa.NIST256p,
+    )
+    assert len(priv) == 32
+    assert vk.verify(
+        signature,
+        b"data",
+        hashfunc=hashlib.sha256,
+        sigdecode=ecdsa.util.sigdecode_der,
+    )
+
+
+def test_hmac_sha256_batch():
+    secret = b"\x01" * 32
+    msgs = [b"", b"a", b"credential-id" * 8]
+
+    digests = crypto.hmac_sha256_batch(msgs, secret)
+
+    assert len(digests) == 32 * len(msgs)
+    for i, msg in enumerate(msgs):
+        assert digests[i * 32 : (i + 1) * 32] == crypto.hmac_sha256(msg, secret)
+
+
+def test_sha256_batch():
+    msgs = [b"", b"a", b"rp.example.com"]
+
+    assert crypto.sha256_batch(msgs) == b"".join(crypto.sha256(m) for m in msgs)
+    assert crypto.sha256_batch(msgs, prefix=b"p") == b"".join(
+        crypto.sha256(b"p" + m) for m in msgs
+    )
+    assert crypto.sha256_batch([]) == b""
@@ -1,11 +1,14 @@
 import asyncio
 from typing import Awaitable
 
-from adafruit_logging import getLogger
+import flynn
 
-from circuitkey import cbor, channel, hid, info, ui, util
+from circuitkey import cbor, channel, hid, info, presence, stats, trace, ui, util
+from circuitkey.arena import get_arena
 from circuitkey.error import CtapError
-from circuitkey.schema import (CTAPHID_BROADCAST_CID, CtaphidCmd, Error,
+from circuitkey.logger import Lazy, getLogger
+from circuitkey.schema import (CTAPHID_BROADCAST_CID, ERROR_BYTES, ERROR_CODES,
+                               KEEPALIVE_BYTES, CtapCommand, CtaphidCmd, Error,
                                KeepaliveStatusCode)
 
 log = getLogger(__name__)
@@ -29,8 +32,11 @@ async def cbor_cmd(cid: bytes, payload: bytes):
     """
     log.info("Processing cbor command")
 
-    response = await cbor.process(payload)
-    await hid.send(cid, 0x10, response)
+    response = await cbor.process(CtapCommand(cid, CtaphidCmd.CBOR, payload))
+    try:
+        await hid.send(cid, 0x10, response)
+    finally:
+        get_arena().release(response)
 
 
 async def init_cmd(cid: bytes, payload: bytes):
@@ -57,6 +63,8 @@ async def init_cmd(cid: bytes, payload: bytes):
         assigned_cid = channel.generate_cid()
     else:
         assigned_cid = cid
+        # resynchronized channel starts without a cached touch
+        presence.invalidate(cid)
 
     nonce = payload
 
@@ -74,7 +82,7 @@ async def init_cmd(cid: bytes, payload: bytes):
 
     buffer = b"".join(buffer)
 
-    log.info("New channel created: %s", util.hexlify(cid))
+    log.info("New channel created: %s", Lazy(util.hexlify, assigned_cid))
     await hid.send(cid, CtaphidCmd.INIT, buffer)
 
 
@@ -119,13 +127,13 @@ async def cancel_cmd(cid: bytes, payload: bytes):
             except asyncio.CancelledError:
                 log.debug("Task cancelled")
 
-            cbor_active_tasks.remove((cid, task))
-
-        for task_cid, task in cbor_active_tasks:
+        # entries are removed by process() once their command has finished
+        for task_cid, task in list(cbor_active_tasks):
             if cid == task_cid:
                 if not task.done():
                     await cancel(task)
                     cancelled_task_counter += 1
+                    stats.inc("cancellations")
                 else:
                     log.debug("CBOR task with CID[%s] already done", task_cid)
 
@@ -144,8 +152,9 @@ async def error_cmd(cid: bytes, error_code: Error):
     DATA 	Error code
     """
     log.info("Sending ctap error code - %d", error_code)
-    assert error_code in Error, "Invalid error code"
-    await hid.send(cid, CtaphidCmd.ERROR, error_code.to_byte())
+    assert error_code in ERROR_CODES, "Invalid error code"
+    stats.count(stats.errors, error_code)
+    await hid.send(cid, CtaphidCmd.ERROR, ERROR_BYTES[error_code])
 
 
 async def keepalive_cmd(cid: bytes, status_code: KeepaliveStatusCode):
@@ -167,7 +176,8 @@ async def keepalive_cmd(cid: bytes, status_code: KeepaliveStatusCode):
     It should be sent at least every 100ms and whenever the status changes.
     """
     log.info("Sending keepalive %d", status_code)
-    await hid.send(cid, CtaphidCmd.KEEPALIVE, status_code.to_byte())
+    stats.inc("keepalives")
+    await hid.send(cid, CtaphidCmd.KEEPALIVE, KEEPALIVE_BYTES[status_code])
 
 
 async def wink_cmd(cid: bytes, payload: bytes):
@@ -189,6 +199,53 @@ async def wink_cmd(cid: bytes, payload: bytes):
     await ui.get_ui().wink()
 
 
+async def trace_cmd(cid: bytes, payload: bytes):
+    """
+    CTAPHID_TRACE (0x41), vendor command
+
+    Request
+    CMD 	CTAPHID_TRACE
+    BCNT 	0..1
+    DATA 	0x01 to clear the trace buffer after it has been read (optional)
+
+    Response at success
+    CMD 	CTAPHID_TRACE
+    BCNT 	n
+    DATA 	trace buffer, see circuitkey.trace
+    """
+    log.info("Trace command received, sending trace buffer")
+    data = trace.dump()
+
+    if payload[:1] == b"\x01":
+        trace.clear()
+
+    await hid.send(cid, CtaphidCmd.TRACE, data)
+
+
+async def stats_cmd(cid: bytes, payload: bytes):
+    """
+    CTAPHID_STATS (0x42), vendor command
+
+    Request
+    CMD 	CTAPHID_STATS
+    BCNT 	0..1
+    DATA 	0x01 to reset the counters after they have been read (optional)
+
+    Response at success
+    CMD 	CTAPHID_STATS
+    BCNT 	n
+    DATA 	CBOR encoded counters, see circuitkey.stats
+    """
+    log.info("Stats command received, sending counters")
+    stats.sample_memory()
+    data = flynn.dumps(stats.snapshot())
+
+    if payload[:1] == b"\x01":
+        stats.reset()
+
+    await hid.send(cid, CtaphidCmd.STATS, data)
+
+
 async def keepalive_task(milliseconds: int):
     while True:
         try:
@@ -203,8 +260,10 @@ async def keepalive_task(milliseconds: int):
 cbor_active_tasks = []
 
 
-async def process(cid: bytes, cmd: int, payload: bytes):
-    CTAPHID_COMMANDS = [
+# command code -> handler
+CTAPHID_HANDLERS = {
+    int(code): handler
+    for code, handler in (
         # Mandatory commands
         (CtaphidCmd.PING, ping_cmd),
         (CtaphidCmd.INIT, init_cmd),
@@ -212,7 +271,33 @@ async def process(cid: bytes, cmd: int, payload: bytes):
         (CtaphidCmd.CANCEL, cancel_cmd),
         # Optional commands
         (CtaphidCmd.WINK, wink_cmd),
-    ]
+        # Vendor commands
+        (CtaphidCmd.TRACE, trace_cmd),
+        (CtaphidCmd.STATS, stats_cmd),
+    )
+}
+
+_CBOR = int(CtaphidCmd.CBOR)
+
+
+async def process(cid: bytes, cmd: int, payload: bytes):
+    stats.count(stats.commands, cmd)
+
+    trace.record(trace.DISPATCH_START, cid, cmd)
+    try:
+        await _dispatch(cid, cmd, payload)
+    finally:
+        trace.record(trace.DISPATCH_END, cid, cmd)
+        # request received by hid.receive into an arena buffer
+        get_arena().release(payload)
+
+
+async def _dispatch(cid: bytes, cmd: int, payload: bytes):
+    handler = CTAPHID_HANDLERS.get(cmd)
+    if handler is None:
+        # the command is not supported
+        await error_cmd(cid, Error.INVALID_COMMAND)
+        return
 
     async def error_handler(func: Awaitable[any]):
         try:
@@ -225,30 +310,22 @@ async def process(cid: bytes, cmd: int, payload: bytes):
             )
             await error_cmd(cid, e.code)
 
-    for cmd_code, handler in CTAPHID_COMMANDS:
-        if cmd_code == cmd:
-            try:
-                h_task = asyncio.create_task(
-                    error_handler(handler(cid, payload)), name="CtapHandlerTask"
-                )
-
-                if cmd == CtaphidCmd.CBOR:
-                    log.info(
-                        "CBOR command received, starting background keepalive task"
-                    )
-                    ka_task = asyncio.create_task(
-                        keepalive_task(50), name="KeepaliveTask"
-                    )
-                    cbor_active_tasks.append((cid, ka_task))
-
-                    await util.wait_until_first_complete(ka_task, h_task)
-                else:
-                    await h_task
-            except CtapError as e:
-                log.error("CtapError occured while processing command %d: %s", cmd, e)
-                await error_cmd(cid, e.code)
+    try:
+        h_task = asyncio.create_task(
+            error_handler(handler(cid, payload)), name="CtapHandlerTask"
+        )
 
-            return
+        if cmd == _CBOR:
+            log.info("CBOR command received, starting background keepalive task")
+            ka_task = asyncio.create_task(keepalive_task(50), name="KeepaliveTask")
+            cbor_active_tasks.append((cid, ka_task))
 
-    # if we reach this point, the command is not supported
-    await error_cmd(cid, Error.INVALID_COMMAND)
+            try:
+                await util.wait_until_first_complete(ka_task, h_task)
+            finally:
+                cbor_active_tasks.remove((cid, ka_task))
+        else:
+            await h_task
+    except CtapError as e:
+        log.error("CtapError occured while processing command %d: %s", cmd, e)
+        await error_cmd(cid, e.code)
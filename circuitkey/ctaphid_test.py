@@ -1,6 +1,7 @@
 import asyncio
 import random
 import sys
+import time
 from unittest.mock import AsyncMock, MagicMock
 
 import pytest
@@ -61,6 +62,9 @@ async def test_cancel_cmd_when_cbor_tasks_active(mocker: pytest_mock.MockFixture
 
     assert cbor_task.cancelled()
 
+    # removed by process() in a real run
+    ctaphid.cbor_active_tasks.remove((cid, cbor_task))
+
 
 @pytest.mark.asyncio
 async def test_wink_cmd(mocker: pytest_mock.MockFixture):
@@ -120,9 +124,23 @@ async def test_cbor_cmd(mocker: pytest_mock.MockFixture):
     hid_send.assert_called_once_with(cid, 0x10, b"")
 
 
+@pytest.mark.asyncio
+async def test_arena_buffers_are_released(mocker: pytest_mock.MockFixture, message_arena):
+    mocker.patch("circuitkey.hid.send")
+    response = message_arena.view(message_arena.borrow(), 1)
+    mocker.patch("circuitkey.cbor.process", return_value=response)
+    mocker.patch("circuitkey.ctaphid.keepalive_task")
+    request = message_arena.view(message_arena.borrow(), 8)
+
+    await ctaphid.process(b"\x00\x00\x00\x01", CtaphidCmd.CBOR, request)
+
+    assert message_arena.available() == message_arena.count
+
+
 @pytest.mark.asyncio
 async def test_process_non_cbor_cmd(mocker: pytest_mock.MockFixture):
-    ping_cmd = mocker.patch("circuitkey.ctaphid.ping_cmd", return_value=AsyncMock())
+    ping_cmd = AsyncMock()
+    mocker.patch.dict(ctaphid.CTAPHID_HANDLERS, {CtaphidCmd.PING: ping_cmd})
     keep_alive_task = mocker.patch("circuitkey.ctaphid.keepalive_task")
 
     cid = random.randbytes(4)
@@ -137,7 +155,8 @@ async def test_process_non_cbor_cmd(mocker: pytest_mock.MockFixture):
 
 @pytest.mark.asyncio
 async def test_process_cbor_cmd(mocker: pytest_mock.MockFixture):
-    cbor_cmd = mocker.patch("circuitkey.ctaphid.cbor_cmd", return_value=AsyncMock())
+    cbor_cmd = AsyncMock()
+    mocker.patch.dict(ctaphid.CTAPHID_HANDLERS, {CtaphidCmd.CBOR: cbor_cmd})
     keep_alive_task = mocker.patch("circuitkey.ctaphid.keepalive_task")
 
     cid = random.randbytes(4)
@@ -150,3 +169,52 @@ async def test_process_cbor_cmd(mocker: pytest_mock.MockFixture):
     cbor_cmd.assert_called_once_with(cid, payload)
 
     assert keep_alive_task.cancelled()
+    assert ctaphid.cbor_active_tasks == []
+
+
+@pytest.mark.asyncio
+async def test_trace_cmd(mocker: pytest_mock.MockFixture):
+    trace = mocker.patch("circuitkey.ctaphid.trace")
+    trace.dump.return_value = b"trace"
+
+    hid_send = mocker.patch("circuitkey.hid.send")
+
+    await ctaphid.trace_cmd(b"01", b"\x01")
+
+    trace.clear.assert_called_once()
+    hid_send.assert_called_once_with(b"01", 0x41, b"trace")
+
+
+@pytest.mark.asyncio
+async def test_stats_cmd(mocker: pytest_mock.MockFixture):
+    import flynn
+
+    import circuitkey.stats as stats
+
+    stats.reset()
+    stats.inc("packets_in")
+
+    hid_send = mocker.patch("circuitkey.hid.send")
+
+    await ctaphid.stats_cmd(b"01", b"\x01")
+
+    cid, cmd, data = hid_send.call_args[0]
+    assert (cid, cmd) == (b"01", 0x42)
+    assert flynn.loads(data)["packets_in"] == 1
+    assert stats.counters["packets_in"] == 0
+
+
+def test_keepalive_cadence(virtual_time, mocker: pytest_mock.MockFixture):
+    sent = []
+
+    async def send(cid, cmd, data):
+        sent.append(time.monotonic_ns() // 1000000)
+
+    mocker.patch("circuitkey.hid.send", side_effect=send)
+
+    with pytest.raises(asyncio.TimeoutError):
+        virtual_time.run_until_complete(
+            asyncio.wait_for(ctaphid.keepalive_task(50), 0.975)
+        )
+
+    assert sent == list(range(0, 1000, 50))
@@ -1,10 +1,19 @@
 import asyncio
+import time
 from typing import Optional, Tuple
 
-import usb_hid
-from adafruit_logging import getLogger
+try:
+    import usb_hid
+except (ImportError, OSError):
+    # CPython (software keys, simulations): the device is set with
+    # set_device(). Some CPython packages named usb_hid probe the kernel
+    # on import and fail with OSError.
+    usb_hid = None
 
+from circuitkey import stats, trace
+from circuitkey.arena import MESSAGE_SIZE, get_arena
 from circuitkey.error import AbortError, CtapError
+from circuitkey.logger import getLogger
 from circuitkey.schema import CtapCommand, CtaphidCmd, Error
 
 log = getLogger(__name__)
@@ -54,12 +63,14 @@ def initialize() -> None:
     usb_hid.enable([fidoKey])
 
 
-def get_device() -> usb_hid.Device:
+def get_device() -> "usb_hid.Device":
     if "_device" in get_device.__dict__:
         return get_device._device
 
+    assert usb_hid is not None, "No usb_hid module, set a device with set_device()"
+
     for device in usb_hid.devices:
-        log.debug(f"Found available device: ({device.usage_page}, {device.usage})")
+        log.debug("Found available device: (%d, %d)", device.usage_page, device.usage)
         if device.usage_page == _FIDO_USAGE_PAGE and device.usage == _FIDO_USAGE:
             log.debug("FIDO device has been found")
             get_device._device = device
@@ -68,45 +79,63 @@ def get_device() -> usb_hid.Device:
     assert False, "FIDO device has not been found"
 
 
+def set_device(device) -> None:
+    """
+    Use device, any object with send_report() and get_last_received_report()
+    like usb_hid.Device, for all reports.
+    """
+    get_device._device = device
+
+
+# reused for every packet sent, send_report() copies the report. Other sends
+# run while one yields between packets, so each packet is written in full
+# (CID included) right before it is sent.
+_report = bytearray(REPORT_LEN)
+_ZEROS = memoryview(bytes(REPORT_LEN))
+
+
 async def send(cid: bytes, cmd: int, payload: bytes, device=None) -> None:
     if device is None:
         device = get_device()
 
     assert len(cid) == 4, "CID length is not equal to 4"
 
-    bcnth = len(payload) >> 8
-    bcntl = len(payload) & 0xFF
+    report = _report
+    payload = memoryview(payload)
+    length = len(payload)
 
     seq = 0
-    while len(payload) > 0:
+    offset = 0
+    while offset < length:
+        report[0:4] = cid
         if seq == 0:
             # initialization packet
-            buffer = cid
-            buffer += cmd.to_bytes(1, "big")
-            buffer += bcnth.to_bytes(1, "big")
-            buffer += bcntl.to_bytes(1, "big")
+            report[4] = cmd
+            report[5] = length >> 8
+            report[6] = length & 0xFF
+            start = 7
         else:
             # continuation packet
-            buffer = cid
-            buffer += (seq | 0x80).to_bytes(1, "big")
-
-        payload_len = REPORT_LEN - len(buffer)
+            report[4] = seq | 0x80
+            start = 5
 
-        buffer += payload[:payload_len]
-        payload = payload[payload_len:]
+        end = min(start + length - offset, REPORT_LEN)
+        report[start:end] = payload[offset : offset + end - start]
+        offset += end - start
 
-        if len(buffer) < REPORT_LEN:
-            buffer += b"\x00" * (REPORT_LEN - len(buffer))
+        if end < REPORT_LEN:
+            report[end:] = _ZEROS[end:]
 
-        assert len(buffer) == REPORT_LEN, "Packet size is not equal to REPORT_LEN"
-        device.send_report(buffer)
+        device.send_report(report)
+        trace.record(trace.PACKET_OUT, cid, report[4])
+        stats.inc("packets_out")
         seq += 1
         assert seq < 0x80, "Sequence number is too big"
 
         await asyncio.sleep(0)
 
 
-def receive(device: usb_hid.Device = None) -> Optional[CtapCommand]:
+def receive(device: "usb_hid.Device" = None) -> Optional[CtapCommand]:
     if device is None:
         device = get_device()
 
@@ -124,72 +153,96 @@ def receive(device: usb_hid.Device = None) -> Optional[CtapCommand]:
     seq = 0
     cid = None
     cmd = None
-    payload = b""
     payload_len = 0
+    received = 0
 
-    while True:
-        buffer = device.get_last_received_report()
-        if buffer == None:
-            return None
+    # borrowed with the first packet, the payload of the returned command is
+    # a view of it and released by ctaphid.process
+    arena = get_arena()
+    message = None
 
-        if len(buffer) != REPORT_LEN:
-            raise CtapError(
-                Error.INVALID_LENGTH,
-                "Invalid packet length. Should be %d bytes, instead got %d bytes"
-                % (REPORT_LEN, len(buffer)),
-            )
+    try:
+        while True:
+            buffer = device.get_last_received_report()
+            if buffer == None:
+                return None
 
-        continuation_packet_flag = (
-            buffer[4] & 0x80 != 0
-        )  # if 7th bit set to 1 then it is a continuation packet
-
-        if cid == None:
-            cid = buffer[0:4]
-        else:
-            b4 = buffer[4]
-            if (
-                cid != buffer[0:4]
-                and continuation_packet_flag
-                and b4 == CtaphidCmd.INIT
-            ):
-                nonce = buffer[7 : 7 + 8]
-                raise AbortError(cid, nonce)
-            elif cid != buffer[0:4]:
+            if len(buffer) != REPORT_LEN:
                 raise CtapError(
-                    Error.INVALID_CHANNEL,
-                    "Invalid channel ID %s" % cid.hex(),
+                    Error.INVALID_LENGTH,
+                    "Invalid packet length. Should be %d bytes, instead got %d bytes"
+                    % (REPORT_LEN, len(buffer)),
                 )
 
-        if seq == 0 and continuation_packet_flag:
-            raise CtapError(
-                Error.INVALID_SEQ,
-                "Invalid sequence number, expected 0 for initialization packet",
-            )
-
-        if seq > 0 and not continuation_packet_flag:
-            raise CtapError(
-                Error.INVALID_SEQ,
-                "Invalid sequence number, expected > 0 for continuation packet",
-            )
-        if not continuation_packet_flag:
-            cmd = buffer[4]
-
-            payload_len = (buffer[5] << 8) + buffer[6]
-
-            payload += buffer[7:]
-        else:
-            if cid != buffer[0:4]:
+            trace.record(trace.PACKET_IN, bytes(buffer[0:4]), buffer[4])
+            stats.inc("packets_in")
+
+            continuation_packet_flag = (
+                buffer[4] & 0x80 != 0
+            )  # if 7th bit set to 1 then it is a continuation packet
+
+            if cid == None:
+                cid = buffer[0:4]
+            else:
+                b4 = buffer[4]
+                if (
+                    cid != buffer[0:4]
+                    and continuation_packet_flag
+                    and b4 == CtaphidCmd.INIT
+                ):
+                    nonce = buffer[7 : 7 + 8]
+                    raise AbortError(cid, nonce)
+                elif cid != buffer[0:4]:
+                    raise CtapError(
+                        Error.INVALID_CHANNEL,
+                        "Invalid channel ID %s" % cid.hex(),
+                    )
+
+            if seq == 0 and continuation_packet_flag:
                 raise CtapError(
-                    Error.INVALID_CHANNEL,
-                    "Invalid channel ID %s" % cid.hex(),
+                    Error.INVALID_SEQ,
+                    "Invalid sequence number, expected 0 for initialization packet",
                 )
-            payload += buffer[5:]
-
-        if len(payload) >= payload_len:
-            break
 
-        seq += 1
-
-    payload = payload[:payload_len]
-
-    return CtapCommand(cid, cmd, payload)
+            if seq > 0 and not continuation_packet_flag:
+                raise CtapError(
+                    Error.INVALID_SEQ,
+                    "Invalid sequence number, expected > 0 for continuation packet",
+                )
+            if not continuation_packet_flag:
+                cmd = buffer[4]
+
+                payload_len = (buffer[5] << 8) + buffer[6]
+                if payload_len > MESSAGE_SIZE:
+                    raise CtapError(
+                        Error.INVALID_LENGTH,
+                        "Message too long: %d bytes" % payload_len,
+                    )
+
+                message = arena.borrow()
+                received_at = time.monotonic_ns()
+                start = 7
+            else:
+                if cid != buffer[0:4]:
+                    raise CtapError(
+                        Error.INVALID_CHANNEL,
+                        "Invalid channel ID %s" % cid.hex(),
+                    )
+                start = 5
+
+            chunk = min(payload_len - received, REPORT_LEN - start)
+            message[received : received + chunk] = buffer[start : start + chunk]
+            received += chunk
+
+            if received >= payload_len:
+                break
+
+            seq += 1
+
+        payload = arena.view(message, payload_len)
+        message = None
+
+        return CtapCommand(cid, cmd, payload, received_at)
+    finally:
+        if message is not None:
+            arena.release(message)
@@ -1,3 +1,4 @@
+import asyncio
 import sys
 from unittest.mock import MagicMock
 
@@ -30,12 +31,13 @@ async def test_send_single_packet():
 @pytest.mark.asyncio
 async def test_send_multiple_packets():
     device = MagicMock()
+    # the report buffer is reused, keep a copy of each packet
+    sent = []
+    device.send_report.side_effect = lambda report: sent.append(bytes(report))
 
     await hid.send(int(64).to_bytes(4, "big"), 0x01, b"test" * 24, device=device)
 
-    assert device.send_report.call_count == 2
-    device.send_report.assert_any_call(MULTI_PACKET[0])
-    device.send_report.assert_any_call(MULTI_PACKET[1])
+    assert sent == list(MULTI_PACKET)
 
 
 def test_receive_packet():
@@ -47,6 +49,49 @@ def test_receive_packet():
     assert data.cid == b"\x00\x00\x00\x40"
     assert data.cmd == 0x01
     assert data.payload == b"test" * 24
+    assert data.received > 0
+
+
+def test_receive_packet_into_arena_buffer(message_arena):
+    arena = message_arena
+    available = arena.available()
+
+    device = MagicMock()
+    device.get_last_received_report.side_effect = MULTI_PACKET
+
+    data = hid.receive(device)
+
+    assert arena.available() == available - 1
+    arena.release(data.payload)
+    assert arena.available() == available
+
+
+def test_receive_releases_buffer_on_error(message_arena):
+    arena = message_arena
+    available = arena.available()
+
+    device = MagicMock()
+    device.get_last_received_report.side_effect = (
+        MULTI_PACKET[0],
+        b"\x00\x00\x00\x00" + MULTI_PACKET[1][4:],
+    )
+
+    with pytest.raises(CtapError):
+        hid.receive(device)
+
+    assert arena.available() == available
+
+
+def test_receive_too_long_message():
+    device = MagicMock()
+    device.get_last_received_report.return_value = (
+        b"\x00\x00\x00\x40\x01\xff\xff" + b"\x00" * 57
+    )
+
+    with pytest.raises(CtapError) as e:
+        hid.receive(device)
+
+    assert e.value.code == Error.INVALID_LENGTH
 
 
 def test_receive_packet_out_of_sequence():
@@ -80,3 +125,33 @@ def test_receive_packet_with_invalid_cid():
     with pytest.raises(CtapError) as e:
         hid.receive(device)
         assert e.code == Error.INVALID_CHANNEL
+
+
+@pytest.mark.asyncio
+async def test_send_to_device_set_with_set_device(monkeypatch):
+    device = MagicMock()
+    monkeypatch.setattr(hid.get_device, "_device", None, raising=False)
+
+    hid.set_device(device)
+    await hid.send(b"\x00\x00\x00\x01", 0x01, b"test")
+
+    assert hid.get_device() is device
+    device.send_report.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_concurrent_sends_keep_their_channel():
+    device = MagicMock()
+    sent = []
+    device.send_report.side_effect = lambda report: sent.append(bytes(report))
+
+    # packets of both messages alternate, the report buffer is shared
+    await asyncio.gather(
+        hid.send(b"\x00\x00\x00\x40", 0x01, b"test" * 24, device=device),
+        hid.send(b"\xff\xff\xff\xff", 0x3B, b"\x01", device=device),
+    )
+
+    assert [r for r in sent if r[0:4] == b"\x00\x00\x00\x40"] == list(MULTI_PACKET)
+    assert [r for r in sent if r[0:4] == b"\xff\xff\xff\xff"] == [
+        b"\xff\xff\xff\xff\x3b\x00\x01\x01" + bytes(56)
+    ]
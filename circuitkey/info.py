@@ -1,3 +1,5 @@
+import flynn
+
 from circuitkey.schema import CapabiltyCode
 
 # fmt:off
@@ -13,7 +15,7 @@ CBOR_INFO = {
     "versions": ["FIDO_2_0"],
     "aaguid": [0x00] * 15 + [0x01],
     "options": {
-        "rk": False,                # Specifies whether this authenticator can create discoverable credentials, and therefore can satisfy authenticatorGetAssertion requests with the allowList parameter omitted.
+        "rk": True,                 # Specifies whether this authenticator can create discoverable credentials, and therefore can satisfy authenticatorGetAssertion requests with the allowList parameter omitted.
         "up": True,                 # user presence: Indicates that the device is capable of testing user presence.
         "plat": False,              # platform device: Indicates that the device is attached to the client and therefore can’t be removed and used on another client.
         "clientPin": True,          # If present and set to true, it indicates that the device is capable of accepting a PIN from the client and PIN has been set.
@@ -22,3 +24,15 @@ CBOR_INFO = {
     "firmwareVersion": 0x01,
 }
 # fmt:on
+
+AAGUID = bytes(CBOR_INFO["aaguid"])
+
+
+def cbor_info_encoded() -> bytes:
+    """
+    CBOR encoded authenticatorGetInfo response, encoded once.
+    """
+    if "_encoded" not in cbor_info_encoded.__dict__:
+        cbor_info_encoded._encoded = flynn.dumps(CBOR_INFO)
+
+    return cbor_info_encoded._encoded
@@ -0,0 +1,43 @@
+# Pool of pregenerated P-256 key pairs.
+#
+# Key generation is the slowest step of authenticatorMakeCredential. The pool
+# is filled during warm-up, so the first requests after boot do not wait for
+# it; once the pool is empty keys are generated on demand.
+
+import typing
+
+import adafruit_logging as logging
+
+import circuitkey.crypto as crypto
+
+log = logging.getLogger(__name__)
+
+POOL_SIZE = 2
+
+_pool = []
+
+
+def fill(size: int = POOL_SIZE) -> int:
+    """
+    Generate keys until the pool holds size keys.
+
+    :return: number of generated keys
+    """
+    generated = 0
+    while len(_pool) < size:
+        _pool.append(crypto.ec_genkey())
+        generated += 1
+
+    return generated
+
+
+def take() -> typing.Tuple[crypto.ECPubKey, crypto.ECPrivKey]:
+    if len(_pool) > 0:
+        return _pool.pop()
+
+    log.debug("Key pool is empty, generating key")
+    return crypto.ec_genkey()
+
+
+def clear() -> None:
+    _pool.clear()
@@ -0,0 +1,75 @@
+# State of the key held in RAM.
+#
+# On a device there is one key per process. Tools running software keys on
+# CPython (benchmarks.replay, host.loadsim) start keys afresh or run several
+# of them in one process, taking turns: save() takes the state of the
+# current key out, restore() puts it back and reset() starts a fresh one.
+# Modules keeping state of the key in RAM (lazily created singletons,
+# caches) list it here, so no tool has to know about them.
+
+import circuitkey.pin as pin
+import circuitkey.storage as storage
+from circuitkey import assertion, counter, credential, keypool, presence, resident
+from circuitkey.storage_backend import Backend
+
+# (function, attribute) of lazily created singletons
+_SINGLETONS = (
+    (storage.get_backend, "_backend"),
+    (storage.get_log, "_log"),
+    (pin.get_pin_protocol, "v1"),
+    (counter.get_counter, "_counters"),
+    (resident.get_store, "_store"),
+    (credential._master_keys, "_keys"),
+)
+
+# module level dictionaries and lists, changed in place
+_CONTAINERS = (
+    storage._cache,
+    storage._dirty,
+    storage._slots,
+    keypool._pool,
+    assertion._cursors,
+    presence._touches,
+)
+
+
+def save() -> tuple:
+    """
+    State of the current key, for restore(). The current key keeps it.
+    """
+    return (
+        tuple(getter.__dict__.get(name) for getter, name in _SINGLETONS),
+        tuple(container.copy() for container in _CONTAINERS),
+    )
+
+
+def restore(state: tuple) -> None:
+    singletons, containers = state
+
+    for (getter, name), value in zip(_SINGLETONS, singletons):
+        if value is None:
+            getter.__dict__.pop(name, None)
+        else:
+            setattr(getter, name, value)
+
+    for container, saved in zip(_CONTAINERS, containers):
+        container.clear()
+        if isinstance(container, dict):
+            container.update(saved)
+        else:
+            container.extend(saved)
+
+
+def reset(backend: Backend = None) -> None:
+    """
+    Fresh key with nothing held in RAM, using backend for storage (by
+    default the one selected by CIRCUITKEY_STORAGE is created when used).
+    """
+    for getter, name in _SINGLETONS:
+        getter.__dict__.pop(name, None)
+
+    for container in _CONTAINERS:
+        container.clear()
+
+    if backend is not None:
+        storage.set_backend(backend)
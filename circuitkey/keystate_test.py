@@ -0,0 +1,57 @@
+import pytest
+
+import circuitkey.pin as pin
+import circuitkey.storage as storage
+from circuitkey import counter, credential, keypool, keystate, presence, resident
+from circuitkey.storage_backend import RamBackend
+
+RP = b"\xaa" * 32
+CID = b"\x00\x00\x00\x01"
+
+
+@pytest.fixture
+def key_state(ram_storage):
+    """
+    State of the key before the test, restored afterwards.
+    """
+    saved = keystate.save()
+    yield
+    keystate.restore(saved)
+
+
+def test_keys_do_not_share_state(key_state, monkeypatch):
+    monkeypatch.setattr(presence, "window", 10)
+    backend_a, backend_b = RamBackend(), RamBackend()
+
+    keystate.reset(backend_a)
+    keypool._pool.append("key of a")
+    resident.get_store().add(RP, b"cred-a", b"user-a")
+    presence.record(CID, RP)
+    master_keys = credential._master_keys()
+    a = keystate.save()
+
+    keystate.reset(backend_b)
+    assert resident.get_store().get(b"cred-a") is None
+    assert not presence.is_cached(CID, RP)
+    assert keypool._pool == []
+    assert credential._master_keys() != master_keys
+
+    keystate.restore(a)
+    assert storage.get_backend().backend is backend_a
+    assert resident.get_store().get(b"cred-a").user_id == b"user-a"
+    assert presence.is_cached(CID, RP)
+    assert keypool._pool == ["key of a"]
+    assert credential._master_keys() == master_keys
+
+
+def test_reset_drops_singletons(key_state, monkeypatch):
+    monkeypatch.setenv("CIRCUITKEY_STORAGE", "ram")
+    keystate.reset(RamBackend())
+    protocol = pin.get_pin_protocol()
+    counter.get_counter()
+
+    keystate.reset()
+
+    assert "_backend" not in storage.get_backend.__dict__
+    assert "_counters" not in counter.get_counter.__dict__
+    assert pin.get_pin_protocol() is not protocol
@@ -0,0 +1,83 @@
+# Logging facade for hot paths.
+#
+# adafruit_logging formats every message (msg % args) before it checks the
+# level, so each dropped debug message still pays for formatting its
+# arguments. Loggers returned by getLogger() check the level first and only
+# then pass the message on.
+#
+# Arguments which are expensive to compute can be wrapped in Lazy, they are
+# evaluated only when the message is emitted:
+#
+#   log.info("New channel created: %s", Lazy(util.hexlify, cid))
+#
+# Debug messages are discarded without any check when STRIP_DEBUG is set,
+# i.e. in optimized builds (python -O, mpy-cross -O1) or with
+# CIRCUITKEY_STRIP_DEBUG in settings.toml.
+
+import os
+
+import adafruit_logging
+from adafruit_logging import DEBUG, ERROR, INFO, WARNING
+
+STRIP_DEBUG = not __debug__ or bool(os.getenv("CIRCUITKEY_STRIP_DEBUG"))
+
+
+class Lazy:
+    """
+    Argument computed by func(*args) when the message is formatted.
+    """
+
+    def __init__(self, func, *args):
+        self.func = func
+        self.args = args
+
+    def __str__(self) -> str:
+        return str(self.func(*self.args))
+
+
+def _discard(msg: str, *args) -> None:
+    pass
+
+
+class Logger:
+    def __init__(self, logger: adafruit_logging.Logger):
+        self._logger = logger
+
+        if STRIP_DEBUG:
+            self.debug = _discard
+
+    def setLevel(self, level: int) -> None:
+        self._logger.setLevel(level)
+
+    def isEnabledFor(self, level: int) -> bool:
+        return level >= self._logger.getEffectiveLevel()
+
+    def log(self, level: int, msg: str, *args) -> None:
+        if level >= self._logger.getEffectiveLevel():
+            self._logger.log(level, msg, *args)
+
+    def debug(self, msg: str, *args) -> None:
+        if DEBUG >= self._logger.getEffectiveLevel():
+            self._logger.log(DEBUG, msg, *args)
+
+    def info(self, msg: str, *args) -> None:
+        if INFO >= self._logger.getEffectiveLevel():
+            self._logger.log(INFO, msg, *args)
+
+    def warning(self, msg: str, *args) -> None:
+        if WARNING >= self._logger.getEffectiveLevel():
+            self._logger.log(WARNING, msg, *args)
+
+    def error(self, msg: str, *args) -> None:
+        if ERROR >= self._logger.getEffectiveLevel():
+            self._logger.log(ERROR, msg, *args)
+
+
+_loggers = {}  # name -> Logger
+
+
+def getLogger(name: str = "") -> Logger:
+    if name not in _loggers:
+        _loggers[name] = Logger(adafruit_logging.getLogger(name))
+
+    return _loggers[name]
@@ -0,0 +1,69 @@
+import io
+
+import adafruit_logging
+import pytest
+
+from circuitkey import logger
+
+
+class Expensive:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "expensive"
+
+
+@pytest.fixture
+def stream():
+    stream = io.StringIO()
+    handler = adafruit_logging.StreamHandler(stream)
+
+    raw = adafruit_logging.getLogger("circuitkey.logger_test")
+    raw.addHandler(handler)
+    raw.setLevel(adafruit_logging.INFO)
+
+    yield stream
+
+    raw.removeHandler(handler)
+
+
+def test_arguments_are_not_formatted_below_level(stream):
+    log = logger.getLogger("circuitkey.logger_test")
+    arg = Expensive()
+
+    log.debug("dropped %s", arg)
+    log.info("emitted %s", arg)
+
+    assert arg.formatted == 1
+    assert "emitted expensive" in stream.getvalue()
+    assert "dropped" not in stream.getvalue()
+
+
+def test_lazy_argument(stream):
+    log = logger.getLogger("circuitkey.logger_test")
+    calls = []
+
+    def compute(value):
+        calls.append(value)
+        return value * 2
+
+    log.debug("dropped %s", logger.Lazy(compute, 1))
+    log.info("emitted %s", logger.Lazy(compute, 2))
+
+    assert calls == [2]
+    assert "emitted 4" in stream.getvalue()
+
+
+def test_strip_debug(monkeypatch, stream):
+    monkeypatch.setattr(logger, "STRIP_DEBUG", True)
+
+    log = logger.Logger(adafruit_logging.getLogger("circuitkey.logger_test"))
+    log.setLevel(adafruit_logging.DEBUG)
+
+    log.debug("stripped")
+    log.info("kept")
+
+    assert "stripped" not in stream.getvalue()
+    assert "kept" in stream.getvalue()
@@ -0,0 +1,266 @@
+# Append-only record log.
+#
+# Records are appended to the active segment. When the segment is full, the
+# latest record of every key is copied to the least recently used segment
+# (compaction), which becomes the new active segment. Rotating the segments
+# spreads erases over all of them instead of one sector.
+#
+# Segment layout:
+#
+#   header (12) | record | record | ...
+#
+#   header = magic "CKLS" (4) | generation (4) | CRC32 (4)
+#   record = sequence (4) | key length (1) | value length (2) | key | value
+#            | CRC32 (4)
+#
+# The header is written after the records copied by compaction, so a segment
+# with a valid header always holds the complete state. On recovery the
+# segment with the highest generation is scanned and the first invalid record
+# ends the log; a torn record left by a power loss triggers compaction.
+
+import binascii
+import errno
+import struct
+
+import adafruit_logging as logging
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"CKLS"
+
+_HEADER_FORMAT = "<4sII"
+HEADER_SIZE = struct.calcsize(_HEADER_FORMAT)
+
+_RECORD_FORMAT = "<IBH"
+_RECORD_HEADER_SIZE = struct.calcsize(_RECORD_FORMAT)
+_CRC_SIZE = 4
+
+_ERASED_SEQUENCE = 0xFFFFFFFF
+
+
+def _crc(data) -> int:
+    return binascii.crc32(data) & 0xFFFFFFFF
+
+
+class Segments:
+    """
+    Segments stored as blobs <prefix>.<index> of a storage backend. Erasing
+    a segment empties its blob.
+    """
+
+    def __init__(self, backend, prefix: str, count: int = 2, size: int = 4096):
+        self.backend = backend
+        self.prefix = prefix
+        self.count = count
+        self.size = size
+
+    def name(self, index: int) -> str:
+        return "%s.%d" % (self.prefix, index)
+
+    def read(self, index: int) -> bytes:
+        return self.backend.read_at(self.name(index), 0, self.size)
+
+    def write(self, index: int, offset: int, data: bytes) -> None:
+        self.backend.write_at(self.name(index), offset, data)
+
+    def erase(self, index: int) -> None:
+        self.backend.write(self.name(index), b"")
+
+    def remove(self) -> None:
+        for index in range(self.count):
+            self.backend.remove(self.name(index))
+
+
+def encode_record(seq: int, key: bytes, value: bytes) -> bytes:
+    record = struct.pack(_RECORD_FORMAT, seq, len(key), len(value)) + key + value
+    return record + struct.pack("<I", _crc(record))
+
+
+def decode_record(data: bytes, offset: int) -> tuple | None:
+    """
+    Record at offset of segment data.
+
+    :return: tuple of sequence, key, value and offset of the next record,
+        or None at the end of the log
+    :raises ValueError: if the record is torn or corrupted
+    """
+    if offset == len(data):
+        return None
+
+    if offset + _RECORD_HEADER_SIZE > len(data):
+        raise ValueError("Truncated record header")
+
+    seq, key_len, value_len = struct.unpack_from(_RECORD_FORMAT, data, offset)
+    if seq == _ERASED_SEQUENCE:
+        return None
+
+    key_start = offset + _RECORD_HEADER_SIZE
+    end = key_start + key_len + value_len
+    if end + _CRC_SIZE > len(data):
+        raise ValueError("Truncated record")
+
+    (crc,) = struct.unpack_from("<I", data, end)
+    if crc != _crc(memoryview(data)[offset:end]):
+        raise ValueError("Record CRC mismatch")
+
+    return (
+        seq,
+        bytes(data[key_start : key_start + key_len]),
+        bytes(data[key_start + key_len : end]),
+        end + _CRC_SIZE,
+    )
+
+
+class LogStore:
+    def __init__(self, segments):
+        if segments.count < 2:
+            raise ValueError("At least two segments are required")
+
+        self.segments = segments
+
+        self._values = {}  # key -> value
+        self._generations = [None] * segments.count  # None: erased or invalid
+        self._active = None
+        self._offset = 0
+        self._seq = 0
+
+        self._recover()
+
+    def _header(self, generation: int) -> bytes:
+        header = struct.pack("<4sI", MAGIC, generation)
+        return header + struct.pack("<I", _crc(header))
+
+    def _parse_header(self, data: bytes) -> int | None:
+        if len(data) < HEADER_SIZE:
+            return None
+
+        magic, generation, crc = struct.unpack_from(_HEADER_FORMAT, data)
+        if magic != MAGIC or crc != _crc(data[: HEADER_SIZE - _CRC_SIZE]):
+            return None
+
+        return generation
+
+    def _recover(self) -> None:
+        latest = None
+        for index in range(self.segments.count):
+            generation = self._parse_header(self.segments.read(index))
+            self._generations[index] = generation
+            if generation is not None and (
+                latest is None or generation > self._generations[latest]
+            ):
+                latest = index
+
+        if latest is None:
+            log.info("Formatting empty log")
+            self._active = 0
+            self.segments.erase(0)
+            self.segments.write(0, 0, self._header(1))
+            self._generations[0] = 1
+            self._offset = HEADER_SIZE
+            return
+
+        self._active = latest
+
+        data = self.segments.read(latest)
+        offset = HEADER_SIZE
+        torn = False
+        while True:
+            try:
+                record = decode_record(data, offset)
+            except ValueError as e:
+                log.warning("Log ends at offset %d: %s", offset, e)
+                torn = True
+                break
+
+            if record is None:
+                break
+
+            seq, key, value, offset = record
+            self._values[key] = value
+            self._seq = max(self._seq, seq)
+
+        self._offset = offset
+
+        log.info(
+            "Recovered %d keys from log segment %d (generation %d)",
+            len(self._values),
+            latest,
+            self._generations[latest],
+        )
+
+        if torn:
+            self.compact()
+
+    def get(self, key: bytes) -> bytes | None:
+        return self._values.get(key)
+
+    def keys(self) -> list:
+        return list(self._values)
+
+    def put(self, key: bytes, value: bytes) -> None:
+        if len(key) > 0xFF or len(value) > 0xFFFF:
+            raise ValueError("Key or value too long")
+
+        if self._values.get(key) == value:
+            return
+
+        record = encode_record(self._seq + 1, key, value)
+
+        if self._offset + len(record) > self.segments.size:
+            previous = self._values.get(key)
+            self._values[key] = value
+            try:
+                self.compact()
+            except OSError:
+                if previous is None:
+                    del self._values[key]
+                else:
+                    self._values[key] = previous
+                raise
+            return
+
+        self.segments.write(self._active, self._offset, record)
+        self._offset += len(record)
+        self._seq += 1
+        self._values[key] = value
+
+    def _next_segment(self) -> int:
+        # least recently written segment, erased ones first
+        candidates = [i for i in range(self.segments.count) if i != self._active]
+        return min(
+            candidates,
+            key=lambda i: -1 if self._generations[i] is None else self._generations[i],
+        )
+
+    def compact(self) -> None:
+        """
+        Copy the latest record of every key to the next segment.
+        """
+        records = []
+        for key, value in self._values.items():
+            self._seq += 1
+            records.append(encode_record(self._seq, key, value))
+
+        size = HEADER_SIZE + sum(len(r) for r in records)
+        if size > self.segments.size:
+            raise OSError(errno.ENOSPC, "Log store is full")
+
+        target = self._next_segment()
+        generation = max(g for g in self._generations if g is not None) + 1
+
+        self.segments.erase(target)
+        self._generations[target] = None
+
+        offset = HEADER_SIZE
+        for record in records:
+            self.segments.write(target, offset, record)
+            offset += len(record)
+
+        # header last, the segment is valid only once all records are in
+        self.segments.write(target, 0, self._header(generation))
+
+        log.debug("Compacted log into segment %d (%d bytes)", target, offset)
+
+        self._generations[target] = generation
+        self._active = target
+        self._offset = offset
@@ -0,0 +1,98 @@
+import pytest
+
+from circuitkey.logstore import HEADER_SIZE, LogStore, Segments
+from circuitkey.storage_backend import RamBackend
+
+
+@pytest.fixture
+def segments():
+    return Segments(RamBackend(), "log", count=2, size=256)
+
+
+def test_put_and_recover(segments):
+    store = LogStore(segments)
+    store.put(b"a", b"1")
+    store.put(b"b", b"2")
+    store.put(b"a", b"3")
+
+    store = LogStore(segments)
+
+    assert store.get(b"a") == b"3"
+    assert store.get(b"b") == b"2"
+    assert store.get(b"c") is None
+
+
+def test_unchanged_value_is_not_appended(segments):
+    store = LogStore(segments)
+    store.put(b"a", b"1")
+    size = len(segments.read(0))
+
+    store.put(b"a", b"1")
+
+    assert len(segments.read(0)) == size
+
+
+def test_compaction_rotates_segments(segments):
+    store = LogStore(segments)
+    store.put(b"b", b"x")
+
+    active = []
+    for i in range(100):
+        store.put(b"a", b"%d" % i)
+        active.append(store._active)
+
+    assert set(active) == {0, 1}
+
+    store = LogStore(segments)
+    assert store.get(b"a") == b"99"
+    assert store.get(b"b") == b"x"
+
+
+def test_torn_record_is_ignored(segments):
+    store = LogStore(segments)
+    store.put(b"a", b"1")
+    store.put(b"a", b"2")
+
+    segments.backend.write("log.0", segments.read(0)[:-3])
+
+    store = LogStore(segments)
+
+    assert store.get(b"a") == b"1"
+
+    # the torn record has been compacted away
+    store.put(b"a", b"3")
+    assert LogStore(segments).get(b"a") == b"3"
+
+
+def test_corrupted_record_ends_log(segments):
+    store = LogStore(segments)
+    store.put(b"a", b"1")
+    store.put(b"a", b"2")
+
+    data = segments.read(0)
+    segments.backend.write("log.0", data[:-1] + bytes((data[-1] ^ 0xFF,)))
+
+    assert LogStore(segments).get(b"a") == b"1"
+
+
+def test_interrupted_compaction_keeps_previous_segment(segments):
+    store = LogStore(segments)
+    store.put(b"a", b"1")
+
+    # compaction which did not write the header of the new segment
+    segments.erase(1)
+    segments.write(1, HEADER_SIZE, b"\x01" * 16)
+
+    assert LogStore(segments).get(b"a") == b"1"
+
+
+def test_full_log(segments):
+    store = LogStore(segments)
+
+    with pytest.raises(OSError):
+        for i in range(100):
+            store.put(b"key%d" % i, b"value")
+
+    # the key which did not fit is not kept
+    assert store.get(b"key%d" % i) is None
+    assert LogStore(segments).get(b"key0") == b"value"
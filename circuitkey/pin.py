@@ -4,16 +4,18 @@ import typing
 import adafruit_logging as logging
 
 import circuitkey.crypto as crypto
+import circuitkey.keypool as keypool
+import circuitkey.stats as stats
 from circuitkey.error import CborError
 from circuitkey.schema import Error
-from circuitkey.storage import Bucket
-from circuitkey.util import next_tick
+from circuitkey.storage import Bucket, PinBucket
+from circuitkey.util import equal, next_tick
 
 log = logging.getLogger(__name__)
 
 
 class PinProtocolV1:
-    def __init__(self, storage: Bucket = Bucket("pin.json")):
+    def __init__(self, storage: Bucket = PinBucket()):
         self._storage = storage
 
         data = self._load()
@@ -24,7 +26,7 @@ class PinProtocolV1:
         self._pin_token = os.urandom(16)
         self._pin_mismatch_counter = 0
 
-        self._key_agreement_key = crypto.ec_genkey()
+        self._key_agreement_key = keypool.take()
 
     def _load(self) -> typing.Tuple[bytes | None, int | None]:
         data = self._storage.load()
@@ -34,8 +36,10 @@ class PinProtocolV1:
             data["retry_count"] if "retry_count" in data else 8,
         )
 
-    def _save(self) -> None:
-        self._storage.save({"pin": self._pin, "retry_count": self._retry_count})
+    def _save(self, durable=False) -> None:
+        self._storage.save(
+            {"pin": self._pin, "retry_count": self._retry_count}, durable=durable
+        )
 
     def _validate(self, pin: bytes) -> None:
         if len(pin) < 4:
@@ -74,13 +78,16 @@ class PinProtocolV1:
         pin_hash = await next_tick(crypto.hmac_sha256)(sharedSecret, pin_hash_enc)
         pin_hash = pin_hash[:16]
 
+        # decremented counter has to reach flash before the PIN is compared,
+        # otherwise cutting the power would give unlimited attempts
         self._retry_count -= 1
-        self._save()
+        self._save(durable=True)
 
-        if pin_hash != self._pin:
+        if self._pin is None or not equal(pin_hash, self._pin):
             # new key pair for each attempt
-            self.key_agreement_key = await next_tick(crypto.ec_genkey)()
+            self._key_agreement_key = await next_tick(keypool.take)()
             self._pin_mismatch_counter += 1
+            stats.inc("pin_failures")
 
             is_device_blocked()
 
@@ -118,7 +125,7 @@ class PinProtocolV1:
         pin_hash_enc = await next_tick(crypto.hmac_sha256)(sharedSecret, new_enc_pin)
         pin_hash_enc = pin_hash_enc[:16]
 
-        if pin_hash_enc != pin_auth:
+        if not equal(pin_hash_enc, pin_auth):
             raise CborError(Error.PIN_AUTH_INVALID, "PIN mismatch")
 
         zero_padded_pin = await next_tick(crypto.aes256_cbc_decrypt)(
@@ -158,6 +165,14 @@ class PinProtocolV1:
         """
         return self._pin_mismatch_counter >= 3
 
+    def verify_pin_auth(self, client_data_hash: bytes, pin_auth: bytes) -> bool:
+        """
+        Check pinAuth sent with MakeCredential or GetAssertion, that is first
+        16 bytes of HMAC-SHA-256(pinToken, clientDataHash).
+        """
+        expected = crypto.hmac_sha256(client_data_hash, self._pin_token)[:16]
+        return equal(expected, pin_auth)
+
     def get_key_agreement_pub_key(self) -> crypto.ECPubKey:
         """
         Get public key for key agreement.
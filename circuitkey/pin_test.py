@@ -51,7 +51,7 @@ class InMemBucket(storage.Bucket):
     def load(self):
         return self._data
 
-    def save(self, data):
+    def save(self, data, durable=False):
         self._data = data
 
 
@@ -154,6 +154,9 @@ async def test_should_fail_pin_verification(pin_protocol_v1: PinProtocolV1):
     assert pin_protocol_v1.get_retries() == 5
     assert pin_protocol_v1._pin_mismatch_counter == 1
 
+    # new key agreement key for the next attempt
+    assert pin_protocol_v1._key_agreement_key != to_ec_key(AUTHENTICATOR_KEY)
+
 
 @pytest.mark.asyncio
 async def test_should_block_auth_after_too_many_failed_attempts(
@@ -0,0 +1,202 @@
+# Power loss fault injection.
+#
+# The write primitive of the storage layer is replaced by one which stops
+# after a given number of bytes, as if the device was unplugged. Every test
+# repeats an update with the power cut at each byte offset and checks that
+# the data recovered afterwards is either the complete old or new state.
+
+import pytest
+
+from circuitkey import resident, storage
+from circuitkey.logstore import LogStore, Segments
+from circuitkey.storage_backend import RamBackend
+
+
+class PowerLoss(Exception):
+    pass
+
+
+class CutPower:
+    """
+    Wraps a write function whose last argument is the data. Writes stop
+    after budget bytes in total, None means no limit.
+    """
+
+    def __init__(self, write, budget=None):
+        self.write = write
+        self.budget = budget
+        self.written = 0
+
+    def __call__(self, *args):
+        *args, data = args
+
+        if self.budget is not None and self.written + len(data) > self.budget:
+            self.write(*args, data[: self.budget - self.written])
+            self.written = self.budget
+            raise PowerLoss()
+
+        self.write(*args, data)
+        self.written += len(data)
+
+
+def every_byte_offset(setup, update, check):
+    """
+    Run update with the power cut after every byte it writes. Each run
+    starts with an empty RAM backend, which plays the role of flash.
+
+    :param setup: creates the initial state, returns context for update
+    :param update: update done by a write function (context, write wrapper)
+    :param check: verifies recovered state (completed)
+    """
+
+    def run(budget):
+        storage.set_backend(RamBackend())
+        context = setup()
+
+        cut = CutPower(None, budget)
+        try:
+            update(context, cut)
+        except PowerLoss:
+            pass
+
+        # reboot
+        storage.invalidate()
+        check(cut.budget is None)
+        return cut.written
+
+    previous = storage.get_backend()
+    try:
+        total = run(None)
+        assert total > 0
+
+        for budget in range(total):
+            run(budget)
+    finally:
+        storage.set_backend(previous)
+
+
+def test_bucket_save(monkeypatch):
+    old = {"pin": b"\x01" * 16, "retry_count": 8}
+    new = {"pin": b"\x01" * 16, "retry_count": 7}
+
+    def setup():
+        storage.Bucket("test").save(old, durable=True)
+        storage.Bucket("test").save(old | {"retry_count": 9}, durable=True)
+        storage.Bucket("test").save(old, durable=True)
+
+    def update(_, cut):
+        cut.write = storage._write_file
+        with monkeypatch.context() as m:
+            m.setattr(storage, "_write_file", cut)
+            storage.Bucket("test").save(new, durable=True)
+
+    def check(completed):
+        assert storage.Bucket("test").load() == (new if completed else old)
+
+    every_byte_offset(setup, update, check)
+
+
+def segments():
+    return Segments(storage.get_backend(), "log", count=2, size=128)
+
+
+def test_log_append():
+    def setup():
+        store = LogStore(segments())
+        store.put(b"a", b"old")
+        return store
+
+    def update(store, cut):
+        cut.write = store.segments.write
+        store.segments.write = cut
+        store.put(b"a", b"new")
+
+    def check(completed):
+        store = LogStore(segments())
+        assert store.get(b"a") == (b"new" if completed else b"old")
+
+        # the log is usable after recovery
+        store.put(b"b", b"1")
+        assert LogStore(segments()).get(b"b") == b"1"
+
+    every_byte_offset(setup, update, check)
+
+
+def test_log_compaction():
+    def setup():
+        store = LogStore(segments())
+        store.put(b"b", b"kept")
+
+        # fill the active segment, so the next put compacts the log
+        i = 0
+        while store._offset + 20 <= store.segments.size:
+            store.put(b"a", b"old%04d" % i)
+            i += 1
+
+        return store
+
+    def update(store, cut):
+        old = store.get(b"a")
+        cut.write = store.segments.write
+        store.segments.write = cut
+        store.put(b"a", b"new")
+
+        assert store._active == 1, "update must compact the log"
+        assert old is not None
+
+    def check(completed):
+        store = LogStore(segments())
+
+        assert store.get(b"b") == b"kept"
+        if completed:
+            assert store.get(b"a") == b"new"
+        else:
+            assert store.get(b"a").startswith(b"old")
+
+    every_byte_offset(setup, update, check)
+
+
+RP = b"\x01" * 32
+
+
+def test_resident_overwrite(monkeypatch):
+    def setup():
+        store = resident.ResidentCredentialStore()
+        store.add(RP, b"cred-1", b"user-1", "Jan")
+        return store
+
+    def update(store, cut):
+        cut.write = store._backend.write_at
+        with monkeypatch.context() as m:
+            m.setattr(store._backend, "write_at", cut)
+            store.add(RP, b"cred-2", b"user-1", "Żaneta")
+
+    def check(completed):
+        store = resident.ResidentCredentialStore()
+        creds = list(store.find(RP))
+
+        if completed:
+            assert [c.name for c in creds] == ["Żaneta"]
+        else:
+            # slot is rewritten in place, a torn one is dropped
+            assert [(c.credential_id, c.name) for c in creds] in (
+                [(b"cred-1", "Jan")],
+                [(b"cred-2", "Żaneta")],
+                [],
+            )
+
+        # the store is usable after recovery
+        store.add(RP, b"cred-3", b"user-3")
+        assert resident.ResidentCredentialStore().count(RP) == len(creds) + 1
+
+    every_byte_offset(setup, update, check)
+
+
+def test_cut_power_stops_at_budget():
+    backend = RamBackend()
+    cut = CutPower(backend.write, 3)
+
+    with pytest.raises(PowerLoss):
+        cut("blob", b"abcdef")
+
+    assert backend.read("blob") == b"abc"
@@ -0,0 +1,55 @@
+# User presence cache.
+#
+# Optionally a touch is honored for a short window for further operations of
+# the same channel and relying party, similar to the UP permission of CTAP 2.1
+# pinUvAuthTokens. Back-to-back requests of a registration flow (e.g.
+# MakeCredential followed by GetAssertion) then need one touch only.
+#
+# The window is set by CIRCUITKEY_UP_CACHE_WINDOW (seconds) in settings.toml,
+# 0 (default) disables the cache. authenticatorReset always requires a touch.
+
+import os
+import time
+
+from circuitkey.logger import getLogger
+
+log = getLogger(__name__)
+
+window = int(os.getenv("CIRCUITKEY_UP_CACHE_WINDOW") or 0)  # seconds
+
+_touches = {}  # (CID, rpIdHash) -> deadline
+
+
+def record(cid: bytes, rp_id_hash: bytes) -> None:
+    """
+    User has confirmed presence for the relying party on the channel.
+    """
+    if window <= 0 or cid is None:
+        return
+
+    _touches[(cid, rp_id_hash)] = time.monotonic() + window
+
+
+def is_cached(cid: bytes, rp_id_hash: bytes) -> bool:
+    deadline = _touches.get((cid, rp_id_hash))
+    if deadline is None:
+        return False
+
+    if window <= 0 or time.monotonic() > deadline:
+        del _touches[(cid, rp_id_hash)]
+        return False
+
+    log.debug("User presence confirmed within the last %d s", window)
+    return True
+
+
+def invalidate(cid: bytes = None) -> None:
+    """
+    Forget touches of the channel, or all touches if no channel is given.
+    """
+    if cid is None:
+        _touches.clear()
+        return
+
+    for key in [key for key in _touches if key[0] == cid]:
+        del _touches[key]
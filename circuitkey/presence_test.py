@@ -0,0 +1,50 @@
+import pytest
+
+from circuitkey import presence
+
+CID = b"\x00\x00\x00\x01"
+RP = b"\x01" * 32
+
+
+@pytest.fixture(autouse=True)
+def cache(monkeypatch):
+    monkeypatch.setattr(presence, "window", 10)
+    presence.invalidate()
+
+    yield
+
+    presence.invalidate()
+
+
+def test_touch_is_cached_per_channel_and_rp():
+    presence.record(CID, RP)
+
+    assert presence.is_cached(CID, RP)
+    assert not presence.is_cached(b"\x00\x00\x00\x02", RP)
+    assert not presence.is_cached(CID, b"\x02" * 32)
+
+
+def test_touch_expires(monkeypatch):
+    presence.record(CID, RP)
+
+    now = presence.time.monotonic()
+    monkeypatch.setattr(presence.time, "monotonic", lambda: now + 11)
+
+    assert not presence.is_cached(CID, RP)
+
+
+def test_zero_window_disables_cache(monkeypatch):
+    monkeypatch.setattr(presence, "window", 0)
+    presence.record(CID, RP)
+
+    assert not presence.is_cached(CID, RP)
+
+
+def test_invalidate_channel():
+    presence.record(CID, RP)
+    presence.record(b"\x00\x00\x00\x02", RP)
+
+    presence.invalidate(CID)
+
+    assert not presence.is_cached(CID, RP)
+    assert presence.is_cached(b"\x00\x00\x00\x02", RP)
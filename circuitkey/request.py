@@ -0,0 +1,112 @@
+# Typed records of CBOR requests.
+#
+# Requests are decoded by flynn into dicts with the integer keys of the CTAP
+# specification. The records take the parameters out once, check the required
+# ones (CTAP2_ERR_MISSING_PARAMETER) and give the handlers plain attributes
+# instead of repeated dict lookups. Optional parameters which are not present
+# are None.
+
+from circuitkey.error import CborError
+from circuitkey.schema import (
+    ClientPinParam,
+    Error,
+    GetAssertionParam,
+    MakeCredentialParam,
+)
+
+
+def _map(req) -> dict:
+    if not isinstance(req, dict):
+        raise CborError(Error.CBOR_UNEXPECTED_TYPE, "Request is not a map")
+    return req
+
+
+def _required(req: dict, key):
+    try:
+        return req[key]
+    except KeyError:
+        raise CborError(Error.MISSING_PARAMETER, "Missing parameter %s" % key)
+
+
+class MakeCredentialRequest:
+    __slots__ = (
+        "client_data_hash",
+        "rp_id",
+        "user",
+        "pub_key_cred_params",
+        "exclude_list",
+        "extensions",
+        "options",
+        "pin_auth",
+        "pin_protocol",
+    )
+
+    def __init__(self, req: dict):
+        req = _map(req)
+        self.client_data_hash = _required(req, MakeCredentialParam.CLIENT_DATA_HASH)
+        self.rp_id = _required(_map(_required(req, MakeCredentialParam.RP)), "id")
+        self.user = _required(req, MakeCredentialParam.USER)
+        self.pub_key_cred_params = _required(
+            req, MakeCredentialParam.PUB_KEY_CRED_PARAMS
+        )
+
+        get = req.get
+        self.exclude_list = get(MakeCredentialParam.EXCLUDE_LIST, ())
+        self.extensions = get(MakeCredentialParam.EXTENSIONS)
+        self.options = get(MakeCredentialParam.OPTIONS, {})
+        self.pin_auth = get(MakeCredentialParam.PIN_AUTH)
+        self.pin_protocol = get(MakeCredentialParam.PIN_PROTOCOL)
+
+
+class GetAssertionRequest:
+    __slots__ = (
+        "rp_id",
+        "client_data_hash",
+        "allow_list",
+        "extensions",
+        "options",
+        "pin_auth",
+        "pin_protocol",
+    )
+
+    def __init__(self, req: dict):
+        req = _map(req)
+        self.rp_id = _required(req, GetAssertionParam.RP_ID)
+        self.client_data_hash = _required(req, GetAssertionParam.CLIENT_DATA_HASH)
+
+        get = req.get
+        self.allow_list = get(GetAssertionParam.ALLOW_LIST, ())
+        self.extensions = get(GetAssertionParam.EXTENSIONS)
+        self.options = get(GetAssertionParam.OPTIONS, {})
+        self.pin_auth = get(GetAssertionParam.PIN_AUTH)
+        self.pin_protocol = get(GetAssertionParam.PIN_PROTOCOL)
+
+
+class ClientPinRequest:
+    __slots__ = (
+        "pin_protocol",
+        "sub_command",
+        "key_agreement",
+        "pin_auth",
+        "new_pin_enc",
+        "pin_hash_enc",
+    )
+
+    def __init__(self, req: dict):
+        req = _map(req)
+        self.pin_protocol = _required(req, ClientPinParam.PIN_PROTOCOL)
+        self.sub_command = _required(req, ClientPinParam.SUB_COMMAND)
+
+        get = req.get
+        self.key_agreement = get(ClientPinParam.KEY_AGREEMENT)
+        self.pin_auth = get(ClientPinParam.PIN_AUTH)
+        self.new_pin_enc = get(ClientPinParam.NEW_PIN_ENC)
+        self.pin_hash_enc = get(ClientPinParam.PIN_HASH_ENC)
+
+    def require(self, *names: str) -> None:
+        """
+        Check parameters required by the sub-command.
+        """
+        for name in names:
+            if getattr(self, name) is None:
+                raise CborError(Error.MISSING_PARAMETER, "Missing parameter %s" % name)
@@ -0,0 +1,104 @@
+import pytest
+
+from circuitkey.error import CborError
+from circuitkey.request import (
+    ClientPinRequest,
+    GetAssertionRequest,
+    MakeCredentialRequest,
+)
+from circuitkey.schema import (
+    ClientPinParam,
+    CtapCommand,
+    Error,
+    GetAssertionParam,
+    MakeCredentialParam,
+    PinSubCmd,
+)
+
+MAKE_CREDENTIAL = {
+    MakeCredentialParam.CLIENT_DATA_HASH: b"\x01" * 32,
+    MakeCredentialParam.RP: {"id": "example.com"},
+    MakeCredentialParam.USER: {"id": b"\x02" * 16},
+    MakeCredentialParam.PUB_KEY_CRED_PARAMS: [{"alg": -7, "type": "public-key"}],
+}
+
+
+def test_ctap_command_has_no_instance_dict():
+    command = CtapCommand(b"\x00\x00\x00\x01", 0x10, memoryview(b"\x04"))
+
+    assert command.received == 0
+    assert not hasattr(command, "__dict__")
+
+
+def test_make_credential_request():
+    req = MakeCredentialRequest(MAKE_CREDENTIAL)
+
+    assert req.rp_id == "example.com"
+    assert req.exclude_list == ()
+    assert req.options == {}
+    assert req.pin_auth is None
+
+
+@pytest.mark.parametrize("missing", list(MAKE_CREDENTIAL))
+def test_make_credential_missing_parameter(missing):
+    req = dict(MAKE_CREDENTIAL)
+    del req[missing]
+
+    with pytest.raises(CborError) as e:
+        MakeCredentialRequest(req)
+
+    assert e.value.code == Error.MISSING_PARAMETER
+
+
+def test_make_credential_rp_without_id():
+    req = dict(MAKE_CREDENTIAL)
+    req[MakeCredentialParam.RP] = {"name": "Example"}
+
+    with pytest.raises(CborError) as e:
+        MakeCredentialRequest(req)
+
+    assert e.value.code == Error.MISSING_PARAMETER
+
+
+def test_get_assertion_request():
+    req = GetAssertionRequest(
+        {
+            GetAssertionParam.RP_ID: "example.com",
+            GetAssertionParam.CLIENT_DATA_HASH: b"\x01" * 32,
+            GetAssertionParam.OPTIONS: {"up": False},
+        }
+    )
+
+    assert req.rp_id == "example.com"
+    assert req.options == {"up": False}
+    assert req.allow_list == ()
+
+
+def test_request_is_not_a_map():
+    with pytest.raises(CborError) as e:
+        GetAssertionRequest([1, 2])
+
+    assert e.value.code == Error.CBOR_UNEXPECTED_TYPE
+
+
+def test_client_pin_request_uses_integer_keys():
+    req = ClientPinRequest(
+        {0x01: 1, 0x02: PinSubCmd.GET_TOKEN, 0x03: {1: 2}, 0x06: b"\x00" * 16}
+    )
+
+    assert req.pin_protocol == 1
+    assert req.sub_command == PinSubCmd.GET_TOKEN
+    assert req.key_agreement == {1: 2}
+    assert req.pin_hash_enc == b"\x00" * 16
+
+    req.require("key_agreement", "pin_hash_enc")
+
+    with pytest.raises(CborError) as e:
+        req.require("new_pin_enc")
+
+    assert e.value.code == Error.MISSING_PARAMETER
+
+
+def test_client_pin_request_ignores_string_keys():
+    with pytest.raises(CborError):
+        ClientPinRequest({"pinProtocol": 1, ClientPinParam.SUB_COMMAND: 1})
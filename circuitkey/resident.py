@@ -0,0 +1,269 @@
+# Resident (discoverable) credentials.
+#
+# Credentials are kept in a single blob of fixed-size binary slots, so adding
+# or removing a credential rewrites one slot only. The blob is read once, when
+# the store is opened, to build an in-RAM index from rpIdHash to slots and
+# from credential ID to slot. User details are decoded from flash on demand.
+#
+# Slot layout (256 bytes):
+#
+#   status (1) | rpIdHash (32) | credential ID length (1) | credential ID (96)
+#   | user ID length (1) | user ID (64) | user name length (1) | user name (56)
+#   | CRC32 (4)
+#
+# Slots are overwritten in place. A used slot whose CRC does not match was
+# torn by a power loss and is treated as free when the store is opened.
+#
+# The credential ID is a wrapped credential (see circuitkey.credential), so
+# the private key is never stored in plain text.
+
+import binascii
+import struct
+from collections import namedtuple
+
+import adafruit_logging as logging
+
+import circuitkey.storage as storage
+from circuitkey.error import CborError
+from circuitkey.schema import Error
+
+log = logging.getLogger(__name__)
+
+ResidentCredential = namedtuple(
+    "ResidentCredential", ["slot", "rp_id_hash", "credential_id", "user_id", "name"]
+)
+
+MAX_CREDENTIALS = 50
+
+MAX_CREDENTIAL_ID_LEN = 96
+MAX_USER_ID_LEN = 64
+MAX_NAME_LEN = 56
+
+_SLOT_FORMAT = "<B32sB%dsB%dsB%ds" % (
+    MAX_CREDENTIAL_ID_LEN,
+    MAX_USER_ID_LEN,
+    MAX_NAME_LEN,
+)
+_SLOT_DATA_SIZE = struct.calcsize(_SLOT_FORMAT)
+SLOT_SIZE = _SLOT_DATA_SIZE + 4
+
+_SLOT_FREE = 0x00
+_SLOT_USED = 0x01
+
+
+def _crc(data) -> int:
+    return binascii.crc32(data) & 0xFFFFFFFF
+
+
+def _is_valid(data: bytes) -> bool:
+    if len(data) < SLOT_SIZE or data[0] != _SLOT_USED:
+        return False
+
+    (crc,) = struct.unpack_from("<I", data, _SLOT_DATA_SIZE)
+    return crc == _crc(memoryview(data)[:_SLOT_DATA_SIZE])
+
+
+def _truncate_utf8(data: bytes, limit: int) -> bytes:
+    if len(data) <= limit:
+        return data
+
+    # do not cut a multibyte character in half
+    end = limit
+    while end > 0 and data[end] & 0xC0 == 0x80:
+        end -= 1
+    return data[:end]
+
+
+class ResidentCredentialStore:
+    def __init__(self, name: str = "resident.bin", capacity=MAX_CREDENTIALS):
+        self.name = name
+        self.capacity = capacity
+        self._backend = storage.get_backend()
+
+        self._by_rp_id_hash = {}  # rpIdHash -> [slot, ...]
+        self._by_credential_id = {}  # credential ID -> slot
+        self._by_user = {}  # rpIdHash + user ID -> slot
+        self._free = []
+
+        self._load()
+
+    def _load(self) -> None:
+        if not self._backend.exists(self.name):
+            self._backend.write(self.name, bytes(SLOT_SIZE * self.capacity))
+
+        for slot in range(self.capacity):
+            data = self._backend.read_at(self.name, slot * SLOT_SIZE, SLOT_SIZE)
+            if not _is_valid(data):
+                if len(data) == SLOT_SIZE and data[0] == _SLOT_USED:
+                    log.warning("Resident credential slot %d is corrupted", slot)
+                self._free.append(slot)
+                continue
+
+            self._index(self._decode(slot, data))
+
+        # lowest slots are used first
+        self._free.reverse()
+
+        log.info(
+            "Loaded %d resident credentials (capacity %d)", len(self), self.capacity
+        )
+
+    def _index(self, cred: ResidentCredential) -> None:
+        self._by_rp_id_hash.setdefault(cred.rp_id_hash, []).append(cred.slot)
+        self._by_credential_id[cred.credential_id] = cred.slot
+        self._by_user[cred.rp_id_hash + cred.user_id] = cred.slot
+
+    def _unindex(self, cred: ResidentCredential) -> None:
+        slots = self._by_rp_id_hash[cred.rp_id_hash]
+        slots.remove(cred.slot)
+        if len(slots) == 0:
+            del self._by_rp_id_hash[cred.rp_id_hash]
+
+        del self._by_credential_id[cred.credential_id]
+        del self._by_user[cred.rp_id_hash + cred.user_id]
+
+    def _decode(self, slot: int, data: bytes) -> ResidentCredential:
+        (
+            _,
+            rp_id_hash,
+            credential_id_len,
+            credential_id,
+            user_id_len,
+            user_id,
+            name_len,
+            name,
+        ) = struct.unpack_from(_SLOT_FORMAT, data)
+
+        return ResidentCredential(
+            slot,
+            rp_id_hash,
+            credential_id[:credential_id_len],
+            user_id[:user_id_len],
+            name[:name_len].decode("utf-8"),
+        )
+
+    def _write(self, slot: int, data: bytes) -> None:
+        if len(data) == _SLOT_DATA_SIZE:
+            data += struct.pack("<I", _crc(data))
+        self._backend.write_at(self.name, slot * SLOT_SIZE, data)
+
+    def __len__(self) -> int:
+        return len(self._by_credential_id)
+
+    def __contains__(self, credential_id: bytes) -> bool:
+        return credential_id in self._by_credential_id
+
+    def is_full(self) -> bool:
+        return len(self._free) == 0
+
+    def has_user(self, rp_id_hash: bytes, user_id: bytes) -> bool:
+        """
+        Whether a credential of the user and relying party is stored, which
+        add() would overwrite even when the store is full.
+        """
+        return rp_id_hash + user_id in self._by_user
+
+    def add(
+        self, rp_id_hash: bytes, credential_id: bytes, user_id: bytes, name: str = ""
+    ) -> ResidentCredential:
+        """
+        Store credential. Existing credential of the same user and relying
+        party is overwritten.
+        """
+        if len(credential_id) > MAX_CREDENTIAL_ID_LEN:
+            raise CborError(Error.LIMIT_EXCEEDED, "Credential ID too long")
+
+        if len(user_id) > MAX_USER_ID_LEN:
+            raise CborError(Error.LIMIT_EXCEEDED, "User ID too long")
+
+        existing = self._by_user.get(rp_id_hash + user_id)
+        if existing is not None:
+            slot = existing
+            self._unindex(self.read(slot))
+        elif self.is_full():
+            raise CborError(
+                Error.KEY_STORE_FULL,
+                "Resident credential store is full (%d)" % self.capacity,
+            )
+        else:
+            slot = self._free.pop()
+
+        encoded_name = _truncate_utf8(name.encode("utf-8"), MAX_NAME_LEN)
+
+        self._write(
+            slot,
+            struct.pack(
+                _SLOT_FORMAT,
+                _SLOT_USED,
+                rp_id_hash,
+                len(credential_id),
+                credential_id,
+                len(user_id),
+                user_id,
+                len(encoded_name),
+                encoded_name,
+            ),
+        )
+
+        cred = ResidentCredential(
+            slot, rp_id_hash, credential_id, user_id, encoded_name.decode("utf-8")
+        )
+        self._index(cred)
+
+        return cred
+
+    def remove(self, credential_id: bytes) -> bool:
+        slot = self._by_credential_id.get(credential_id)
+        if slot is None:
+            return False
+
+        self._unindex(self.read(slot))
+        self._write(slot, bytes(SLOT_SIZE))
+        self._free.append(slot)
+
+        return True
+
+    def read(self, slot: int) -> ResidentCredential:
+        return self._decode(
+            slot, self._backend.read_at(self.name, slot * SLOT_SIZE, SLOT_SIZE)
+        )
+
+    def get(self, credential_id: bytes) -> ResidentCredential | None:
+        slot = self._by_credential_id.get(credential_id)
+        return self.read(slot) if slot is not None else None
+
+    def count(self, rp_id_hash: bytes) -> int:
+        return len(self._by_rp_id_hash.get(rp_id_hash, ()))
+
+    def slots(self, rp_id_hash: bytes) -> list:
+        """
+        Slots of all credentials of relying party, without reading flash.
+        """
+        return list(self._by_rp_id_hash.get(rp_id_hash, ()))
+
+    def find(self, rp_id_hash: bytes):
+        """
+        Lazily read credentials of relying party.
+        """
+        for slot in self.slots(rp_id_hash):
+            yield self.read(slot)
+
+
+def get_store() -> ResidentCredentialStore:
+    if "_store" not in get_store.__dict__:
+        get_store._store = ResidentCredentialStore()
+
+    return get_store._store
+
+
+def reset() -> None:
+    """
+    Remove all resident credentials.
+    """
+    if "_store" in get_store.__dict__:
+        name = get_store._store.name
+        del get_store._store
+    else:
+        name = "resident.bin"
+
+    storage.get_backend().remove(name)
@@ -0,0 +1,90 @@
+import pytest
+
+from circuitkey import resident
+from circuitkey.error import CborError
+from circuitkey.schema import Error
+
+RP_A = b"\xaa" * 32
+RP_B = b"\xbb" * 32
+
+
+@pytest.fixture
+def store(ram_storage):
+    return resident.ResidentCredentialStore(capacity=4)
+
+
+def test_add_and_find(store: resident.ResidentCredentialStore):
+    store.add(RP_A, b"cred-1", b"user-1", "alice")
+    store.add(RP_A, b"cred-2", b"user-2", "bob")
+    store.add(RP_B, b"cred-3", b"user-1", "alice")
+
+    assert len(store) == 3
+    assert store.count(RP_A) == 2
+    assert [c.credential_id for c in store.find(RP_A)] == [b"cred-1", b"cred-2"]
+    assert store.get(b"cred-3").user_id == b"user-1"
+    assert store.get(b"cred-3").name == "alice"
+    assert store.get(b"unknown") is None
+
+
+def test_index_is_rebuilt_from_flash(store: resident.ResidentCredentialStore):
+    store.add(RP_A, b"cred-1", b"user-1", "alice")
+    store.add(RP_B, b"cred-2", b"user-2", "bob")
+
+    reopened = resident.ResidentCredentialStore(capacity=4)
+
+    assert len(reopened) == 2
+    assert reopened.slots(RP_B) == store.slots(RP_B)
+    assert reopened.get(b"cred-1") == store.get(b"cred-1")
+
+
+def test_same_user_overwrites_credential(store: resident.ResidentCredentialStore):
+    store.add(RP_A, b"cred-1", b"user-1")
+    store.add(RP_A, b"cred-2", b"user-1")
+
+    assert len(store) == 1
+    assert store.get(b"cred-1") is None
+    assert store.get(b"cred-2").user_id == b"user-1"
+
+
+def test_remove(store: resident.ResidentCredentialStore):
+    store.add(RP_A, b"cred-1", b"user-1")
+
+    assert store.remove(b"cred-1")
+    assert not store.remove(b"cred-1")
+    assert store.count(RP_A) == 0
+    assert len(resident.ResidentCredentialStore(capacity=4)) == 0
+
+
+def test_store_full(store: resident.ResidentCredentialStore):
+    for i in range(4):
+        store.add(RP_A, b"cred-%d" % i, b"user-%d" % i)
+
+    assert store.is_full()
+
+    with pytest.raises(CborError) as e:
+        store.add(RP_A, b"cred-4", b"user-4")
+
+    assert e.value.code == Error.KEY_STORE_FULL
+
+    store.remove(b"cred-0")
+    store.add(RP_A, b"cred-4", b"user-4")
+
+
+def test_has_user(store: resident.ResidentCredentialStore):
+    store.add(RP_A, b"cred-1", b"user-1")
+
+    assert store.has_user(RP_A, b"user-1")
+    assert not store.has_user(RP_B, b"user-1")
+    assert not store.has_user(RP_A, b"user-2")
+
+    store.remove(b"cred-1")
+    assert not store.has_user(RP_A, b"user-1")
+
+
+def test_name_is_truncated_at_character_boundary(
+    store: resident.ResidentCredentialStore,
+):
+    cred = store.add(RP_A, b"cred-1", b"user-1", "ż" * resident.MAX_NAME_LEN)
+
+    assert cred.name == "ż" * (resident.MAX_NAME_LEN // 2)
+    assert store.get(b"cred-1").name == cred.name
@@ -1,7 +1,27 @@
-from collections import namedtuple
 from enum import IntFlag, unique
 
-CtapCommand = namedtuple("CtapCommand", ["cid", "cmd", "payload"])
+
+class CtapCommand:
+    """
+    CTAPHID message. The payload is usually a memoryview of an arena buffer
+    (see circuitkey.arena), received is the arrival time in nanoseconds
+    (time.monotonic_ns) or 0 if unknown.
+    """
+
+    __slots__ = ("cid", "cmd", "payload", "received")
+
+    def __init__(self, cid: bytes, cmd: int, payload, received: int = 0):
+        self.cid = cid
+        self.cmd = cmd
+        self.payload = payload
+        self.received = received
+
+    def __repr__(self) -> str:
+        return "CtapCommand(cid=%r, cmd=%r, length=%d)" % (
+            self.cid,
+            self.cmd,
+            len(self.payload),
+        )
 
 
 # Error codes
@@ -54,7 +74,7 @@ class Error(IntFlag):
     ACTION_TIMEOUT = 0x3A  # Action timeout.
     UP_REQUIRED = 0x3B  # Up required.
 
-    to_byte = lambda self: self.value.to_bytes(1, "big")
+    to_byte = lambda self: ERROR_BYTES[self]
 
     is_ctap_error = lambda self: self.value <= 0x0B
 
@@ -66,7 +86,7 @@ class KeepaliveStatusCode(IntFlag):
     PROCESSING = 1  # The authenticator is still processing the current request.
     UPNEEDED = 2  # The authenticator is waiting for user presence.
 
-    to_byte = lambda self: self.value.to_bytes(1, "big")
+    to_byte = lambda self: KEEPALIVE_BYTES[self]
 
 
 @unique
@@ -89,6 +109,9 @@ class CtaphidCmd(IntFlag):
     CANCEL = 0x11
     KEEPALIVE = 0x3B
     ERROR = 0x3F
+    # vendor commands (0x40-0x7F)
+    TRACE = 0x41
+    STATS = 0x42
 
 
 @unique
@@ -110,10 +133,78 @@ class PinSubCmd(IntFlag):
     GET_TOKEN = 0x05
 
 
+@unique
+class ClientPinParam(IntFlag):
+    PIN_PROTOCOL = 0x01
+    SUB_COMMAND = 0x02
+    KEY_AGREEMENT = 0x03
+    PIN_AUTH = 0x04
+    NEW_PIN_ENC = 0x05
+    PIN_HASH_ENC = 0x06
+
+
+@unique
+class MakeCredentialParam(IntFlag):
+    CLIENT_DATA_HASH = 0x01
+    RP = 0x02
+    USER = 0x03
+    PUB_KEY_CRED_PARAMS = 0x04
+    EXCLUDE_LIST = 0x05
+    EXTENSIONS = 0x06
+    OPTIONS = 0x07
+    PIN_AUTH = 0x08
+    PIN_PROTOCOL = 0x09
+
+
+@unique
+class GetAssertionParam(IntFlag):
+    RP_ID = 0x01
+    CLIENT_DATA_HASH = 0x02
+    ALLOW_LIST = 0x03
+    EXTENSIONS = 0x04
+    OPTIONS = 0x05
+    PIN_AUTH = 0x06
+    PIN_PROTOCOL = 0x07
+
+
+# Authenticator data flags
+# https://www.w3.org/TR/webauthn/#sec-authenticator-data
+
+
+@unique
+class AuthDataFlag(IntFlag):
+    UP = 0x01  # User present.
+    UV = 0x04  # User verified.
+    AT = 0x40  # Attested credential data included.
+    ED = 0x80  # Extension data included.
+
+
+COSE_ALG_ES256 = -7
+
+PUBLIC_KEY_CREDENTIAL_TYPE = "public-key"
+
 CTAPHID_BROADCAST_CID = int(0xFFFFFFFF).to_bytes(4, "big")
 
 CBOR_SUCCCESS_CODE = 0x00
 
+# Lookup tables for hot paths, computed once. Membership tests, to_bytes and
+# comparisons of IntFlag members go through flag arithmetic, which is slow.
+
+
+def _codes(flag) -> frozenset:
+    return frozenset(int(member) for member in flag.__members__.values())
+
+
+def _byte_table(flag) -> dict:
+    return {int(member): bytes((member,)) for member in flag.__members__.values()}
+
+
+ERROR_CODES = _codes(Error)
+
+ERROR_BYTES = _byte_table(Error)  # code -> status byte
+KEEPALIVE_BYTES = _byte_table(KeepaliveStatusCode)
+CBOR_SUCCESS_BYTE = bytes((CBOR_SUCCCESS_CODE,))
+
 
 def cbor_pin_response(retries=None, key_agreement=None, pin_token=None):
     response = {}
@@ -128,3 +219,21 @@ def cbor_pin_response(retries=None, key_agreement=None, pin_token=None):
         response[0x02] = pin_token
 
     return response if len(response) > 0 else None
+
+
+def cbor_make_credential_response(fmt, auth_data, att_stmt):
+    return {0x01: fmt, 0x02: auth_data, 0x03: att_stmt}
+
+
+def cbor_get_assertion_response(
+    credential, auth_data, signature, user=None, number_of_credentials=None
+):
+    response = {0x01: credential, 0x02: auth_data, 0x03: signature}
+
+    if user is not None:
+        response[0x04] = user
+
+    if number_of_credentials is not None:
+        response[0x05] = number_of_credentials
+
+    return response
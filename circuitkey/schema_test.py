@@ -0,0 +1,22 @@
+from circuitkey.schema import (
+    ERROR_BYTES,
+    ERROR_CODES,
+    KEEPALIVE_BYTES,
+    Error,
+    KeepaliveStatusCode,
+)
+
+
+def test_byte_tables_cover_all_codes():
+    for error in Error.__members__.values():
+        assert ERROR_BYTES[error] == error.value.to_bytes(1, "big")
+        assert error.to_byte() is ERROR_BYTES[error]
+
+    for status in KeepaliveStatusCode.__members__.values():
+        assert KEEPALIVE_BYTES[status] == bytes((status,))
+
+
+def test_error_codes():
+    assert Error.PIN_AUTH_INVALID in ERROR_CODES
+    assert 0x33 in ERROR_CODES
+    assert 0x07 not in ERROR_CODES
@@ -0,0 +1,67 @@
+# Runtime performance counters.
+#
+# Counters are plain integers updated in place by hid, ctaphid, cbor, pin and
+# storage. They are read with the vendor command CTAPHID_STATS (see
+# circuitkey.ctaphid) as CBOR and compared between polls by host/stats.py.
+
+import gc
+
+# name -> value
+counters = {
+    "packets_in": 0,
+    "packets_out": 0,
+    "cancellations": 0,
+    "keepalives": 0,
+    "flash_writes": 0,
+    "pin_failures": 0,
+    "loop_iterations": 0,
+    "arena_misses": 0,  # message buffers allocated, see circuitkey.arena
+    "mem_free_min": 0,  # lowest gc.mem_free() seen, 0 if not available
+}
+
+commands = {}  # CTAPHID command -> count
+cbor_commands = {}  # CBOR command -> count
+errors = {}  # Error code -> count, CTAPHID errors and CBOR status codes
+
+
+def inc(name: str) -> None:
+    counters[name] += 1
+
+
+def count(table: dict, key: int) -> None:
+    table[key] = table.get(key, 0) + 1
+
+
+def sample_memory() -> None:
+    # gc.mem_free() exists on CircuitPython only
+    if not hasattr(gc, "mem_free"):
+        return
+
+    free = gc.mem_free()
+    if counters["mem_free_min"] == 0 or free < counters["mem_free_min"]:
+        counters["mem_free_min"] = free
+
+
+def tick() -> None:
+    """
+    One iteration of the main loop.
+    """
+    counters["loop_iterations"] += 1
+    sample_memory()
+
+
+def snapshot() -> dict:
+    data = dict(counters)
+    data["commands"] = dict(commands)
+    data["cbor_commands"] = dict(cbor_commands)
+    data["errors"] = dict(errors)
+    return data
+
+
+def reset() -> None:
+    for name in counters:
+        counters[name] = 0
+
+    commands.clear()
+    cbor_commands.clear()
+    errors.clear()
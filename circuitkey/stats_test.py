@@ -0,0 +1,60 @@
+import gc
+
+import pytest
+
+import circuitkey.stats as stats
+
+
+@pytest.fixture(autouse=True)
+def zero_stats():
+    stats.reset()
+    yield
+    stats.reset()
+
+
+def test_inc_and_count():
+    stats.inc("packets_in")
+    stats.inc("packets_in")
+    stats.count(stats.commands, 0x10)
+
+    data = stats.snapshot()
+
+    assert data["packets_in"] == 2
+    assert data["commands"] == {0x10: 1}
+    assert data["errors"] == {}
+
+
+def test_snapshot_is_a_copy():
+    data = stats.snapshot()
+    stats.count(stats.errors, 0x01)
+
+    assert data["errors"] == {}
+
+
+def test_reset():
+    stats.inc("keepalives")
+    stats.count(stats.cbor_commands, 0x04)
+
+    stats.reset()
+
+    assert stats.counters["keepalives"] == 0
+    assert stats.cbor_commands == {}
+
+
+def test_tick_keeps_memory_low_water_mark(monkeypatch):
+    free = iter((5000, 3000, 4000))
+    monkeypatch.setattr(gc, "mem_free", lambda: next(free), raising=False)
+
+    for _ in range(3):
+        stats.tick()
+
+    assert stats.counters["loop_iterations"] == 3
+    assert stats.counters["mem_free_min"] == 3000
+
+
+def test_flash_writes_are_counted(ram_storage):
+    import circuitkey.storage as storage
+
+    storage.get_backend().write("test", b"data")
+
+    assert stats.counters["flash_writes"] == 1
@@ -1,62 +1,401 @@
+import binascii
 import json
 import os
+import struct
 
 import adafruit_logging as logging
+import flynn
+
+from circuitkey import stats, trace
+from circuitkey.logstore import LogStore, Segments
+from circuitkey.storage_backend import (
+    Backend,
+    FileSystemBackend,
+    InstrumentedBackend,
+    RamBackend,
+)
 
 log = logging.getLogger(__name__)
 
+# Buckets are cached in RAM. Loads are served from the cache and saves only
+# mark the bucket dirty (if its data has changed). Dirty buckets are written
+# to flash by flush(), which runs once at the end of every CBOR command, or
+# right away by save(..., durable=True) for state which must survive a power
+# loss, e.g. PIN retries.
+#
+# Bucket data is stored as a format version byte followed by CBOR. Data
+# written by older versions as JSON is still read and is rewritten in the
+# binary format.
+#
+# Every bucket has two slots, <name>.0.bin and <name>.1.bin, written
+# alternately:
+#
+#   sequence (4) | length (2) | data (length) | CRC32 (4)
+#
+# A power loss can only corrupt the slot being written, the other one still
+# holds the previous data. Loading reads both slots and takes the valid one
+# with the higher sequence number.
+
+_cache = {}  # name -> data
+_dirty = {}  # name -> bucket with unsaved changes
+_slots = {}  # name -> (sequence, slot) of the latest valid slot
+
+# when disabled every load reads and every save writes flash, including the
+# record log, which is recovered again on each load
+caching = True
+
+# reads and writes of all blobs (buckets, the record log, resident
+# credentials), counted by the backend returned by get_backend()
+io_stats = {"reads": 0, "writes": 0}
+
+# small, frequently updated buckets are appended to a record log instead of
+# rewriting their files, see circuitkey.logstore
+LOG_SEGMENTS = 2
+LOG_SEGMENT_SIZE = 4096
+
+FORMAT_VERSION = 0x01
+
+
+def encode(data: dict) -> bytes:
+    return bytes((FORMAT_VERSION,)) + flynn.dumps(data)
+
+
+def decode(raw: bytes) -> dict:
+    if len(raw) == 0:
+        return {}
+
+    if raw[0] == FORMAT_VERSION:
+        return flynn.loads(raw[1:])
+
+    if raw[:1] == b"{":
+        return json.loads(raw)
+
+    raise ValueError("Unknown storage format: %d" % raw[0])
+
+
+_SLOT_HEADER_FORMAT = "<IH"
+_SLOT_HEADER_SIZE = struct.calcsize(_SLOT_HEADER_FORMAT)
+
+
+def _crc(data) -> int:
+    return binascii.crc32(data) & 0xFFFFFFFF
+
+
+class _CountingBackend(Backend):
+    def __init__(self, backend: Backend):
+        self.backend = backend
+
+    def exists(self, name: str) -> bool:
+        return self.backend.exists(name)
+
+    def read(self, name: str) -> bytes | None:
+        data = self.backend.read(name)
+        if data is not None:
+            io_stats["reads"] += 1
+        return data
+
+    def read_at(self, name: str, offset: int, size: int) -> bytes:
+        data = self.backend.read_at(name, offset, size)
+        if len(data) > 0:
+            io_stats["reads"] += 1
+        return data
+
+    def write(self, name: str, data: bytes) -> None:
+        io_stats["writes"] += 1
+        stats.inc("flash_writes")
+        self.backend.write(name, data)
+
+    def write_at(self, name: str, offset: int, data: bytes) -> None:
+        io_stats["writes"] += 1
+        stats.inc("flash_writes")
+        self.backend.write_at(name, offset, data)
+
+    def remove(self, name: str) -> None:
+        self.backend.remove(name)
+
+    def names(self) -> list:
+        return self.backend.names()
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+def get_backend() -> Backend:
+    """
+    Storage backend, selected by CIRCUITKEY_STORAGE in settings.toml:
+    "fs" (default) for files in data/, "ram" for RAM only. Prefixed with
+    "instrumented-" (e.g. "instrumented-fs") the backend is wrapped in
+    InstrumentedBackend, which counts operations, bytes and time spent.
+    """
+    if "_backend" not in get_backend.__dict__:
+        kind = os.getenv("CIRCUITKEY_STORAGE") or "fs"
+
+        instrumented = kind.startswith("instrumented-")
+        if instrumented:
+            kind = kind[len("instrumented-") :]
+
+        if kind == "ram":
+            log.warning("Using RAM storage, nothing will survive a reboot")
+            backend = RamBackend()
+        else:
+            backend = FileSystemBackend("data")
+
+        if instrumented:
+            backend = InstrumentedBackend(backend)
+
+        get_backend._backend = _CountingBackend(backend)
+
+    return get_backend._backend
+
+
+def set_backend(backend: Backend) -> None:
+    invalidate()
+
+    if not isinstance(backend, _CountingBackend):
+        backend = _CountingBackend(backend)
+    get_backend._backend = backend
+
+
+def _read_file(name: str) -> bytes | None:
+    return get_backend().read(name)
+
+
+def _write_file(name: str, raw: bytes) -> None:
+    get_backend().write(name, raw)
+
+
+def _slot_name(name: str, slot: int) -> str:
+    return "%s.%d.bin" % (name, slot)
+
+
+def _parse_slot(raw: bytes) -> tuple | None:
+    if len(raw) < _SLOT_HEADER_SIZE:
+        return None
+
+    seq, length = struct.unpack_from(_SLOT_HEADER_FORMAT, raw)
+    end = _SLOT_HEADER_SIZE + length
+    if len(raw) != end + 4:
+        return None
+
+    (crc,) = struct.unpack_from("<I", raw, end)
+    if crc != _crc(memoryview(raw)[:end]):
+        return None
+
+    return seq, raw[_SLOT_HEADER_SIZE:end]
+
+
+def _read(name: str) -> dict | None:
+    """
+    Data of the latest valid slot or None if there is none.
+    """
+    latest = None
+    for slot in (0, 1):
+        raw = _read_file(_slot_name(name, slot))
+        parsed = _parse_slot(raw) if raw is not None else None
+
+        if parsed is None:
+            if raw is not None:
+                log.warning("Ignoring invalid slot %d of %s", slot, name)
+            continue
+
+        if latest is None or parsed[0] > latest[0]:
+            latest = (parsed[0], slot, parsed[1])
+
+    if latest is None:
+        return None
+
+    _slots[name] = latest[:2]
+    return decode(latest[2])
+
+
+def _write(name: str, data: dict) -> None:
+    if name not in _slots:
+        _read(name)
+
+    seq, slot = _slots.get(name, (0, 1))
+    seq, slot = seq + 1, 1 - slot
+
+    payload = encode(data)
+    raw = struct.pack(_SLOT_HEADER_FORMAT, seq, len(payload)) + payload
+    raw += struct.pack("<I", _crc(raw))
+
+    _write_file(_slot_name(name, slot), raw)
+    _slots[name] = (seq, slot)
+
+
+def flush() -> None:
+    """
+    Write all dirty buckets to flash.
+    """
+    if _dirty:
+        trace.record(trace.FLUSH, None, len(_dirty))
+
+    for name in sorted(_dirty):
+        _dirty.pop(name)._write(_cache[name])
+
+
+def invalidate() -> None:
+    """
+    Drop the RAM cache, including unsaved changes. The record log is
+    recovered from flash again when it is used next.
+    """
+    _cache.clear()
+    _dirty.clear()
+    _slots.clear()
+
+    if "_log" in get_log.__dict__:
+        del get_log._log
+
+
+def _log_segments() -> Segments:
+    return Segments(get_backend(), "log", LOG_SEGMENTS, LOG_SEGMENT_SIZE)
+
+
+def get_log() -> LogStore:
+    if "_log" not in get_log.__dict__:
+        get_log._log = LogStore(_log_segments())
+
+    return get_log._log
+
 
 def reset():
-    if os.path.exists("data"):
-        os.rmdir("data")
+    """
+    Remove all stored data.
+    """
+    invalidate()
+    get_backend().clear()
 
 
 class Bucket:
-    def __init__(self, filename: str):
-        if not filename.endswith(".json"):
-            raise ValueError("File must be a .json file")
+    """
+    Dictionary stored in the slots of <name>.
+    """
 
-        if not os.path.exists("data"):
-            os.mkdir("data")
+    def __init__(self, name: str):
+        if "." in name or "/" in name:
+            raise ValueError("Invalid bucket name: %s" % name)
 
-        self.path = os.path.join("data", filename)
+        self.name = name
 
     def load(self):
-        with open(self.path, "r") as f:
-            data = f.read()
-            if len(data) == 0:
-                return {}
-            return json.load(data)
+        data = _cache.get(self.name) if caching else None
 
-    def save(self, data):
-        with open(self.path, "w") as f:
-            f.write(json.dumps(data))
+        if data is None:
+            data = self._read()
+            _cache[self.name] = data
 
+        # copy, so changes are not visible in the cache until saved
+        return dict(data)
 
-class CounterBucket(Bucket):
-    def __init__(self):
-        super().__init__("counter.json")
+    def save(self, data, durable=False):
+        if _cache.get(self.name) != data:
+            _cache[self.name] = dict(data)
+            _dirty[self.name] = self
 
-    def increment(self):
+        if durable or not caching:
+            self.flush()
+
+    def flush(self):
+        if self.name in _dirty:
+            del _dirty[self.name]
+            self._write(_cache[self.name])
+
+    def _read_legacy(self) -> dict:
+        """
+        Move data of the JSON file written by older versions to the bucket.
+        """
+        legacy = self.name + ".json"
+        raw = _read_file(legacy)
+        if raw is None:
+            return {}
+
+        log.info("Migrating %s", legacy)
+        data = decode(raw)
+        self._write(data)
+        get_backend().remove(legacy)
+
+        return data
+
+    def _read(self) -> dict:
+        data = _read(self.name)
+        return data if data is not None else self._read_legacy()
+
+    def _write(self, data: dict) -> None:
+        _write(self.name, data)
+
+
+class LogBucket(Bucket):
+    """
+    Bucket kept in the record log under its name.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.key = name.encode()
+
+    def _read(self) -> dict:
+        if not caching:
+            # the log keeps all values in RAM, recover it from flash again
+            get_log.__dict__.pop("_log", None)
+
+        value = get_log().get(self.key)
+        if value is not None:
+            return decode(value)
+
+        return self._read_legacy()
+
+    def _write(self, data: dict) -> None:
+        get_log().put(self.key, encode(data))
+
+
+class CounterBucket(LogBucket):
+    def __init__(self, name: str = "counter"):
+        super().__init__(name)
+
+    def increment(self) -> int:
         data = self.load()
-        data["counter"] += 1
+        data["counter"] = data.get("counter", 0) + 1
         self.save(data)
+        return data["counter"]
 
     def get(self):
-        return self.load()["counter"]
+        return self.load().get("counter", 0)
+
+    def set(self, value: int, durable=False):
+        data = self.load()
+        data["counter"] = value
+        self.save(data, durable=durable)
 
     def reset(self):
         self.save({"counter": 0})
 
 
-class PinBucket(Bucket):
+class PinBucket(LogBucket):
     def __init__(self):
-        super().__init__("pin.json")
+        super().__init__("pin")
+
+
+class SecretBucket(Bucket):
+    def __init__(self):
+        super().__init__("secret")
+
+    def get_master_key(self) -> bytes | None:
+        master_key = self.load().get("master_key")
+        if isinstance(master_key, str):
+            # hex string of JSON files
+            return bytes.fromhex(master_key)
+        return master_key
+
+    def set_master_key(self, master_key: bytes) -> None:
+        data = self.load()
+        data["master_key"] = bytes(master_key)
+        # credentials cannot be unwrapped once the master key is lost
+        self.save(data, durable=True)
 
 
-class KeyBucket(Bucket):
+class KeyBucket(LogBucket):
     def __init__(self):
-        super().__init__("keys.json")
+        super().__init__("keys")
 
     def add(self, key):
         data = self.load()
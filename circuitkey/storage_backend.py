@@ -0,0 +1,234 @@
+# Storage backends.
+#
+# Everything the authenticator persists (buckets, the record log, resident
+# credentials) is a named blob in a backend:
+#
+#   FileSystemBackend   files in a directory of the CIRCUITPY filesystem
+#   RamBackend          dictionary in RAM, lost on reboot
+#   InstrumentedBackend wrapper counting operations, bytes and time spent,
+#                       optionally adding latency to simulate slow flash
+#
+# The backend is selected at startup, see circuitkey.storage.get_backend.
+
+import errno
+import os
+import time
+
+import adafruit_logging as logging
+
+log = logging.getLogger(__name__)
+
+
+class Backend:
+    def exists(self, name: str) -> bool:
+        raise NotImplementedError()
+
+    def read(self, name: str) -> bytes | None:
+        """
+        Content of the blob or None if it does not exist.
+        """
+        raise NotImplementedError()
+
+    def read_at(self, name: str, offset: int, size: int) -> bytes:
+        raise NotImplementedError()
+
+    def write(self, name: str, data: bytes) -> None:
+        """
+        Replace content of the blob.
+        """
+        raise NotImplementedError()
+
+    def write_at(self, name: str, offset: int, data: bytes) -> None:
+        """
+        Overwrite part of the blob, which is created if it does not exist.
+        """
+        raise NotImplementedError()
+
+    def remove(self, name: str) -> None:
+        raise NotImplementedError()
+
+    def names(self) -> list:
+        raise NotImplementedError()
+
+    def clear(self) -> None:
+        """
+        Remove all blobs.
+        """
+        for name in self.names():
+            self.remove(name)
+
+
+class FileSystemBackend(Backend):
+    def __init__(self, root: str = "data"):
+        self.root = root
+
+    def _path(self, name: str) -> str:
+        return self.root + "/" + name
+
+    @staticmethod
+    def _missing(e: OSError) -> bool:
+        # other errors must not be mistaken for missing data, which would be
+        # formatted or recreated empty
+        return e.errno == errno.ENOENT
+
+    def _ensure_root(self) -> None:
+        try:
+            os.mkdir(self.root)
+        except OSError:
+            pass  # already exists
+
+    def exists(self, name: str) -> bool:
+        try:
+            os.stat(self._path(name))
+            return True
+        except OSError as e:
+            if not self._missing(e):
+                raise
+            return False
+
+    def read(self, name: str) -> bytes | None:
+        try:
+            with open(self._path(name), "rb") as f:
+                return f.read()
+        except OSError as e:
+            if not self._missing(e):
+                raise
+            return None
+
+    def read_at(self, name: str, offset: int, size: int) -> bytes:
+        try:
+            with open(self._path(name), "rb") as f:
+                f.seek(offset)
+                return f.read(size)
+        except OSError as e:
+            if not self._missing(e):
+                raise
+            return b""
+
+    def write(self, name: str, data: bytes) -> None:
+        self._ensure_root()
+        with open(self._path(name), "wb") as f:
+            f.write(data)
+
+    def write_at(self, name: str, offset: int, data: bytes) -> None:
+        self._ensure_root()
+        mode = "r+b" if self.exists(name) else "wb"
+        with open(self._path(name), mode) as f:
+            f.seek(offset)
+            f.write(data)
+
+    def remove(self, name: str) -> None:
+        if self.exists(name):
+            os.remove(self._path(name))
+
+    def names(self) -> list:
+        try:
+            return os.listdir(self.root)
+        except OSError as e:
+            if not self._missing(e):
+                raise
+            return []
+
+    def clear(self) -> None:
+        super().clear()
+
+        try:
+            os.rmdir(self.root)
+        except OSError:
+            pass  # does not exist
+
+
+class RamBackend(Backend):
+    def __init__(self):
+        self._blobs = {}  # name -> bytearray
+
+    def exists(self, name: str) -> bool:
+        return name in self._blobs
+
+    def read(self, name: str) -> bytes | None:
+        blob = self._blobs.get(name)
+        return bytes(blob) if blob is not None else None
+
+    def read_at(self, name: str, offset: int, size: int) -> bytes:
+        blob = self._blobs.get(name, b"")
+        return bytes(blob[offset : offset + size])
+
+    def write(self, name: str, data: bytes) -> None:
+        self._blobs[name] = bytearray(data)
+
+    def write_at(self, name: str, offset: int, data: bytes) -> None:
+        blob = self._blobs.setdefault(name, bytearray())
+        if len(blob) < offset:
+            blob.extend(bytes(offset - len(blob)))
+        blob[offset : offset + len(data)] = data
+
+    def remove(self, name: str) -> None:
+        self._blobs.pop(name, None)
+
+    def names(self) -> list:
+        return list(self._blobs)
+
+
+class InstrumentedBackend(Backend):
+    """
+    :param latency_us: added to every operation
+    :param latency_us_per_byte: added per byte read or written
+    """
+
+    OPS = ("exists", "read", "write", "remove", "names")
+
+    def __init__(
+        self, backend: Backend, latency_us: int = 0, latency_us_per_byte: float = 0
+    ):
+        self.backend = backend
+        self.latency_us = latency_us
+        self.latency_us_per_byte = latency_us_per_byte
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        self.stats = {
+            "ops": {op: 0 for op in self.OPS},
+            "bytes_read": 0,
+            "bytes_written": 0,
+            "time_us": 0,
+        }
+
+    def _call(self, op: str, func, *args, size: int = 0):
+        start = time.monotonic_ns()
+
+        delay = self.latency_us + self.latency_us_per_byte * size
+        if delay > 0:
+            time.sleep(delay / 1000000)
+
+        result = func(*args)
+
+        self.stats["ops"][op] += 1
+        self.stats["time_us"] += (time.monotonic_ns() - start) // 1000
+        return result
+
+    def exists(self, name: str) -> bool:
+        return self._call("exists", self.backend.exists, name)
+
+    def read(self, name: str) -> bytes | None:
+        data = self._call("read", self.backend.read, name)
+        self.stats["bytes_read"] += len(data) if data is not None else 0
+        return data
+
+    def read_at(self, name: str, offset: int, size: int) -> bytes:
+        data = self._call("read", self.backend.read_at, name, offset, size, size=size)
+        self.stats["bytes_read"] += len(data)
+        return data
+
+    def write(self, name: str, data: bytes) -> None:
+        self._call("write", self.backend.write, name, data, size=len(data))
+        self.stats["bytes_written"] += len(data)
+
+    def write_at(self, name: str, offset: int, data: bytes) -> None:
+        self._call("write", self.backend.write_at, name, offset, data, size=len(data))
+        self.stats["bytes_written"] += len(data)
+
+    def remove(self, name: str) -> None:
+        self._call("remove", self.backend.remove, name)
+
+    def names(self) -> list:
+        return self._call("names", self.backend.names)
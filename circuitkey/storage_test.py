@@ -1 +1,254 @@
-# TODO add unit tests
+import pytest
+
+from circuitkey import storage
+from circuitkey.storage_backend import FileSystemBackend, InstrumentedBackend
+
+
+@pytest.fixture(autouse=True)
+def backend(ram_storage, monkeypatch):
+    monkeypatch.setattr(storage, "io_stats", {"reads": 0, "writes": 0})
+    return ram_storage
+
+
+def test_load_missing_bucket():
+    assert storage.Bucket("missing").load() == {}
+
+
+def test_save_and_load():
+    bucket = storage.Bucket("test")
+
+    bucket.save({"a": 1})
+    storage.flush()
+    storage.invalidate()
+
+    assert storage.Bucket("test").load() == {"a": 1}
+
+
+def test_loads_are_served_from_cache():
+    storage.Bucket("test").save({"a": 1}, durable=True)
+    storage.invalidate()
+
+    for _ in range(3):
+        assert storage.Bucket("test").load() == {"a": 1}
+
+    assert storage.io_stats["reads"] == 1
+
+
+def test_loaded_data_is_a_copy():
+    bucket = storage.Bucket("test")
+    bucket.save({"a": 1})
+
+    bucket.load()["a"] = 2
+
+    assert bucket.load() == {"a": 1}
+
+
+def test_saves_are_coalesced_until_flush():
+    bucket = storage.Bucket("test")
+
+    for i in range(5):
+        bucket.save({"a": i})
+
+    assert storage.io_stats["writes"] == 0
+
+    storage.flush()
+    storage.flush()
+
+    assert storage.io_stats["writes"] == 1
+
+
+def test_unchanged_data_is_not_written():
+    bucket = storage.Bucket("test")
+    bucket.save({"a": 1}, durable=True)
+
+    bucket.save({"a": 1})
+    storage.flush()
+
+    assert storage.io_stats["writes"] == 1
+
+
+def test_durable_save_is_written_immediately():
+    storage.Bucket("test").save({"a": 1}, durable=True)
+
+    assert storage.io_stats["writes"] == 1
+
+    storage.invalidate()
+    assert storage.Bucket("test").load() == {"a": 1}
+
+
+def test_caching_disabled(monkeypatch):
+    monkeypatch.setattr(storage, "caching", False)
+
+    bucket = storage.Bucket("test")
+    bucket.save({"a": 1})
+    bucket.load()
+    bucket.load()
+
+    assert storage.io_stats["writes"] == 1
+    assert storage.io_stats["reads"] == 2
+
+
+def test_counter_increment():
+    counter = storage.CounterBucket()
+
+    assert counter.get() == 0
+    assert counter.increment() == 1
+    assert counter.increment() == 2
+    assert storage.CounterBucket().get() == 2
+
+
+def test_secret_bucket():
+    secret = storage.SecretBucket()
+
+    assert secret.get_master_key() is None
+
+    secret.set_master_key(b"\x01" * 32)
+
+    assert storage.SecretBucket().get_master_key() == b"\x01" * 32
+
+
+def test_log_bucket_is_appended_to_log(backend):
+    counter = storage.CounterBucket()
+    counter.increment()
+    storage.flush()
+    counter.increment()
+    storage.flush()
+    storage.invalidate()
+
+    assert storage.CounterBucket().get() == 2
+    assert backend.names() == ["log.0"]
+
+
+def test_log_bucket_moves_json_file_to_log(backend):
+    # bucket file written by older versions
+    backend.write("counter.json", b'{"counter": 7}')
+
+    assert storage.CounterBucket().get() == 7
+    assert not backend.exists("counter.json")
+
+    storage.invalidate()
+    assert storage.CounterBucket().get() == 7
+
+
+def test_json_file_is_migrated(backend):
+    backend.write("test.json", b'{"a": 1}')
+
+    assert storage.Bucket("test").load() == {"a": 1}
+    storage.invalidate()
+
+    assert not backend.exists("test.json")
+    # sequence (4) | length (2) | format version
+    assert backend.read("test.0.bin")[6] == storage.FORMAT_VERSION
+    assert storage.Bucket("test").load() == {"a": 1}
+
+
+def test_encode_bytes():
+    data = {"pin": b"\x01" * 16, "retry_count": 8}
+
+    encoded = storage.encode(data)
+
+    assert storage.decode(encoded) == data
+    assert len(encoded) < len('{"pin": "%s", "retry_count": 8}' % data["pin"].hex())
+
+
+def test_decode_unknown_format():
+    with pytest.raises(ValueError):
+        storage.decode(b"\xff")
+
+
+def test_invalid_bucket_name():
+    with pytest.raises(ValueError):
+        storage.Bucket("test.json")
+
+
+def test_slots_are_written_alternately(backend):
+    bucket = storage.Bucket("test")
+    bucket.save({"a": 1}, durable=True)
+    bucket.save({"a": 2}, durable=True)
+
+    assert sorted(backend.names()) == ["test.0.bin", "test.1.bin"]
+
+    storage.invalidate()
+    assert storage.Bucket("test").load() == {"a": 2}
+
+
+def test_corrupted_slot_falls_back_to_previous_data(backend):
+    bucket = storage.Bucket("test")
+    bucket.save({"a": 1}, durable=True)
+    bucket.save({"a": 2}, durable=True)
+
+    raw = backend.read("test.1.bin")
+    backend.write("test.1.bin", raw[:-1] + bytes((raw[-1] ^ 0xFF,)))
+    storage.invalidate()
+
+    assert storage.Bucket("test").load() == {"a": 1}
+
+
+def test_save_without_load_continues_sequence():
+    storage.Bucket("test").save({"a": 1}, durable=True)
+    storage.Bucket("test").save({"a": 2}, durable=True)
+    storage.invalidate()
+
+    storage.Bucket("test").save({"a": 3}, durable=True)
+    storage.invalidate()
+
+    assert storage.Bucket("test").load() == {"a": 3}
+
+
+def test_reset_removes_everything(backend):
+    storage.Bucket("test").save({"a": 1}, durable=True)
+    storage.CounterBucket().increment()
+    storage.flush()
+
+    storage.reset()
+
+    assert backend.names() == []
+    assert storage.Bucket("test").load() == {}
+
+
+def test_file_system_backend(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    storage.set_backend(FileSystemBackend("data"))
+
+    storage.Bucket("test").save({"a": 1}, durable=True)
+    storage.invalidate()
+
+    assert storage.Bucket("test").load() == {"a": 1}
+    assert (tmp_path / "data" / "test.0.bin").exists()
+
+    storage.reset()
+
+    assert not (tmp_path / "data").exists()
+
+
+def test_file_system_read_errors_are_not_missing_data(tmp_path):
+    # root is a file, so opening anything in it fails with ENOTDIR
+    (tmp_path / "data").write_bytes(b"")
+    backend = FileSystemBackend(str(tmp_path / "data"))
+
+    with pytest.raises(OSError):
+        backend.read("log.0")
+
+    assert FileSystemBackend(str(tmp_path / "missing")).read("log.0") is None
+
+
+@pytest.mark.parametrize(
+    "kind, instrumented", [("ram", False), ("instrumented-ram", True)]
+)
+def test_backend_selection(monkeypatch, kind, instrumented):
+    monkeypatch.setenv("CIRCUITKEY_STORAGE", kind)
+    monkeypatch.delattr(storage.get_backend, "_backend")
+
+    backend = storage.get_backend().backend
+
+    assert isinstance(backend, InstrumentedBackend) == instrumented
+
+
+def test_all_backend_writes_are_counted():
+    backend = storage.get_backend()
+
+    backend.write("blob", b"abc")
+    backend.write_at("blob", 3, b"def")
+    backend.read_at("blob", 0, 6)
+
+    assert storage.io_stats == {"reads": 1, "writes": 2}
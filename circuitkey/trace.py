@@ -0,0 +1,105 @@
+# Binary trace of protocol events.
+#
+# Events are written into a preallocated ring buffer of fixed-size entries.
+# Recording one is a single struct.pack_into, no text is formatted, so it
+# can stay enabled on deployed keys. The buffer is read with the vendor
+# command CTAPHID_TRACE (see circuitkey.ctaphid) and rendered as a timeline
+# by host/trace.py.
+#
+# Entry (12 bytes, little endian):
+#
+#   timestamp in us (4) | event (1) | reserved (1) | argument (2) | CID (4)
+#
+# Dump: version (1) | number of entries (2) | events recorded since boot (4)
+# followed by the entries, oldest first.
+
+import struct
+import time
+
+# events and their arguments
+PACKET_IN = 0x01  # byte 4 of the packet (command or sequence number)
+PACKET_OUT = 0x02  # byte 4 of the packet
+DISPATCH_START = 0x03  # CTAPHID command
+DISPATCH_END = 0x04  # CTAPHID command
+CRYPTO_START = 0x05  # index in CRYPTO_OPS
+CRYPTO_END = 0x06  # index in CRYPTO_OPS
+FLUSH = 0x07  # number of dirty buckets
+
+EVENT_NAMES = {
+    PACKET_IN: "packet_in",
+    PACKET_OUT: "packet_out",
+    DISPATCH_START: "dispatch_start",
+    DISPATCH_END: "dispatch_end",
+    CRYPTO_START: "crypto_start",
+    CRYPTO_END: "crypto_end",
+    FLUSH: "flush",
+}
+
+# crypto operations which are traced, see circuitkey.crypto
+CRYPTO_OPS = (
+    "ec_genkey",
+    "ec_shared_secret",
+    "ec_sign",
+    "aes256_cbc_encrypt",
+    "aes256_cbc_decrypt",
+)
+
+VERSION = 0x01
+
+ENTRY_FORMAT = "<IBxH4s"
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+HEADER_FORMAT = "<BHI"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+CAPACITY = 256  # entries
+
+enabled = True
+
+_buffer = bytearray(ENTRY_SIZE * CAPACITY)
+_next = 0  # index of the next entry
+_recorded = 0
+
+_NO_CID = bytes(4)
+
+
+def record(event: int, cid: bytes = None, arg: int = 0) -> None:
+    global _next, _recorded
+
+    if not enabled:
+        return
+
+    struct.pack_into(
+        ENTRY_FORMAT,
+        _buffer,
+        _next * ENTRY_SIZE,
+        (time.monotonic_ns() // 1000) & 0xFFFFFFFF,
+        event,
+        arg & 0xFFFF,
+        _NO_CID if cid is None else cid,
+    )
+
+    _next += 1
+    if _next == CAPACITY:
+        _next = 0
+    _recorded += 1
+
+
+def dump() -> bytes:
+    """
+    Header and entries, oldest first.
+    """
+    count = min(_recorded, CAPACITY)
+    header = struct.pack(HEADER_FORMAT, VERSION, count, _recorded & 0xFFFFFFFF)
+
+    if _recorded < CAPACITY:
+        return header + _buffer[: count * ENTRY_SIZE]
+
+    split = _next * ENTRY_SIZE
+    return header + _buffer[split:] + _buffer[:split]
+
+
+def clear() -> None:
+    global _next, _recorded
+
+    _next = 0
+    _recorded = 0
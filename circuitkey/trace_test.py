@@ -0,0 +1,73 @@
+import struct
+
+import pytest
+
+import circuitkey.trace as trace
+
+
+@pytest.fixture(autouse=True)
+def empty_trace():
+    trace.clear()
+    yield
+    trace.clear()
+
+
+def entries(data: bytes) -> list:
+    return [
+        struct.unpack_from(trace.ENTRY_FORMAT, data, offset)
+        for offset in range(trace.HEADER_SIZE, len(data), trace.ENTRY_SIZE)
+    ]
+
+
+def test_entry_is_12_bytes():
+    assert trace.ENTRY_SIZE == 12
+
+
+def test_empty_dump():
+    assert trace.dump() == struct.pack(trace.HEADER_FORMAT, trace.VERSION, 0, 0)
+
+
+def test_record():
+    trace.record(trace.DISPATCH_START, b"\x00\x00\x00\x01", 0x10)
+    trace.record(trace.FLUSH, None, 2)
+
+    data = trace.dump()
+
+    assert struct.unpack_from(trace.HEADER_FORMAT, data) == (trace.VERSION, 2, 2)
+    (t1, event1, arg1, cid1), (t2, event2, arg2, cid2) = entries(data)
+    assert (event1, arg1, cid1) == (trace.DISPATCH_START, 0x10, b"\x00\x00\x00\x01")
+    assert (event2, arg2, cid2) == (trace.FLUSH, 2, bytes(4))
+    assert t1 <= t2
+
+
+def test_wraps_around_oldest_first():
+    for i in range(trace.CAPACITY + 3):
+        trace.record(trace.PACKET_IN, None, i)
+
+    data = trace.dump()
+
+    assert struct.unpack_from(trace.HEADER_FORMAT, data) == (
+        trace.VERSION,
+        trace.CAPACITY,
+        trace.CAPACITY + 3,
+    )
+    args = [arg for _, _, arg, _ in entries(data)]
+    assert args == list(range(3, trace.CAPACITY + 3))
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(trace, "enabled", False)
+
+    trace.record(trace.PACKET_IN)
+
+    assert struct.unpack_from(trace.HEADER_FORMAT, trace.dump())[1] == 0
+
+
+def test_crypto_ops_are_traced():
+    import circuitkey.crypto as crypto
+
+    crypto.ec_genkey()
+
+    events = [(event, arg) for _, event, arg, _ in entries(trace.dump())]
+    op = trace.CRYPTO_OPS.index("ec_genkey")
+    assert events == [(trace.CRYPTO_START, op), (trace.CRYPTO_END, op)]
@@ -0,0 +1,246 @@
+# CTAPHID over UDP, a software key on CPython.
+#
+# Each datagram carries one 64-byte HID report, as with other FIDO
+# simulators (the key listens on port 8111). The reports go through the same
+# hid/ctaphid/cbor stack as USB ones:
+#
+#   python -m circuitkey.udp [--host 127.0.0.1] [--port 8111] [--confirm-presence]
+#
+# Several clients can talk to the key at once. Reports are sent back to the
+# address the channel was last used from; reports on the broadcast channel
+# (CTAPHID_INIT responses, keepalives) go to all recent clients, which skip
+# those of other channels or nonces. The reports of a message are handed to
+# hid.receive only when the message is complete, so messages of different
+# clients do not interleave. Incomplete messages are dropped after
+# PENDING_TIMEOUT, or the oldest one when MAX_PENDING are waiting.
+#
+# The framing is the one of hid.send/hid.receive, not the one of the CTAPHID
+# specification: the command byte of an initialization packet has bit 7
+# clear (INIT is 0x06) and continuation packets are numbered from 1 with
+# bit 7 set. Standard clients (INIT 0x86, sequence from 0) get INVALID_SEQ.
+#
+# Storage is selected with CIRCUITKEY_STORAGE as on a device.
+
+import asyncio
+import time
+from collections import OrderedDict
+
+from circuitkey import ctaphid, hid, ui, warmup
+from circuitkey.arena import MESSAGE_SIZE
+from circuitkey.error import AbortError, CtapError
+from circuitkey.logger import Lazy, getLogger
+from circuitkey.schema import CTAPHID_BROADCAST_CID
+
+log = getLogger(__name__)
+
+PORT = 8111
+
+MAX_CLIENTS = 16  # addresses which receive broadcast reports
+
+MAX_PENDING = 16  # incomplete messages
+PENDING_TIMEOUT = 3  # seconds
+
+
+def packet_count(length: int) -> int:
+    """
+    Number of reports of a message with a payload of length bytes.
+    """
+    initial = hid.REPORT_LEN - 7
+    if length <= initial:
+        return 1
+    continuation = hid.REPORT_LEN - 5
+    return 1 + (length - initial + continuation - 1) // continuation
+
+
+class UdpDevice(asyncio.DatagramProtocol):
+    """
+    HID device (see hid.set_device) on a datagram endpoint.
+    """
+
+    def __init__(self):
+        self.transport = None
+        self.last_cid = CTAPHID_BROADCAST_CID  # of the last report handed out
+        self._ready = []  # reports of complete messages
+        self._available = asyncio.Event()
+        # (address, CID) -> (count, reports, received at) of an incomplete
+        # message, oldest first
+        self._pending = {}
+        self._channels = {}  # CID -> address
+        self._clients = OrderedDict()  # recent addresses, oldest first
+
+    def connection_made(self, transport) -> None:
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr) -> None:
+        if len(data) != hid.REPORT_LEN:
+            log.warning("Dropped datagram of %d bytes", len(data))
+            return
+
+        cid = bytes(data[0:4])
+        self._channels[cid] = addr
+        self._clients.pop(addr, None)
+        self._clients[addr] = None
+        if len(self._clients) > MAX_CLIENTS:
+            self._clients.popitem(last=False)
+
+        self._expire()
+
+        key = (addr, cid)
+        if data[4] & 0x80 == 0:
+            # initialization packet, replaces an incomplete message; one that
+            # is too long is rejected by hid.receive right away
+            length = (data[5] << 8) + data[6]
+            count = packet_count(length) if length <= MESSAGE_SIZE else 1
+            self._pending.pop(key, None)
+            self._add_pending(key, count, data)
+        elif key in self._pending:
+            self._pending[key][1].append(data)
+        else:
+            # hid.receive responds with an error
+            self._add_pending(key, 1, data)
+
+        count, reports, _ = self._pending[key]
+        if len(reports) >= count:
+            del self._pending[key]
+            self._ready += reports
+            self._available.set()
+
+    def _add_pending(self, key: tuple, count: int, data: bytes) -> None:
+        if len(self._pending) >= MAX_PENDING:
+            oldest = next(iter(self._pending))
+            log.warning("Dropped incomplete message of %s", oldest)
+            del self._pending[oldest]
+
+        self._pending[key] = (count, [data], time.monotonic())
+
+    def _expire(self) -> None:
+        """
+        Drop incomplete messages older than PENDING_TIMEOUT.
+        """
+        expired = time.monotonic() - PENDING_TIMEOUT
+        while self._pending:
+            key = next(iter(self._pending))
+            if self._pending[key][2] > expired:
+                break
+            log.warning("Incomplete message of %s timed out", key)
+            del self._pending[key]
+
+    async def wait(self) -> None:
+        """
+        Wait until a message is complete.
+        """
+        await self._available.wait()
+
+    def get_last_received_report(self):
+        if not self._ready:
+            self._available.clear()
+            return None
+
+        report = self._ready.pop(0)
+        self.last_cid = bytes(report[0:4])
+        if not self._ready:
+            self._available.clear()
+        return report
+
+    def discard(self, cid: bytes = None) -> None:
+        """
+        Drop the remaining reports of the message of channel cid (by default
+        the channel of the last report) which has been rejected or aborted.
+        """
+        cid = self.last_cid if cid is None else bytes(cid)
+
+        kept = []
+        dropping = True
+        for report in self._ready:
+            if dropping and report[0:4] == cid:
+                if report[4] & 0x80:
+                    continue
+                # next message of the channel
+                dropping = False
+            kept.append(report)
+
+        self._ready = kept
+        if not self._ready:
+            self._available.clear()
+
+    def send_report(self, report) -> None:
+        cid = bytes(report[0:4])
+
+        if cid == CTAPHID_BROADCAST_CID:
+            addresses = list(self._clients)
+        elif cid in self._channels:
+            addresses = (self._channels[cid],)
+        else:
+            log.warning("No client for channel %s", Lazy(cid.hex))
+            return
+
+        # the transport copies the data if it cannot be sent right away
+        for addr in addresses:
+            self.transport.sendto(report, addr)
+
+
+async def serve(device: UdpDevice) -> None:
+    """
+    Receive and process messages of device, like main() does for USB.
+    """
+    while True:
+        await device.wait()
+
+        try:
+            data = hid.receive(device)
+        except AbortError as e:
+            log.error("Transaction of channel %s aborted", Lazy(e.cid.hex))
+            device.discard(e.cid)
+            continue
+        except CtapError as e:
+            log.error("Unable to receive message: %s", e)
+            device.discard()
+            await ctaphid.error_cmd(device.last_cid, e.code)
+            continue
+
+        if data is not None:
+            asyncio.create_task(
+                ctaphid.process(data.cid, data.cmd, data.payload),
+                name="CtapProcessorTask",
+            )
+
+
+async def start(host: str = "127.0.0.1", port: int = PORT) -> UdpDevice:
+    """
+    Datagram endpoint set as the HID device.
+    """
+    loop = asyncio.get_running_loop()
+    _, device = await loop.create_datagram_endpoint(UdpDevice, local_addr=(host, port))
+    hid.set_device(device)
+
+    return device
+
+
+async def main(host: str, port: int, confirm_presence: bool) -> None:
+    if confirm_presence:
+        ui.get_ui._ui = ui.UI(ui.PressedButton(), ui.LedScheduler(ui.SimulatedLed()))
+
+    device = await start(host, port)
+    await warmup.run()
+
+    log.info("Software key listening on %s:%d", host, port)
+    try:
+        await serve(device)
+    finally:
+        device.transport.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="CTAPHID over UDP")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument(
+        "--confirm-presence",
+        action="store_true",
+        help="confirm user presence without a button press",
+    )
+    args = parser.parse_args()
+
+    asyncio.run(main(args.host, args.port, args.confirm_presence))
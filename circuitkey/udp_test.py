@@ -0,0 +1,177 @@
+import asyncio
+import struct
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+import pytest_asyncio
+
+from circuitkey.schema import CTAPHID_BROADCAST_CID, CborCmd, CtaphidCmd, Error
+
+sys.modules["usb_hid"] = MagicMock()
+
+import circuitkey.hid as hid
+import circuitkey.info as info
+import circuitkey.udp as udp
+
+
+class Client(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.reports = asyncio.Queue()
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.reports.put_nowait(data)
+
+    def packets(self, cid: bytes, cmd: int, payload: bytes) -> list:
+        packets = [cid + struct.pack(">BH", cmd, len(payload)) + payload[:57]]
+        for seq, offset in enumerate(range(57, len(payload), 59), 1):
+            packets.append(cid + bytes((0x80 | seq,)) + payload[offset : offset + 59])
+        return [p + bytes(64 - len(p)) for p in packets]
+
+    def send(self, packets: list) -> None:
+        for packet in packets:
+            self.transport.sendto(packet)
+
+    async def response(self, cid: bytes) -> tuple:
+        """
+        Command and payload of the next response on the channel.
+        """
+        while True:
+            report = await asyncio.wait_for(self.reports.get(), 5)
+            if report[0:4] == cid and report[4] != CtaphidCmd.KEEPALIVE:
+                break
+
+        length = (report[5] << 8) + report[6]
+        payload = report[7:]
+        while len(payload) < length:
+            payload += (await asyncio.wait_for(self.reports.get(), 5))[5:]
+
+        return report[4], payload[:length]
+
+
+@pytest_asyncio.fixture
+async def key(monkeypatch):
+    # restored afterwards
+    monkeypatch.setattr(hid.get_device, "_device", None, raising=False)
+
+    device = await udp.start("127.0.0.1", 0)
+    server = asyncio.create_task(udp.serve(device))
+
+    yield device
+
+    server.cancel()
+    device.transport.close()
+
+
+async def connect(device) -> Client:
+    _, client = await asyncio.get_running_loop().create_datagram_endpoint(
+        Client, remote_addr=device.transport.get_extra_info("sockname")
+    )
+    return client
+
+
+def test_packet_count():
+    assert udp.packet_count(0) == 1
+    assert udp.packet_count(57) == 1
+    assert udp.packet_count(58) == 2
+    assert udp.packet_count(57 + 59) == 2
+    assert udp.packet_count(57 + 128 * 59) == 129
+
+
+@pytest.mark.asyncio
+async def test_init_and_get_info(key):
+    client = await connect(key)
+    nonce = bytes(range(8))
+
+    client.send(client.packets(CTAPHID_BROADCAST_CID, CtaphidCmd.INIT, nonce))
+    cmd, payload = await client.response(CTAPHID_BROADCAST_CID)
+    assert cmd == CtaphidCmd.INIT
+    assert payload[:8] == nonce
+    cid = payload[8:12]
+
+    client.send(client.packets(cid, CtaphidCmd.CBOR, bytes((CborCmd.GET_INFO,))))
+    cmd, payload = await client.response(cid)
+    assert cmd == CtaphidCmd.CBOR
+    assert payload == b"\x00" + info.cbor_info_encoded()
+
+    client.transport.close()
+
+
+@pytest.mark.asyncio
+async def test_messages_of_clients_do_not_interleave(key):
+    a, b = await connect(key), await connect(key)
+    cid_a, cid_b = b"\x00\x00\x00\x0a", b"\x00\x00\x00\x0b"
+    ping_a, ping_b = bytes(range(100)), bytes(range(100, 200))
+
+    packets = a.packets(cid_a, CtaphidCmd.PING, ping_a)
+    a.send(packets[:1])
+    b.send(b.packets(cid_b, CtaphidCmd.PING, ping_b))
+    a.send(packets[1:])
+
+    assert await a.response(cid_a) == (CtaphidCmd.PING, ping_a)
+    assert await b.response(cid_b) == (CtaphidCmd.PING, ping_b)
+
+    a.transport.close()
+    b.transport.close()
+
+
+@pytest.mark.asyncio
+async def test_invalid_message_gets_error(key):
+    client = await connect(key)
+    cid = b"\x00\x00\x00\x0c"
+
+    # continuation packet without an initialization packet
+    client.send([cid + b"\x81" + bytes(59)])
+
+    assert await client.response(cid) == (CtaphidCmd.ERROR, bytes((Error.INVALID_SEQ,)))
+
+    client.transport.close()
+
+
+def test_incomplete_messages_expire(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr(udp.time, "monotonic", lambda: now[0])
+    device = udp.UdpDevice()
+    client = Client()
+    addr = ("127.0.0.1", 1)
+    cid = b"\x00\x00\x00\x0d"
+
+    packets = client.packets(cid, CtaphidCmd.PING, bytes(100))
+    device.datagram_received(packets[0], addr)
+    now[0] += udp.PENDING_TIMEOUT
+
+    # handed out alone, hid.receive responds with INVALID_SEQ
+    device.datagram_received(packets[1], addr)
+    assert device._ready == [packets[1]]
+    assert device._pending == {}
+
+
+def test_pending_messages_are_capped():
+    device = udp.UdpDevice()
+    client = Client()
+
+    for i in range(udp.MAX_PENDING + 1):
+        cid = struct.pack(">I", i + 1)
+        packets = client.packets(cid, CtaphidCmd.PING, bytes(100))
+        device.datagram_received(packets[0], ("127.0.0.1", i))
+
+    assert len(device._pending) == udp.MAX_PENDING
+    assert (("127.0.0.1", 0), struct.pack(">I", 1)) not in device._pending
+
+
+def test_discard_aborted_message():
+    device = udp.UdpDevice()
+    client = Client()
+    cid_a, cid_b = b"\x00\x00\x00\x0a", b"\x00\x00\x00\x0b"
+
+    for cid, payload in ((cid_a, bytes(100)), (cid_b, bytes(10)), (cid_a, b"a")):
+        for packet in client.packets(cid, CtaphidCmd.PING, payload):
+            device.datagram_received(packet, ("127.0.0.1", 1))
+
+    assert device.get_last_received_report()[0:4] == cid_a
+    device.discard(cid_a)
+
+    assert [(r[0:4], r[7]) for r in device._ready] == [(cid_b, 0), (cid_a, ord("a"))]
@@ -1,86 +1,158 @@
 # User interface. At the moement only one LED and button are used.
+#
+# All LED indications are patterns played by a scheduler task, which sleeps
+# until the next LED transition. Showing another pattern cancels the task, so
+# the new pattern takes effect immediately.
+# Button presses are detected by hardware (keypad scans the pin in the
+# background and queues debounced edges), so waiting for the user only checks
+# the event queue between sleeps. On CPython a simulated button and LED are
+# used instead.
 
 import asyncio
+from collections import namedtuple
 
-import async_button
-import digitalio
 from adafruit_logging import getLogger
 
-from circuitkey.util import wait_until_first_complete
-
 log = getLogger(__name__)
 
+# steps: tuple of (LED on, duration in seconds), repeat: play until replaced
+Pattern = namedtuple("Pattern", ["steps", "repeat"])
+
+OFF = Pattern((), False)
+BLINK = ((True, 0.25), (False, 0.25))
+PRESENCE = Pattern(((True, 0.25), (False, 1.5)), True)
 
-class LedPulsar:
-    def __init__(self, pin, duration=0.25, interval=1.5) -> None:
-        self.led = digitalio.DigitalInOut(pin)
-        self.led.switch_to_output()
-        self.duration = duration
-        self.interval = interval
-        self.off()
 
-    async def blink(self) -> None:
-        self.led.value = True
-        await asyncio.sleep(self.duration)
+class LedScheduler:
+    def __init__(self, led):
+        self.led = led
         self.led.value = False
+        self._task = None
+
+    def show(self, pattern: Pattern) -> asyncio.Event:
+        """
+        Replace the current pattern.
+
+        :return: event set when the pattern has finished or has been replaced
+        """
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
 
-    async def _blink_forever(self) -> None:
-        log.debug("Starting infinite blinking...")
+        done = asyncio.Event()
+        self._task = asyncio.create_task(
+            self._play(pattern, done), name="LedSchedulerTask"
+        )
+        return done
+
+    async def play(self, pattern: Pattern) -> None:
+        """
+        Show pattern and wait until it has finished (or has been replaced).
+        """
+        await self.show(pattern).wait()
+
+    async def _play(self, pattern: Pattern, done: asyncio.Event) -> None:
         try:
             while True:
-                await self.blink()
-                await asyncio.sleep(self.interval)
-        except asyncio.CancelledError:
-            self.off()
-            log.debug("Cancelled blinking, led off")
-
-    def blink_forever(self) -> asyncio.Task:
-        return asyncio.create_task(self._blink_forever(), name="BlinkingPulsarTask")
+                for on, duration in pattern.steps:
+                    self.led.value = on
+                    await asyncio.sleep(duration)
 
-    def off(self):
-        self.led.value = False
+                if not pattern.repeat or len(pattern.steps) == 0:
+                    break
+        finally:
+            # the next pattern, if any, sets the LED as soon as it starts
+            self.led.value = False
+            done.set()
 
-    def is_off(self):
+    def is_off(self) -> bool:
         return not self.led.value
 
 
+class KeypadButton:
+    """
+    Button connected to pin and ground.
+    """
+
+    POLL_INTERVAL = 0.02  # seconds
+
+    def __init__(self, pin):
+        import keypad
+
+        self._keys = keypad.Keys((pin,), value_when_pressed=False, pull=True)
+        self._event = keypad.Event()
+
+    async def wait_pressed(self) -> None:
+        # presses from before the request do not count
+        self._keys.events.clear()
+
+        while True:
+            if self._keys.events.get_into(self._event) and self._event.pressed:
+                return
+            await asyncio.sleep(self.POLL_INTERVAL)
+
+
+class SimulatedButton:
+    def __init__(self):
+        self._pressed = asyncio.Event()
+
+    def press(self) -> None:
+        self._pressed.set()
+
+    async def wait_pressed(self) -> None:
+        self._pressed.clear()
+        await self._pressed.wait()
+
+
+class PressedButton:
+    """
+    Simulated button which is pressed as soon as it is waited for, for
+    software keys without a user (see circuitkey.udp).
+    """
+
+    async def wait_pressed(self) -> None:
+        pass
+
+
+class SimulatedLed:
+    def __init__(self):
+        self.value = False
+
+
 class UI:
-    def __init__(self, button: async_button.SimpleButton, pulsar: LedPulsar):
+    def __init__(self, button, leds: LedScheduler):
         self.button = button
-        self.pulsar = pulsar
+        self.leds = leds
 
-    async def wink(self, times=3):
-        for _ in range(times):
-            await self.pulsar.blink()
+    async def wink(self, times=3) -> None:
+        await self.leds.play(Pattern(BLINK * times, False))
 
     async def verify_user_presence(self, timeout=30):
         log.info("Verifing user presence (timeout=%d)", timeout)
 
-        blinking_led = self.pulsar.blink_forever()
-        button_pressed = asyncio.create_task(
-            self.button.pressed(), name="ButtonPressedTask"
-        )
-
+        self.leds.show(PRESENCE)
         try:
-            done, _ = await wait_until_first_complete(
-                blinking_led, button_pressed, timeout=timeout
-            )
-            if button_pressed in done:
-                log.debug("User confirmed")
-                return
-            else:
-                raise asyncio.TimeoutError("User did not confirm in time")
+            await asyncio.wait_for(self.button.wait_pressed(), timeout)
+            log.debug("User confirmed")
+        except asyncio.TimeoutError:
+            raise asyncio.TimeoutError("User did not confirm in time")
         finally:
-            if not blinking_led.done():
-                blinking_led.cancel()
+            self.leds.show(OFF)
 
 
 def get_ui():
     if "_ui" not in get_ui.__dict__:
+        try:
+            import keypad  # noqa: F401
+        except ImportError:
+            log.warning("No keypad module, using simulated button and LED")
+            get_ui._ui = UI(SimulatedButton(), LedScheduler(SimulatedLed()))
+            return get_ui._ui
+
         import board
+        import digitalio
 
-        button = async_button.SimpleButton(digitalio.DigitalInOut(board.D2))
-        pulsar = LedPulsar(board.D13)
-        get_ui._ui = UI(button, pulsar)
+        led = digitalio.DigitalInOut(board.D13)
+        led.switch_to_output()
+        get_ui._ui = UI(KeypadButton(board.D2), LedScheduler(led))
 
     return get_ui._ui
@@ -1,77 +1,119 @@
 import asyncio
-import sys
-from unittest.mock import MagicMock
+import time
 
 import pytest
-from async_button import SimpleButton
-from pytest_mock import MockerFixture
-
-sys.modules["usb_hid"] = MagicMock()
-sys.modules["countio"] = MagicMock()
 
 import circuitkey.ui as ui
 
 
 @pytest.fixture
-def btn(mocker: MockerFixture):
-    return mocker.patch("async_button.SimpleButton", autospec=SimpleButton)
+def led():
+    return ui.SimulatedLed()
 
 
 @pytest.fixture
-def pulsar():
-    return ui.LedPulsar(0, 0, 0)
+def button():
+    return ui.SimulatedButton()
 
 
-@pytest.fixture(autouse=True)
-def setup_teardown(mocker: MockerFixture):
-    mocker.patch("digitalio.DigitalInOut")
+async def for_led_off(leds: ui.LedScheduler):
+    async def wait_for_led_off():
+        while not leds.is_off():
+            await asyncio.sleep(0)
 
-    yield
+    await asyncio.wait_for(wait_for_led_off(), timeout=1)
 
 
-async def for_led_off(pulsar: ui.LedPulsar):
-    async def wait_for_led_off(pulsar: ui.LedPulsar):
-        while pulsar.led.value:
-            await asyncio.sleep(0)
+@pytest.mark.asyncio
+async def test_wink_ends_with_led_off(button, led, monkeypatch):
+    changes = []
 
-    await asyncio.wait_for(wait_for_led_off(pulsar), timeout=1)
-    return
+    class RecordingLed:
+        @property
+        def value(self):
+            return led.value
 
+        @value.setter
+        def value(self, value):
+            changes.append(value)
+            led.value = value
 
-@pytest.mark.asyncio
-async def test_verify_user_presence_timeout(
-    btn: MagicMock, pulsar: ui.LedPulsar, mocker: MockerFixture
-):
-    async def no_button_pressed():
-        while True:
-            await asyncio.sleep(0)
+    u = ui.UI(button, ui.LedScheduler(RecordingLed()))
+    monkeypatch.setattr(ui, "BLINK", ((True, 0), (False, 0)))
+    await u.wink(times=2)
+
+    assert changes == [False, True, False, True, False, False]
+    assert u.leds.is_off()
 
-    mocker.patch.object(btn, "pressed", wraps=no_button_pressed)
 
-    u = ui.UI(btn, pulsar)
+@pytest.mark.asyncio
+async def test_verify_user_presence_timeout(button, led):
+    u = ui.UI(button, ui.LedScheduler(led))
 
     with pytest.raises(asyncio.TimeoutError):
         await u.verify_user_presence(timeout=0)
 
-    await for_led_off(pulsar)
-
-    assert pulsar.is_off()
+    await for_led_off(u.leds)
 
 
 @pytest.mark.asyncio
-async def test_verify_user_presence_button_pressed(
-    btn: MagicMock, pulsar: ui.LedPulsar, mocker: MockerFixture
-):
-    async def button_pressed():
-        await asyncio.sleep(0)
+async def test_verify_user_presence_button_pressed(button, led):
+    u = ui.UI(button, ui.LedScheduler(led))
 
-    mocker.patch.object(btn, "pressed", wraps=button_pressed)
+    async def press():
+        # LED blinks while waiting for the user
+        while led.value is False:
+            await asyncio.sleep(0)
+        button.press()
 
-    u = ui.UI(btn, pulsar)
+    presser = asyncio.create_task(press())
 
     # no error raised, so we're good - user pressed the button
     await u.verify_user_presence(timeout=5)
+    await presser
+
+    await for_led_off(u.leds)
+
+
+@pytest.mark.asyncio
+async def test_press_before_request_is_ignored(button, led):
+    u = ui.UI(button, ui.LedScheduler(led))
 
-    await for_led_off(pulsar)
+    button.press()
+
+    with pytest.raises(asyncio.TimeoutError):
+        await u.verify_user_presence(timeout=0.01)
+
+
+@pytest.mark.asyncio
+async def test_new_pattern_replaces_current_one(led):
+    leds = ui.LedScheduler(led)
+
+    leds.show(ui.Pattern(((True, 60),), True))
+    await asyncio.sleep(0)
+    assert led.value is True
+
+    # takes effect without waiting for the 60 s step to end
+    await asyncio.wait_for(leds.play(ui.OFF), timeout=1)
+    assert leds.is_off()
+
+
+def test_presence_blinks_until_timeout(button, virtual_time):
+    switched_on = []
+
+    class RecordingLed:
+        value = False
+
+        def __setattr__(self, name, value):
+            if value and not self.value:
+                switched_on.append(time.monotonic())
+            object.__setattr__(self, name, value)
+
+    u = ui.UI(button, ui.LedScheduler(RecordingLed()))
+
+    with pytest.raises(asyncio.TimeoutError):
+        virtual_time.run_until_complete(u.verify_user_presence())
 
-    assert pulsar.is_off()
+    assert time.monotonic() == 30
+    # on for 0.25 s every 1.75 s
+    assert switched_on == [i * 1.75 for i in range(18)]
@@ -1,4 +1,5 @@
 import asyncio
+import binascii
 import inspect
 import typing
 
@@ -54,5 +55,16 @@ def next_tick(func: typing.Callable) -> typing.Callable:
     return wrapper
 
 
+def equal(a: bytes, b: bytes) -> bool:
+    # constant time comparison, for MACs and PIN hashes
+    if len(a) != len(b):
+        return False
+
+    result = 0
+    for x, y in zip(a, b):
+        result |= x ^ y
+    return result == 0
+
+
 def hexlify(data: bytes) -> str:
-    return "".join("{:02x}".format(b) for b in data)
+    return binascii.hexlify(data).decode()
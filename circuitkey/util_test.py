@@ -2,7 +2,7 @@ import asyncio
 
 import pytest
 
-from circuitkey.util import wait_until_first_complete
+from circuitkey.util import equal, hexlify, wait_until_first_complete
 
 
 async def task1(sleep):
@@ -31,3 +31,13 @@ async def test_wait_until_first_complete():
         assert t1.cancelled()
     except asyncio.CancelledError:
         pass
+
+
+def test_equal():
+    assert equal(b"abc", b"abc")
+    assert not equal(b"abc", b"abd")
+    assert not equal(b"abc", b"ab")
+
+
+def test_hexlify():
+    assert hexlify(b"\x00\x01\xab") == "0001ab"
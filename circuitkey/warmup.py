@@ -0,0 +1,70 @@
+# Boot-time warm-up.
+#
+# State which is otherwise created lazily on the first request (message
+# buffers, storage caches, the PIN protocol and its key agreement key, the key
+# pool, encoded responses) is prepared right after boot, so the first request
+# is served as fast as any later one.
+
+import asyncio
+import time
+
+import adafruit_logging as logging
+
+import circuitkey.arena as arena
+import circuitkey.counter as counter
+import circuitkey.credential as credential
+import circuitkey.info as info
+import circuitkey.keypool as keypool
+import circuitkey.pin as pin
+import circuitkey.resident as resident
+import circuitkey.storage as storage
+
+log = logging.getLogger(__name__)
+
+
+def _storage() -> None:
+    storage.get_log()
+    counter.get_counter()
+    credential.preload()
+
+
+# name, function; run in this order. The HID device and the UI are not
+# included, main() needs them before the warm-up starts. Message buffers come
+# first, while the heap is not fragmented yet. The PIN protocol takes its key
+# agreement key from the pool, which is then refilled.
+STEPS = (
+    ("arena", arena.get_arena),
+    ("storage", _storage),
+    ("resident", resident.get_store),
+    ("keypool", keypool.fill),
+    ("pin", pin.get_pin_protocol),
+    ("keypool_refill", keypool.fill),
+    ("info", info.cbor_info_encoded),
+)
+
+
+async def run(steps=STEPS) -> dict:
+    """
+    Run warm-up steps. A failing step is logged and skipped, the device
+    still starts and initializes that state on demand.
+
+    :return: duration of each step in milliseconds
+    """
+    timings = {}
+
+    for name, func in steps:
+        start = time.monotonic_ns()
+        try:
+            func()
+        except Exception as e:
+            log.error("Warm-up step %s failed: %s", name, e)
+        timings[name] = (time.monotonic_ns() - start) // 1000000
+
+        log.info("Warm-up %s: %d ms", name, timings[name])
+
+        # let other tasks run between steps
+        await asyncio.sleep(0)
+
+    log.info("Warm-up finished in %d ms", sum(timings.values()))
+
+    return timings
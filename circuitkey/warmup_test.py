@@ -0,0 +1,38 @@
+import pytest
+
+from circuitkey import counter, credential, keypool, pin, warmup
+
+
+@pytest.fixture(autouse=True)
+def device(monkeypatch, ram_storage):
+    counter.reset()
+    credential.reset()
+    keypool.clear()
+    monkeypatch.delattr(pin.get_pin_protocol, "v1", raising=False)
+
+    yield
+
+    keypool.clear()
+    counter.reset()
+    credential.reset()
+
+
+@pytest.mark.asyncio
+async def test_warm_up():
+    timings = await warmup.run()
+
+    assert list(timings) == [name for name, _ in warmup.STEPS]
+    assert len(keypool._pool) == keypool.POOL_SIZE
+    assert "v1" in pin.get_pin_protocol.__dict__
+    assert "_keys" in credential._master_keys.__dict__
+
+
+@pytest.mark.asyncio
+async def test_failing_step_is_skipped():
+    def broken():
+        raise OSError("broken")
+
+    timings = await warmup.run((("broken", broken), ("keypool", keypool.fill)))
+
+    assert list(timings) == ["broken", "keypool"]
+    assert len(keypool._pool) == keypool.POOL_SIZE
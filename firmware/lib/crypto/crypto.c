@@ -210,13 +210,83 @@ void ecdsakeys_cleanup(mbedtls_ecdsa_context *ctx, mbedtls_ctr_drbg_context *ctr
     }
 }
 
+STATIC mp_obj_t crypto_sign(mp_obj_t a_private_key, mp_obj_t a_hash)
+{
+    // check arguments
+    {
+        mp_obj_t args[] = {a_private_key, a_hash};
+
+        for (int i = 0; i < 2; i++)
+        {
+            if (!mp_obj_is_type(args[i], &mp_type_bytes))
+            {
+                mp_raise_ValueError(MP_ERROR_TEXT("Argument is not bytes"));
+            }
+
+            size_t len = mp_obj_get_int(mp_obj_len(args[i]));
+            if (len != 32)
+            {
+                mp_raise_ValueError(MP_ERROR_TEXT("Argument is not 32 bytes long"));
+            }
+        }
+    }
+
+    // convert arguments
+    size_t len = 32;
+    unsigned char *private_key = (unsigned char *)mp_obj_str_get_data(a_private_key, &len);
+    unsigned char *hash = (unsigned char *)mp_obj_str_get_data(a_hash, &len);
+
+    // contexts
+    mbedtls_ecdsa_context ctx;
+    mbedtls_entropy_context entropy;
+    mbedtls_ctr_drbg_context ctr_drbg;
+
+    const char *pers = "mbedtls_ecdsa_sign";
+    unsigned char signature[MBEDTLS_ECDSA_MAX_LEN];
+    size_t signature_len = 0;
+
+    // init
+    mbedtls_ecdsa_init(&ctx);
+    mbedtls_ctr_drbg_init(&ctr_drbg);
+    mbedtls_entropy_init(&entropy);
+
+    if ((mbedtls_ctr_drbg_seed(&ctr_drbg, mbedtls_entropy_func, &entropy, (const unsigned char *)pers, strlen(pers)) != 0))
+    {
+        ecdsakeys_cleanup(&ctx, &ctr_drbg, &entropy, NULL, "Cannot seed entropy source");
+    }
+
+    // load group
+    if ((mbedtls_ecp_group_load(&ctx.grp, MBEDTLS_ECP_DP_SECP256R1)) != 0)
+    {
+        ecdsakeys_cleanup(&ctx, &ctr_drbg, &entropy, NULL, "Cannot load group");
+    }
+
+    // load private key
+    if ((mbedtls_mpi_read_binary(&ctx.d, private_key, 32)) != 0)
+    {
+        ecdsakeys_cleanup(&ctx, &ctr_drbg, &entropy, NULL, "Cannot load private key");
+    }
+
+    // sign SHA-256 hash, signature is DER encoded
+    if ((mbedtls_ecdsa_write_signature(&ctx, MBEDTLS_MD_SHA256, hash, 32, signature, &signature_len, mbedtls_ctr_drbg_random, &ctr_drbg)) != 0)
+    {
+        ecdsakeys_cleanup(&ctx, &ctr_drbg, &entropy, NULL, "Cannot sign hash");
+    }
+
+    ecdsakeys_cleanup(&ctx, &ctr_drbg, &entropy, NULL, NULL);
+
+    return mp_obj_new_bytes(signature, signature_len);
+}
+
 STATIC MP_DEFINE_CONST_FUN_OBJ_0(crypto_gen_keys_obj, crypto_gen_keys);
 STATIC MP_DEFINE_CONST_FUN_OBJ_3(crypto_shared_secret_obj, crypto_shared_secret);
+STATIC MP_DEFINE_CONST_FUN_OBJ_2(crypto_sign_obj, crypto_sign);
 
 STATIC const mp_rom_map_elem_t crypto_module_globals_table[] = {
     {MP_ROM_QSTR(MP_QSTR___name__), MP_ROM_QSTR(MP_QSTR_crypto)},
     {MP_ROM_QSTR(MP_QSTR_gen_keys), MP_ROM_PTR(&crypto_gen_keys_obj)},
     {MP_ROM_QSTR(MP_QSTR_shared_secret), MP_ROM_PTR(&crypto_shared_secret_obj)},
+    {MP_ROM_QSTR(MP_QSTR_sign), MP_ROM_PTR(&crypto_sign_obj)},
 };
 
 STATIC MP_DEFINE_CONST_DICT(crypto_module_globals, crypto_module_globals_table);
@@ -22,6 +22,8 @@
 #define MBEDTLS_SHA512_C
 #define MBEDTLS_ECDSA_C
 #define MBEDTLS_ECP_C
+#define MBEDTLS_ASN1_PARSE_C
+#define MBEDTLS_ASN1_WRITE_C
 
 #define MBEDTLS_ENTROPY_C
 #define MBEDTLS_ERROR_C
@@ -19,6 +19,8 @@ SRC_MBEDTLS := $(addprefix lib/mbedtls/library/, \
 		error.c \
 		bignum.c \
 		ctr_drbg.c \
+		asn1write.c \
+		asn1parse.c \
 )
 
 SRC_USERMOD += $(SRC_MBEDTLS) 
@@ -0,0 +1,287 @@
+"""
+Load simulator: many software keys running scripted flows.
+
+    python -m host.loadsim [--keys 200] [--processes 8] [--rounds 5] [--output load.json]
+
+Keys are spread across a multiprocessing pool. Each one has its own RAM
+storage and its own state held in RAM (see circuitkey.keystate), swapped
+in while it handles a flow. Reports go through
+hid.receive and ctaphid.process of a virtual HID device, the user confirms
+presence at once. In every round each key registers a new credential
+(MakeCredential) and authenticates with it (GetAssertion); the first round
+starts with CTAPHID_INIT. The keys of a process take turns, like requests
+to a single USB key, so concurrency comes from the number of processes.
+
+The report has the latency of each flow, the number of failed flows by
+status code and the throughput of all processes together.
+"""
+
+import asyncio
+import multiprocessing
+import os
+import struct
+import time
+
+import adafruit_logging
+import flynn
+
+from benchmarks import harness
+from benchmarks.replay import Device, reports
+import circuitkey.hid as hid
+import circuitkey.ui as ui
+from circuitkey import ctaphid, keystate
+from circuitkey.schema import (
+    CTAPHID_BROADCAST_CID,
+    COSE_ALG_ES256,
+    PUBLIC_KEY_CREDENTIAL_TYPE,
+    CborCmd,
+    CtaphidCmd,
+    GetAssertionParam,
+    MakeCredentialParam,
+)
+from circuitkey.storage_backend import RamBackend
+
+RP_ID = "example.com"
+
+FLOWS = ("init", "register", "authenticate")
+
+
+class FlowError(Exception):
+    def __init__(self, code: int, msg: str):
+        self.code = code
+        self.msg = msg
+
+    def __str__(self):
+        return "Flow error {}: {}".format(hex(self.code), self.msg)
+
+
+class SoftKey:
+    """
+    Software key with its own storage and RAM state.
+    """
+
+    def __init__(self, index: int):
+        self.index = index
+        self.state = None  # see circuitkey.keystate
+        self.cid = None
+
+    def activate(self) -> None:
+        if self.state is None:
+            keystate.reset(RamBackend())
+        else:
+            keystate.restore(self.state)
+
+    def deactivate(self) -> None:
+        self.state = keystate.save()
+
+
+def _message(packets: list) -> tuple:
+    """
+    Command and payload of the response sent in packets.
+    """
+    first = packets[0]
+    length = (first[5] << 8) + first[6]
+
+    payload = bytearray(first[7:])
+    for packet in packets[1:]:
+        payload += packet[5:]
+
+    return first[4], bytes(payload[:length])
+
+
+async def _request(device: Device, cid: bytes, cmd: int, payload: bytes) -> tuple:
+    device.sent.clear()
+    device.reports[:] = reports(cid, cmd, payload)
+
+    command = hid.receive()
+    await ctaphid.process(command.cid, command.cmd, command.payload)
+
+    return _message(device.sent)
+
+
+async def _cbor(device: Device, cid: bytes, cmd: CborCmd, req: dict) -> dict:
+    response, payload = await _request(
+        device, cid, CtaphidCmd.CBOR, struct.pack("<B", cmd) + flynn.dumps(req)
+    )
+
+    if response == CtaphidCmd.ERROR:
+        raise FlowError(payload[0], "CTAPHID error")
+    if payload[0] != 0:
+        raise FlowError(payload[0], "CBOR command %#x failed" % cmd)
+
+    return flynn.loads(payload[1:])
+
+
+async def init(device: Device, key: SoftKey) -> None:
+    nonce = os.urandom(8)
+    response, payload = await _request(
+        device, CTAPHID_BROADCAST_CID, CtaphidCmd.INIT, nonce
+    )
+
+    if response != CtaphidCmd.INIT or payload[:8] != nonce:
+        raise FlowError(payload[0], "CTAPHID_INIT failed")
+
+    key.cid = payload[8:12]
+
+
+async def register(device: Device, key: SoftKey) -> bytes:
+    """
+    New credential, returns its ID.
+    """
+    response = await _cbor(
+        device,
+        key.cid,
+        CborCmd.MAKE_CREDENTIAL,
+        {
+            MakeCredentialParam.CLIENT_DATA_HASH: os.urandom(32),
+            MakeCredentialParam.RP: {"id": RP_ID, "name": "Example"},
+            MakeCredentialParam.USER: {
+                "id": struct.pack(">I", key.index),
+                "name": "user%d" % key.index,
+            },
+            MakeCredentialParam.PUB_KEY_CRED_PARAMS: [
+                {"alg": COSE_ALG_ES256, "type": PUBLIC_KEY_CREDENTIAL_TYPE}
+            ],
+        },
+    )
+
+    # rpIdHash (32) | flags (1) | signCount (4) | AAGUID (16) | length (2) | ID
+    auth_data = response[0x02]
+    (length,) = struct.unpack_from(">H", auth_data, 53)
+    return auth_data[55 : 55 + length]
+
+
+async def authenticate(device: Device, key: SoftKey, credential_id: bytes) -> None:
+    await _cbor(
+        device,
+        key.cid,
+        CborCmd.GET_ASSERTION,
+        {
+            GetAssertionParam.RP_ID: RP_ID,
+            GetAssertionParam.CLIENT_DATA_HASH: os.urandom(32),
+            GetAssertionParam.ALLOW_LIST: [
+                {"id": credential_id, "type": PUBLIC_KEY_CREDENTIAL_TYPE}
+            ],
+        },
+    )
+
+
+async def _round(device: Device, key: SoftKey, latencies: dict) -> None:
+    started = time.monotonic_ns()
+
+    def lap(flow):
+        nonlocal started
+        now = time.monotonic_ns()
+        latencies[flow].append(now - started)
+        started = now
+
+    if key.cid is None:
+        await init(device, key)
+        lap("init")
+
+    credential_id = await register(device, key)
+    lap("register")
+
+    await authenticate(device, key, credential_id)
+    lap("authenticate")
+
+
+def _worker(task: tuple) -> dict:
+    """
+    Run rounds on keys first..first + count - 1, in a pool process.
+    """
+    first, count, rounds = task
+
+    device = Device()
+    hid.set_device(device)
+    ui.get_ui._ui = ui.UI(ui.PressedButton(), ui.LedScheduler(ui.SimulatedLed()))
+    for name, log in adafruit_logging.logger_cache.items():
+        if isinstance(name, str) and name.startswith("circuitkey"):
+            log.setLevel(adafruit_logging.WARNING)
+    loop = asyncio.new_event_loop()
+
+    keys = [SoftKey(index) for index in range(first, first + count)]
+    latencies = {flow: [] for flow in FLOWS}
+    errors = {}
+
+    try:
+        for _ in range(rounds):
+            for key in keys:
+                key.activate()
+                try:
+                    loop.run_until_complete(_round(device, key, latencies))
+                except FlowError as e:
+                    errors[e.code] = errors.get(e.code, 0) + 1
+                finally:
+                    key.deactivate()
+    finally:
+        loop.close()
+
+    return {"latencies": latencies, "errors": errors}
+
+
+def _tasks(keys: int, processes: int, rounds: int) -> list:
+    """
+    Keys split as evenly as possible: (first key, number of keys, rounds).
+    """
+    tasks = []
+    first = 0
+    for i in range(processes):
+        count = keys // processes + (1 if i < keys % processes else 0)
+        if count > 0:
+            tasks.append((first, count, rounds))
+        first += count
+    return tasks
+
+
+def run(keys: int = 200, processes: int = None, rounds: int = 5) -> dict:
+    processes = processes or os.cpu_count() or 1
+    tasks = _tasks(keys, processes, rounds)
+
+    started = time.monotonic_ns()
+    with multiprocessing.Pool(len(tasks)) as pool:
+        parts = pool.map(_worker, tasks)
+    elapsed = time.monotonic_ns() - started
+
+    latencies = {flow: [] for flow in FLOWS}
+    errors = {}
+    for part in parts:
+        for flow, samples in part["latencies"].items():
+            latencies[flow] += samples
+        for code, n in part["errors"].items():
+            errors[code] = errors.get(code, 0) + n
+
+    results = [harness.summarize(f, latencies[f]) for f in FLOWS if latencies[f]]
+    completed = len(latencies["authenticate"])
+
+    data = harness.report(
+        "loadsim",
+        results,
+        keys=keys,
+        processes=len(tasks),
+        rounds=rounds,
+        rounds_per_sec=completed * 1e9 / elapsed if elapsed > 0 else 0.0,
+    )
+    data["errors"] = {"%#x" % code: n for code, n in sorted(errors.items())}
+    return data
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--keys", type=int, default=200)
+    parser.add_argument("--processes", type=int, help="default: number of CPUs")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--output", help="write JSON report to file")
+    args = parser.parse_args(argv)
+
+    data = run(args.keys, args.processes, args.rounds)
+    harness.emit(data, args.output)
+    harness.print_table(data)
+
+    return 1 if data["errors"] else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,46 @@
+import sys
+from unittest.mock import MagicMock
+
+sys.modules.setdefault("usb_hid", MagicMock())
+
+import circuitkey.credential as credential
+import circuitkey.keystate as keystate
+import host.loadsim as loadsim
+
+
+def test_tasks_spread_keys():
+    assert loadsim._tasks(10, 3, 2) == [(0, 4, 2), (4, 3, 2), (7, 3, 2)]
+    assert loadsim._tasks(1, 4, 1) == [(0, 1, 1)]
+
+
+def test_keys_are_isolated():
+    saved = keystate.save()
+    a, b = loadsim.SoftKey(0), loadsim.SoftKey(1)
+
+    try:
+        a.activate()
+        keys_a = credential._master_keys()
+        a.deactivate()
+
+        b.activate()
+        keys_b = credential._master_keys()
+        b.deactivate()
+
+        a.activate()
+        assert credential._master_keys() is keys_a
+        a.deactivate()
+    finally:
+        keystate.restore(saved)
+
+    assert keys_a != keys_b
+
+
+def test_run_flows_in_pool():
+    data = loadsim.run(keys=4, processes=2, rounds=2)
+    results = {r["name"]: r for r in data["results"]}
+
+    assert data["errors"] == {}
+    assert data["meta"]["processes"] == 2
+    assert results["init"]["iterations"] == 4
+    assert results["register"]["iterations"] == 8
+    assert results["authenticate"]["iterations"] == 8
@@ -0,0 +1,111 @@
+"""
+Poll the performance counters of a key and print what changed.
+
+    python -m host.stats [--interval 5] [--count 0] [--reset]
+
+Counters are read with the vendor command CTAPHID_STATS, which needs
+python-fido2. The first poll prints all counters, later polls the increase
+since the previous one (mem_free_min is shown as its current value).
+"""
+
+import time
+
+import flynn
+
+from circuitkey.schema import CborCmd, CtaphidCmd, Error
+
+# counters which are not monotonic, shown as they are
+_GAUGES = ("mem_free_min",)
+
+_TABLES = {
+    "commands": {cmd.value: name for name, cmd in CtaphidCmd.__members__.items()},
+    "cbor_commands": {cmd.value: name for name, cmd in CborCmd.__members__.items()},
+    "errors": {error.value: name for name, error in Error.__members__.items()},
+}
+
+
+def flatten(data: dict) -> dict:
+    """
+    Counters with tables expanded to "<table>.<name>" keys.
+    """
+    flat = {}
+    for name, value in data.items():
+        if isinstance(value, dict):
+            names = _TABLES.get(name, {})
+            for key, count in value.items():
+                flat["%s.%s" % (name, names.get(key, "%#x" % key))] = count
+        else:
+            flat[name] = value
+    return flat
+
+
+def diff(previous: dict, current: dict) -> dict:
+    """
+    Counters of two flattened snapshots which have changed.
+    """
+    changes = {}
+    for name, value in current.items():
+        if name in _GAUGES:
+            if value != previous.get(name):
+                changes[name] = value
+        elif value != previous.get(name, 0):
+            changes[name] = value - previous.get(name, 0)
+    return changes
+
+
+def format_counters(counters: dict) -> str:
+    if not counters:
+        return "  (no changes)"
+
+    width = max(len(name) for name in counters)
+    return "\n".join(
+        "  %-*s %d" % (width, name, value) for name, value in sorted(counters.items())
+    )
+
+
+def fetch(device, reset: bool = False) -> dict:
+    return flynn.loads(device.call(CtaphidCmd.STATS, b"\x01" if reset else b""))
+
+
+def _open_device():
+    from fido2.hid import CtapHidDevice
+
+    device = next(CtapHidDevice.list_devices(), None)
+    if device is None:
+        raise RuntimeError("No FIDO device found")
+    return device
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--interval", type=float, default=5, help="seconds")
+    parser.add_argument("--count", type=int, default=0, help="polls, 0 is forever")
+    parser.add_argument("--reset", action="store_true", help="reset before polling")
+    args = parser.parse_args(argv)
+
+    device = _open_device()
+
+    if args.reset:
+        fetch(device, reset=True)
+
+    previous = None
+    polls = 0
+    while True:
+        current = flatten(fetch(device))
+        if previous is None:
+            print(format_counters(current))
+        else:
+            print(time.strftime("%H:%M:%S"))
+            print(format_counters(diff(previous, current)))
+        previous = current
+
+        polls += 1
+        if polls == args.count:
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
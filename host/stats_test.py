@@ -0,0 +1,42 @@
+from unittest.mock import MagicMock
+
+import flynn
+
+import host.stats as host_stats
+
+
+def test_flatten_names_table_entries():
+    flat = host_stats.flatten(
+        {"packets_in": 3, "commands": {0x10: 2, 0x55: 1}, "errors": {0x12: 1}}
+    )
+
+    assert flat == {
+        "packets_in": 3,
+        "commands.CBOR": 2,
+        "commands.0x55": 1,
+        "errors.INVALID_CBOR": 1,
+    }
+
+
+def test_diff():
+    previous = {"packets_in": 3, "mem_free_min": 9000, "commands.CBOR": 1}
+    current = {
+        "packets_in": 5,
+        "mem_free_min": 8000,
+        "commands.CBOR": 1,
+        "commands.PING": 2,
+    }
+
+    assert host_stats.diff(previous, current) == {
+        "packets_in": 2,
+        "mem_free_min": 8000,
+        "commands.PING": 2,
+    }
+
+
+def test_fetch():
+    device = MagicMock()
+    device.call.return_value = flynn.dumps({"packets_in": 1})
+
+    assert host_stats.fetch(device, reset=True) == {"packets_in": 1}
+    device.call.assert_called_once_with(0x42, b"\x01")
@@ -0,0 +1,154 @@
+"""
+Decode and render the trace buffer of a key.
+
+    python -m host.trace trace.bin
+    python -m host.trace --fetch [--clear] [--output trace.bin]
+
+--fetch reads the buffer from the first connected key with the vendor command
+CTAPHID_TRACE and needs python-fido2. Timestamps are shown in ms relative to
+the first event; dispatch_end lines show the time since the matching
+dispatch_start, crypto_end lines the time since crypto_start.
+"""
+
+import struct
+from collections import namedtuple
+
+from circuitkey import trace
+from circuitkey.schema import CtaphidCmd
+
+Event = namedtuple("Event", ("timestamp", "event", "arg", "cid"))
+
+
+def decode(data: bytes) -> list:
+    """
+    Events of a dump returned by CTAPHID_TRACE, oldest first.
+    """
+    if len(data) < trace.HEADER_SIZE:
+        raise ValueError("Trace dump too short: %d bytes" % len(data))
+
+    version, count, _ = struct.unpack_from(trace.HEADER_FORMAT, data)
+    if version != trace.VERSION:
+        raise ValueError("Unsupported trace version %d" % version)
+
+    if len(data) != trace.HEADER_SIZE + count * trace.ENTRY_SIZE:
+        raise ValueError("Trace dump has %d bytes for %d entries" % (len(data), count))
+
+    return [
+        Event(*struct.unpack_from(trace.ENTRY_FORMAT, data, offset))
+        for offset in range(trace.HEADER_SIZE, len(data), trace.ENTRY_SIZE)
+    ]
+
+
+def dropped(data: bytes) -> int:
+    """
+    Number of events overwritten before the dump was taken.
+    """
+    _, count, recorded = struct.unpack_from(trace.HEADER_FORMAT, data)
+    return recorded - count
+
+
+_COMMANDS = {cmd.value: name for name, cmd in CtaphidCmd.__members__.items()}
+
+
+def _command(cmd: int) -> str:
+    return _COMMANDS.get(cmd, "cmd %#x" % cmd)
+
+
+def _describe(event: Event) -> str:
+    if event.event in (trace.PACKET_IN, trace.PACKET_OUT):
+        # continuation packets have bit 7 set, see circuitkey.hid
+        if event.arg & 0x80:
+            return "seq %d" % (event.arg & 0x7F)
+        return _command(event.arg)
+
+    if event.event in (trace.DISPATCH_START, trace.DISPATCH_END):
+        return _command(event.arg)
+
+    if event.event in (trace.CRYPTO_START, trace.CRYPTO_END):
+        if event.arg < len(trace.CRYPTO_OPS):
+            return trace.CRYPTO_OPS[event.arg]
+        return "op %d" % event.arg
+
+    if event.event == trace.FLUSH:
+        return "%d buckets" % event.arg
+
+    return "arg %d" % event.arg
+
+
+def render(events: list) -> str:
+    """
+    Timeline with one line per event.
+    """
+    if not events:
+        return ""
+
+    lines = []
+    start = events[0].timestamp
+    open_since = {}  # (start event, CID, arg) -> timestamp
+
+    for event in events:
+        # timestamps are 32 bit us and wrap after ~71 minutes
+        relative = (event.timestamp - start) & 0xFFFFFFFF
+        name = trace.EVENT_NAMES.get(event.event, "event_%d" % event.event)
+        line = "%10.3f ms  %s  %-14s %s" % (
+            relative / 1000,
+            event.cid.hex(),
+            name,
+            _describe(event),
+        )
+
+        if event.event in (trace.DISPATCH_START, trace.CRYPTO_START):
+            open_since[(event.event, event.cid, event.arg)] = event.timestamp
+        elif event.event in (trace.DISPATCH_END, trace.CRYPTO_END):
+            began = open_since.pop((event.event - 1, event.cid, event.arg), None)
+            if began is not None:
+                line += "  (%.3f ms)" % (
+                    ((event.timestamp - began) & 0xFFFFFFFF) / 1000
+                )
+
+        lines.append(line)
+
+    return "\n".join(lines)
+
+
+def fetch(clear: bool = False) -> bytes:
+    from fido2.hid import CtapHidDevice
+
+    device = next(CtapHidDevice.list_devices(), None)
+    if device is None:
+        raise RuntimeError("No FIDO device found")
+
+    return device.call(CtaphidCmd.TRACE, b"\x01" if clear else b"")
+
+
+def main(argv=None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("dump", nargs="?", help="trace dump file")
+    parser.add_argument("--fetch", action="store_true", help="read from the key")
+    parser.add_argument("--clear", action="store_true", help="clear after --fetch")
+    parser.add_argument("--output", help="write the raw dump to file")
+    args = parser.parse_args(argv)
+
+    if args.fetch:
+        data = fetch(args.clear)
+    elif args.dump:
+        with open(args.dump, "rb") as f:
+            data = f.read()
+    else:
+        parser.error("either a dump file or --fetch is required")
+
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(data)
+
+    print(render(decode(data)))
+    if dropped(data):
+        print("(%d earlier events were overwritten)" % dropped(data))
+
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,64 @@
+import pytest
+
+import circuitkey.trace as trace
+import host.trace as host_trace
+
+CID = b"\x00\x00\x00\x01"
+
+
+@pytest.fixture(autouse=True)
+def empty_trace():
+    trace.clear()
+    yield
+    trace.clear()
+
+
+def test_decode_and_render():
+    trace.record(trace.PACKET_IN, CID, 0x10)
+    trace.record(trace.DISPATCH_START, CID, 0x10)
+    trace.record(trace.CRYPTO_START, None, 2)
+    trace.record(trace.CRYPTO_END, None, 2)
+    trace.record(trace.DISPATCH_END, CID, 0x10)
+    trace.record(trace.PACKET_OUT, CID, 0x80 | 1)
+
+    events = host_trace.decode(trace.dump())
+
+    assert [e.event for e in events] == [
+        trace.PACKET_IN,
+        trace.DISPATCH_START,
+        trace.CRYPTO_START,
+        trace.CRYPTO_END,
+        trace.DISPATCH_END,
+        trace.PACKET_OUT,
+    ]
+    assert events[0].cid == CID
+
+    lines = host_trace.render(events).splitlines()
+    assert len(lines) == 6
+    assert "packet_in" in lines[0] and "CBOR" in lines[0]
+    assert "ec_sign" in lines[3] and "ms)" in lines[3]
+    assert "dispatch_end" in lines[4] and "ms)" in lines[4]
+    assert "seq 1" in lines[5]
+
+
+def test_dropped():
+    for _ in range(trace.CAPACITY + 5):
+        trace.record(trace.FLUSH, None, 1)
+
+    assert host_trace.dropped(trace.dump()) == 5
+
+
+def test_decode_rejects_truncated_dump():
+    trace.record(trace.FLUSH, None, 1)
+
+    with pytest.raises(ValueError):
+        host_trace.decode(trace.dump()[:-1])
+
+
+def test_main_reads_dump_file(tmp_path, capsys):
+    trace.record(trace.FLUSH, None, 3)
+    dump = tmp_path / "trace.bin"
+    dump.write_bytes(trace.dump())
+
+    assert host_trace.main([str(dump)]) == 0
+    assert "flush" in capsys.readouterr().out
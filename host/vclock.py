@@ -0,0 +1,110 @@
+"""
+Virtual time for tests and simulations on CPython.
+
+The event loop never waits for a timer: when nothing is ready it advances
+the clock straight to the next scheduled callback. patch_time() makes
+time.monotonic and time.monotonic_ns read the same clock, so timeouts,
+keepalive cadence and uptime checks of circuitkey take no real time and
+give the same timings on every run:
+
+    with vclock.patch_time() as loop:
+        loop.run_until_complete(asyncio.sleep(30))  # returns at once
+        assert time.monotonic() == 30
+
+A test can also use the virtual_time fixture (see circuitkey/conftest.py).
+"""
+
+import asyncio
+import contextlib
+import math
+import selectors
+import time
+
+# real time to wait for I/O from other threads when no timer is scheduled
+IDLE_TIMEOUT = 5  # seconds
+
+
+class VirtualClock:
+    """
+    Monotonic clock which only moves when advanced, kept in nanoseconds.
+    """
+
+    def __init__(self, start: float = 0):
+        self._ns = math.ceil(start * 1e9)
+
+    def monotonic(self) -> float:
+        return self._ns / 1e9
+
+    def monotonic_ns(self) -> int:
+        return self._ns
+
+    def advance(self, seconds: float) -> None:
+        if seconds > 0:
+            # rounded up, so the clock reaches the timer it is advanced to
+            self._ns += math.ceil(seconds * 1e9)
+
+
+class _Selector:
+    """
+    Polls the real selector and advances the clock instead of waiting.
+    """
+
+    def __init__(self, selector: selectors.BaseSelector, clock: VirtualClock):
+        self._selector = selector
+        self._clock = clock
+
+    def select(self, timeout: float = None) -> list:
+        events = self._selector.select(0)
+        if events:
+            return events
+
+        if timeout is None:
+            # only another thread can wake the loop up
+            events = self._selector.select(IDLE_TIMEOUT)
+            if not events:
+                raise RuntimeError("Event loop is idle: no timer and no I/O")
+            return events
+
+        self._clock.advance(timeout)
+        return []
+
+    def __getattr__(self, name: str):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    def __init__(self, clock: VirtualClock = None):
+        self.clock = clock or VirtualClock()
+        super().__init__(_Selector(selectors.DefaultSelector(), self.clock))
+        self._clock_resolution = 1e-9
+
+    def time(self) -> float:
+        return self.clock.monotonic()
+
+
+@contextlib.contextmanager
+def patch_time(loop: VirtualTimeLoop = None):
+    """
+    New (or the given) virtual time loop, with time.monotonic and
+    time.monotonic_ns reading its clock. Tasks still pending at the end are
+    cancelled and the loop is closed.
+    """
+    loop = loop or VirtualTimeLoop()
+    saved = time.monotonic, time.monotonic_ns
+
+    time.monotonic = loop.clock.monotonic
+    time.monotonic_ns = loop.clock.monotonic_ns
+    try:
+        yield loop
+        _cancel_pending(loop)
+    finally:
+        time.monotonic, time.monotonic_ns = saved
+        loop.close()
+
+
+def _cancel_pending(loop: VirtualTimeLoop) -> None:
+    pending = asyncio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    if pending:
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+
+from host import vclock
+
+
+def test_sleep_takes_no_real_time():
+    start = time.perf_counter()
+
+    with vclock.patch_time() as loop:
+        loop.run_until_complete(asyncio.sleep(3600))
+
+        assert time.monotonic() == 3600
+        assert time.monotonic_ns() == 3600 * 10**9
+
+    assert time.perf_counter() - start < 1
+
+
+def test_timers_fire_in_order():
+    fired = []
+
+    async def after(delay, name):
+        await asyncio.sleep(delay)
+        fired.append((name, time.monotonic_ns()))
+
+    async def main():
+        await asyncio.gather(after(0.3, "c"), after(0.1, "a"), after(0.2, "b"))
+
+    with vclock.patch_time() as loop:
+        loop.run_until_complete(main())
+
+    assert fired == [("a", 10**8), ("b", 2 * 10**8), ("c", 3 * 10**8)]
+
+
+def test_wait_for_times_out_at_deadline():
+    with vclock.patch_time() as loop:
+        with pytest.raises(asyncio.TimeoutError):
+            loop.run_until_complete(asyncio.wait_for(asyncio.Event().wait(), 30))
+
+        assert time.monotonic() == 30
+
+
+def test_time_is_restored_and_pending_tasks_cancelled():
+    monotonic = time.monotonic
+
+    with vclock.patch_time() as loop:
+        task = loop.create_task(asyncio.sleep(60))
+        loop.run_until_complete(asyncio.sleep(1))
+
+    assert task.cancelled()
+    assert time.monotonic is monotonic
+
+
+def test_idle_loop_raises(monkeypatch):
+    monkeypatch.setattr(vclock, "IDLE_TIMEOUT", 0)
+
+    with vclock.patch_time() as loop:
+        with pytest.raises(RuntimeError):
+            loop.run_until_complete(asyncio.Event().wait())
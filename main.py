@@ -1,6 +1,6 @@
 import asyncio
 import adafruit_logging as logging
-from circuitkey import ctaphid
+from circuitkey import ctaphid, stats, warmup
 from circuitkey.error import AbortError, CtapError
 
 import circuitkey.hid as hid
@@ -23,9 +23,13 @@ async def main():
     # Say hello to the user
     await user_interface.wink()
 
+    await warmup.run()
+
     log.info("Device is ready")
 
     while True:
+        stats.tick()
+
         try:
             await asyncio.sleep(0)
             data = hid.receive(hdev)